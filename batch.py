@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import argparse
+from array import array
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+
+from isa import MAX_MEMORY, decode_code, hex_to_data, read_code
+from machine import DEFAULT_LIMIT, ENGINES, TraceLevel, read_input, simulation
+
+BatchResult = tuple[int, str, int, int]
+
+worker_options: dict = {}
+
+
+def init_worker(options: dict) -> None:
+    # the program is decoded once per process, every job of the process runs the same commands and words
+    worker_options.update(options)
+    worker_options["code_memory"] = decode_code(options["code_memory"])
+    worker_options["data_memory"] = array("q", map(hex_to_data, options["data_memory"]))
+
+
+def run_chunk(jobs: list[tuple[int, list]]) -> list[BatchResult]:
+    results: list[BatchResult] = []
+
+    for index, input_tokens in jobs:
+        output, instr_counter, ticks = simulation(input_tokens=input_tokens, trace=TraceLevel.off, **worker_options)
+        results.append((index, output, instr_counter, ticks))
+
+    return results
+
+
+def chunked(jobs: Iterable[tuple[int, list]], chunk_size: int) -> Iterator[list[tuple[int, list]]]:
+    iterator = iter(jobs)
+    while chunk := list(islice(iterator, chunk_size)):
+        yield chunk
+
+
+def run_batch(
+    codes_file,
+    datas_file,
+    input_schedules: Iterable[list],
+    workers=None,
+    chunk_size=1,
+    limit=DEFAULT_LIMIT,
+    engine="threaded",
+    memory_size=MAX_MEMORY,
+) -> Iterator[BatchResult]:
+    start_addr, code = read_code(codes_file)
+    _, data = read_code(datas_file)
+    options = {
+        "data_memory": data,
+        "code_memory": code,
+        "memory_size": memory_size,
+        "limit": limit,
+        "start_addr": start_addr,
+        "engine": engine,
+    }
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(options,)) as executor:
+        futures = [executor.submit(run_chunk, chunk) for chunk in chunked(enumerate(input_schedules), chunk_size)]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def main(
+    codes_file,
+    datas_file,
+    inputs_files,
+    workers=None,
+    chunk_size=1,
+    limit=DEFAULT_LIMIT,
+    engine="threaded",
+    memory_size=MAX_MEMORY,
+):
+    schedules = (list(read_input(inputs_file)) for inputs_file in inputs_files)
+
+    for index, output, instr_counter, ticks in run_batch(
+        codes_file,
+        datas_file,
+        schedules,
+        workers=workers,
+        chunk_size=chunk_size,
+        limit=limit,
+        engine=engine,
+        memory_size=memory_size,
+    ):
+        print(inputs_files[index], repr(output), "instr_counter:", instr_counter, "ticks:", ticks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate one translated program over many input files")
+    parser.add_argument("code_file")
+    parser.add_argument("data_file")
+    parser.add_argument("input_files", nargs="+")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--memory-size", type=int, default=MAX_MEMORY)
+    parser.add_argument("--engine", choices=list(ENGINES), default="threaded")
+    args = parser.parse_args()
+    main(
+        args.code_file,
+        args.data_file,
+        args.input_files,
+        args.workers,
+        args.chunk_size,
+        args.limit,
+        args.engine,
+        args.memory_size,
+    )
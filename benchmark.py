@@ -0,0 +1,259 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+
+from isa import MAX_MEMORY, read_code, read_object, write_code, write_object
+from machine import ENGINES, TraceLevel, read_input, simulation
+from translator import assemble, clean_text, translate
+
+EXAMPLES_DIR = "example"
+EXAMPLE_LIMIT = 20000
+TRANSLATOR_SIZES = (1000, 10000, 100000)
+
+
+class Case:
+    def __init__(self, name: str, text: str, data: str, input_tokens: list, limit: int):
+        self.name = name
+        self.text = text
+        self.data = data
+        self.input_tokens = input_tokens
+        self.limit = limit
+
+
+def read_file(filename: str) -> str:
+    with open(filename, encoding="utf-8") as file:
+        return file.read()
+
+
+def example_cases(examples_dir: str = EXAMPLES_DIR) -> list[Case]:
+    cases = []
+    for path in sorted(Path(examples_dir, "text").glob("*.text")):
+        name = path.stem
+        cases.append(
+            Case(
+                name,
+                read_file(str(path)),
+                read_file(os.path.join(examples_dir, "data", name + ".data")),
+                list(read_input(os.path.join(examples_dir, "input", name + ".txt"))),
+                EXAMPLE_LIMIT,
+            )
+        )
+    return cases
+
+
+def scaled_cases(scale: int, examples_dir: str = EXAMPLES_DIR) -> list[Case]:
+    def source(name: str, kind: str) -> str:
+        return read_file(os.path.join(examples_dir, kind, f"{name}.{kind}"))
+
+    # prob1 reads its upper bound from the input port, one loop iteration is at most 11 instructions
+    bound = 1000 * scale
+    prob1 = Case(f"prob1_x{scale}", source("prob1", "text"), source("prob1", "data"), [(1, bound)], 16 * bound + 1000)
+
+    # cat echoes every character, the idle loop spins for the 50 ticks between arrivals
+    length = 1000 * scale
+    text = [(50 * (i + 1), chr(ord("a") + i % 26)) for i in range(length)] + [(50 * (length + 1), "\n")]
+    cat = Case(f"cat_x{scale}", source("cat", "text"), source("cat", "data"), text, 50 * (length + 2))
+
+    return [prob1, cat]
+
+
+def generate_program(lines: int) -> str:
+    # every block is 8 source lines and exercises each operand form the translator accepts
+    blocks = max(1, lines // 8)
+    data = ["section .data", "    Counter: 0 ; loop counter", '    Text: "Hello, world!"', "    Buffer: buf 4 -1"]
+    text = ["section .text"]
+    for block in range(blocks):
+        data.append(f"    Var{block}: {block}")
+        text += [
+            f"    .block{block}: mov %rax #Var{block}",
+            f"\tadd #Counter -{block}   ; negative constant",
+            f"        cmp *Var{block} Buffer[{block % 4}]",
+            f"        jz .block{(block + 1) % blocks}",
+            "        movo !1 #Text Text[1] Text[2]",
+            "",
+            f"        jmp .block{block}",
+        ]
+    text.append("    .exit: hlt")
+    return "\n".join(data + text)
+
+
+def translator_scaling(sizes: tuple[int, ...], repeat: int) -> list[dict]:
+    results = []
+    for lines in sizes:
+        source = generate_program(lines)
+        assemble_seconds = best_time(lambda: assemble(source), repeat)
+        legacy_seconds = best_time(lambda: translate(clean_text(source)), repeat)
+        results.append(
+            {
+                "source_lines": len(source.splitlines()),
+                "assemble_seconds": assemble_seconds,
+                "legacy_seconds": legacy_seconds,
+                "assemble_lines_per_second": len(source.splitlines()) / assemble_seconds,
+                "speedup": legacy_seconds / assemble_seconds,
+            }
+        )
+    return results
+
+
+def best_time(function: Callable[[], object], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(function: Callable[[], object]) -> int:
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_engine(case: Case, code: list, data: list, start_addr: int, engine: str, repeat: int) -> dict:
+    def run():
+        return simulation(
+            data, code, list(case.input_tokens), MAX_MEMORY, case.limit, start_addr, engine=engine, trace=TraceLevel.off
+        )
+
+    output, instr_counter, ticks = run()
+    seconds = best_time(run, repeat)
+    return {
+        "seconds": seconds,
+        "instructions": instr_counter,
+        "ticks": ticks,
+        "instructions_per_second": instr_counter / seconds,
+        "ticks_per_second": ticks / seconds,
+        "peak_memory_bytes": peak_memory(run),
+        "output_length": len(output),
+    }
+
+
+def bench_case(case: Case, engines: list[str], repeat: int) -> dict:
+    source = case.data + "\n" + case.text
+    data_words, code_words = assemble(source)
+
+    with tempfile.TemporaryDirectory() as tmp_dir_name:
+        code_file = os.path.join(tmp_dir_name, "code.txt")
+        data_file = os.path.join(tmp_dir_name, "data.txt")
+        object_file = os.path.join(tmp_dir_name, "program.o")
+        write_code(code_words, code_file)
+        write_code(data_words, data_file)
+        write_object(code_words, data_words, object_file)
+
+        start_addr, code = read_code(code_file)
+        _, data = read_code(data_file)
+        result = {
+            "name": case.name,
+            "source_lines": len(source.splitlines()),
+            "code_words": len(code_words),
+            "input_tokens": len(case.input_tokens),
+            "translate_seconds": best_time(lambda: assemble(source), repeat),
+            "load_text_seconds": best_time(lambda: (read_code(code_file), read_code(data_file)), repeat),
+            "load_object_seconds": best_time(lambda: read_object(object_file), repeat),
+        }
+
+    result["engines"] = {engine: bench_engine(case, code, data, start_addr, engine, repeat) for engine in engines}
+    return result
+
+
+def peephole_savings(case: Case) -> dict:
+    source = case.data + "\n" + case.text
+
+    def run(optimize: bool) -> tuple[dict, str]:
+        data_words, code_words = assemble(source, optimize)
+        output, instr_counter, ticks = simulation(
+            [format(word.word, "020x") for word in data_words],
+            [format(word.word, "020x") for word in code_words],
+            list(case.input_tokens),
+            MAX_MEMORY,
+            case.limit,
+            0,
+            engine="threaded",
+            trace=TraceLevel.off,
+        )
+        return {"code_words": len(code_words), "instructions": instr_counter, "ticks": ticks}, output
+
+    (before, output), (after, optimized_output) = run(False), run(True)
+    return {
+        "name": case.name,
+        **before,
+        **{f"optimized_{key}": value for key, value in after.items()},
+        "tick_savings": before["ticks"] - after["ticks"],
+        "same_output": output == optimized_output,
+    }
+
+
+def run_benchmark(
+    scale: int = 10, repeat: int = 3, engines: list[str] | None = None, translator_sizes=TRANSLATOR_SIZES
+) -> dict:
+    engines = engines or list(ENGINES)
+    cases = example_cases() + (scaled_cases(scale) if scale > 0 else [])
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": scale,
+        "repeat": repeat,
+        "cases": [bench_case(case, engines, repeat) for case in cases],
+        "translator": translator_scaling(translator_sizes, repeat),
+        "peephole": [peephole_savings(case) for case in cases],
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    previous = {
+        (case["name"], engine): run["instructions_per_second"]
+        for case in baseline["cases"]
+        for engine, run in case["engines"].items()
+    }
+    regressions = []
+    for case in current["cases"]:
+        for engine, run in case["engines"].items():
+            before = previous.get((case["name"], engine))
+            if before is not None and run["instructions_per_second"] < before * (1 - tolerance):
+                regressions.append(
+                    f"{case['name']} {engine}: {run['instructions_per_second']:.0f} < {before:.0f} instr/s"
+                )
+    return regressions
+
+
+def main(scale=10, repeat=3, engines=None, output=None, baseline=None, tolerance=0.1):
+    report = run_benchmark(scale, repeat, engines)
+    text = json.dumps(report, indent=2)
+    if output is None:
+        print(text)
+    else:
+        with open(output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+
+    if baseline is not None:
+        with open(baseline, encoding="utf-8") as file:
+            regressions = compare(json.load(file), report, tolerance)
+        for regression in regressions:
+            print("regression:", regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure translator and machine throughput on the example programs")
+    parser.add_argument("--scale", type=int, default=10, help="size of the generated prob1/cat variants, 0 to skip")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--engine", action="append", choices=list(ENGINES), dest="engines")
+    parser.add_argument("--output", help="write the JSON report to a file instead of stdout")
+    parser.add_argument("--baseline", help="JSON report to compare instructions per second against")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+    main(args.scale, args.repeat, args.engines, args.output, args.baseline, args.tolerance)
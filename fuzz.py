@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import random
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Final
+
+from isa import Command, Commands, alu_commands, branch_commands, data_to_hex, op_commands, registers, zero_op_commands
+from machine import (
+    ENGINES,
+    BlockControlUnit,
+    DataPath,
+    InputSchedule,
+    Port,
+    TraceLevel,
+    make_control_unit,
+)
+
+MEMORY_SIZE: Final = 64
+PROGRAM_LENGTH: Final = 16
+FUZZ_LIMIT: Final = 2000
+CHUNK_SIZE: Final = 50
+INT_VECTOR: Final = 1
+BIG_VALUES: Final = (1 << 31) - 1, -(1 << 31), 1 << 30, -(1 << 30)
+
+# an engine run as (name, idle_skip); the reference engine is always the first run
+Variant = tuple[str, bool]
+# output, instr_counter, ticks, halted, registers, flags, data memory; or the error raised and the output before it
+Outcome = tuple
+
+
+class FuzzCase:
+    def __init__(self, seed: int, code: list[str], data: list[int], input_tokens: list, limit: int = FUZZ_LIMIT):
+        self.seed = seed
+        self.code = code
+        self.data = data
+        self.input_tokens = input_tokens
+        self.limit = limit
+
+    def listing(self) -> list[str]:
+        return [f"{addr} {Command(word)}" for addr, word in enumerate(self.code)]
+
+    def to_json(self) -> dict:
+        return {
+            "seed": self.seed,
+            "code": self.code,
+            "data": self.data,
+            "input": self.input_tokens,
+            "limit": self.limit,
+            "listing": self.listing(),
+        }
+
+    @classmethod
+    def from_json(cls, case: dict) -> FuzzCase:
+        return cls(case["seed"], case["code"], case["data"], [tuple(token) for token in case["input"]], case["limit"])
+
+
+def random_value(rng: random.Random) -> int:
+    # mostly small values, which are also valid addresses, and some at the edges of the word
+    return rng.choice(BIG_VALUES) if rng.random() < 0.1 else rng.randrange(-4, MEMORY_SIZE)
+
+
+def random_operand(rng: random.Random, types: tuple[int, ...]) -> tuple[int, int]:
+    arg_type = rng.choice(types)
+    if arg_type == 0:
+        return arg_type, random_value(rng)
+    if arg_type == 1:
+        # rip and rst are rare: writing them jumps and raises interrupts at random
+        return arg_type, rng.choices(range(len(registers)), weights=(6, 6, 6, 1, 1, 2))[0]
+    if arg_type == 3:
+        return arg_type, 0
+    return arg_type, rng.randrange(MEMORY_SIZE)
+
+
+def random_instruction(rng: random.Random, length: int) -> Command:
+    opcode = rng.choices(op_commands, weights=[1 if opcode in zero_op_commands else 4 for opcode in op_commands])[0]
+    if opcode in branch_commands:
+        target = rng.randrange(-1, length)
+        return Command.from_fields(op_commands.index(opcode), 0, target, 0, 0)
+    if opcode == Commands.movi:
+        return Command.from_fields(op_commands.index(opcode), 2, rng.randrange(MEMORY_SIZE), 3, 0)
+    if opcode == Commands.movo:
+        arg2 = random_operand(rng, (0, 1, 2, 4))
+        return Command.from_fields(op_commands.index(opcode), 3, 1, *arg2)
+    if opcode in alu_commands or opcode == Commands.mov:
+        arg1 = random_operand(rng, (1, 1, 2, 4, 0))
+        arg2 = random_operand(rng, (0, 1, 2, 4))
+        if opcode in (Commands.div, Commands.mod) and rng.random() < 0.8:
+            # keep most divisions from stopping the program
+            arg2 = 0, rng.choice((-3, 2, 7, 10))
+        if opcode == Commands.mul and arg1[0] == 1:
+            # registers are not cut to a word, repeated squaring in a loop would grow without bound
+            arg1 = random_operand(rng, (2, 4))
+        return Command.from_fields(op_commands.index(opcode), *arg1, *arg2)
+    return Command.from_fields(op_commands.index(opcode), 0, 0, 0, 0)
+
+
+def random_case(seed: int, length: int = PROGRAM_LENGTH, limit: int = FUZZ_LIMIT) -> FuzzCase:
+    rng = random.Random(seed)
+    code = [random_instruction(rng, length).hex_string for _ in range(length - 1)]
+    code.append(Command.from_fields(op_commands.index(Commands.hlt), 0, 0, 0, 0).hex_string)
+    data = [random_value(rng) for _ in range(MEMORY_SIZE // 2)]
+    data[INT_VECTOR] = rng.randrange(length)
+    tick = 0
+    input_tokens: list = []
+    for _ in range(rng.randrange(8)):
+        tick += rng.randrange(1, 60)
+        input_tokens.append((tick, rng.choice("ab\n") if rng.random() < 0.7 else rng.randrange(-9, 100)))
+    return FuzzCase(seed, code, data, input_tokens, limit)
+
+
+def run_case(case: FuzzCase, engine: str = "reference", idle_skip: bool = True, hot_block: int = 1) -> Outcome:
+    output: list[str] = []
+    ports: dict[int, Port] = {0: InputSchedule(case.input_tokens), 1: output}
+    data_path = DataPath([data_to_hex(value) for value in case.data], MEMORY_SIZE, ports, 0)
+    control_unit = make_control_unit(engine, data_path, case.limit, case.code, MEMORY_SIZE, TraceLevel.off, idle_skip)
+    if isinstance(control_unit, BlockControlUnit):
+        # blocks are compiled on first entry, so short random programs exercise them
+        control_unit.hot_block = hot_block
+    try:
+        control_unit.command_cycle()
+    except (ArithmeticError, IndexError, KeyError, ValueError) as error:
+        # after a crash only the error and the output are defined, the counters stop mid-instruction
+        return "error", type(error).__name__, "".join(output)
+    return (
+        "".join(output),
+        control_unit.instr_counter,
+        control_unit.current_tick(),
+        control_unit.halted,
+        dict(data_path.reg),
+        str(data_path.alu),
+        data_path.memory.dump(),
+    )
+
+
+def default_variants() -> list[Variant]:
+    return [(engine, idle_skip) for engine in ENGINES if engine != "reference" for idle_skip in (True, False)]
+
+
+def find_mismatch(case: FuzzCase, variants: list[Variant]) -> str | None:
+    expected = run_case(case, idle_skip=False)
+    for engine, idle_skip in variants:
+        actual = run_case(case, engine, idle_skip)
+        if actual != expected:
+            fields = [index for index, (left, right) in enumerate(zip(expected, actual)) if left != right]
+            return f"{engine} (idle_skip={idle_skip}) differs in fields {fields}: {actual} != {expected}"
+    return None
+
+
+def without(code: list[str], addr: int) -> list[str]:
+    # drops one instruction, branches behind it move along
+    result = []
+    for word in code[:addr] + code[addr + 1 :]:
+        command = Command(word)
+        if command.opcode in branch_commands and command.arg1_value > addr:
+            word = Command.from_fields(*command.fields()[:2], command.arg1_value - 1, 0, 0).hex_string
+        result.append(word)
+    return result
+
+
+def shrunk(case: FuzzCase) -> Iterator[FuzzCase]:
+    # smaller candidates first: shorter limit, fewer instructions or nops, fewer inputs, zeroed data
+    for limit in (case.limit // 2, case.limit - 1):
+        if limit > 0:
+            yield FuzzCase(case.seed, case.code, case.data, case.input_tokens, limit)
+    nop = Command.from_fields(0, 0, 0, 0, 0).hex_string
+    for addr in reversed(range(len(case.code))):
+        yield FuzzCase(case.seed, without(case.code, addr), case.data, case.input_tokens, case.limit)
+        if case.code[addr] != nop:
+            code = [*case.code[:addr], nop, *case.code[addr + 1 :]]
+            yield FuzzCase(case.seed, code, case.data, case.input_tokens, case.limit)
+    for index in range(len(case.input_tokens)):
+        tokens = case.input_tokens[:index] + case.input_tokens[index + 1 :]
+        yield FuzzCase(case.seed, case.code, case.data, tokens, case.limit)
+    if case.data and not case.data[-1]:
+        yield FuzzCase(case.seed, case.code, case.data[:-1], case.input_tokens, case.limit)
+    for addr, value in enumerate(case.data):
+        if value:
+            data = [*case.data[:addr], 0, *case.data[addr + 1 :]]
+            yield FuzzCase(case.seed, case.code, data, case.input_tokens, case.limit)
+
+
+def minimize(case: FuzzCase, variants: list[Variant]) -> FuzzCase:
+    # greedy: take the first smaller case that still fails and start over, until none does
+    while True:
+        for candidate in shrunk(case):
+            if find_mismatch(candidate, variants) is not None:
+                case = candidate
+                break
+        else:
+            return case
+
+
+def check_seeds(seeds: list[int], variants: list[Variant], length: int, limit: int) -> list[tuple[dict, str]]:
+    failures = []
+    for seed in seeds:
+        case = random_case(seed, length, limit)
+        if find_mismatch(case, variants) is not None:
+            case = minimize(case, variants)
+            mismatch = find_mismatch(case, variants)
+            assert mismatch is not None
+            failures.append((case.to_json(), mismatch))
+    return failures
+
+
+def init_worker() -> None:
+    # limit and empty input warnings of thousands of runs say nothing here
+    logging.disable(logging.WARNING)
+
+
+def run_fuzz(
+    count, seed=0, variants=None, length=PROGRAM_LENGTH, limit=FUZZ_LIMIT, workers=None, chunk_size=CHUNK_SIZE
+) -> Iterator[tuple[dict, str]]:
+    variants = variants or default_variants()
+    seeds = list(range(seed, seed + count))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        futures = [
+            executor.submit(check_seeds, seeds[start : start + chunk_size], variants, length, limit)
+            for start in range(0, len(seeds), chunk_size)
+        ]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def main(count, seed=0, engines=None, **options) -> int:
+    variants = [(engine, idle_skip) for engine in engines for idle_skip in (True, False)] if engines else None
+    failures = 0
+    for case, mismatch in run_fuzz(count, seed, variants, **options):
+        failures += 1
+        print(json.dumps({**case, "mismatch": mismatch}))
+    print(f"{count} programs, {failures} mismatches")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare execution engines with the reference on random programs")
+    parser.add_argument("--count", type=int, default=1000, help="number of random programs")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first program, the rest follow it")
+    parser.add_argument("--engine", action="append", choices=[engine for engine in ENGINES if engine != "reference"])
+    parser.add_argument("--length", type=int, default=PROGRAM_LENGTH, help="instructions per program")
+    parser.add_argument("--limit", type=int, default=FUZZ_LIMIT)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+    failed = main(
+        args.count,
+        args.seed,
+        args.engine,
+        length=args.length,
+        limit=args.limit,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+    )
+    raise SystemExit(1 if failed else 0)
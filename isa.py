@@ -1,6 +1,11 @@
 from __future__ import annotations
 
+import mmap
 import re
+import struct
+import sys
+from array import array
+from collections.abc import Iterator, Sequence
 from enum import Enum
 from typing import Final
 
@@ -68,16 +73,39 @@ SECTION_TEXT: Final = "section .text"
 SECTION_DATA: Final = "section .data"
 MAX_NUM: Final = 1 << 31
 MAX_MEMORY: Final = 1 << 11
+WORD_MASK: Final = (1 << 32) - 1
+
+OBJECT_MAGIC: Final = b"CSA3"
+OBJECT_VERSION: Final = 2
+# magic, version, reserved, entry point, code size (words), data size (words)
+OBJECT_HEADER: Final = struct.Struct("<4sHHIII")
+# command type, arg1 type, arg2 type, padding, arg1 value, arg2 value
+OBJECT_CODE_WORD: Final = struct.Struct("<BBBxii")
+OBJECT_DATA_WORD: Final = struct.Struct("<i")
+
+CommandFields = tuple[int, int, int, int, int]
 
 
 class Instruction:
+    __slots__ = ("address", "mnemonic", "word")
+
     def __init__(self, address: int, binary_code: str, mnemonic: str):
         self.address = address
-        self.binary_code = binary_code
+        self.word = int(binary_code, 2)
         self.mnemonic = mnemonic
 
+    @classmethod
+    def from_word(cls, address: int, word: int, mnemonic: str):
+        instruction = cls.__new__(cls)
+        instruction.address, instruction.word, instruction.mnemonic = address, word, mnemonic
+        return instruction
+
+    @property
+    def binary_code(self) -> str:
+        return format(self.word, "080b")
+
     def __str__(self):
-        return f"{self.address} {binary_to_hex(self.binary_code)} {self.mnemonic}"
+        return f"{self.address} {self.word:020x} {self.mnemonic}"
 
 
 def get_type_address(addr_type: int, arg: int) -> str:
@@ -96,6 +124,19 @@ class Command:
     def __init__(self, hex_string):
         self.hex_string = hex_string
         self.command_type, self.arg1_type, self.arg1_value, self.arg2_type, self.arg2_value = parse_command(hex_string)
+        self.opcode = op_commands[self.command_type]
+
+    @classmethod
+    def from_fields(cls, command_type: int, arg1_type: int, arg1_value: int, arg2_type: int, arg2_value: int):
+        command = cls.__new__(cls)
+        command.hex_string = encode_command(command_type, arg1_type, arg1_value, arg2_type, arg2_value)
+        command.command_type, command.arg1_type, command.arg1_value = command_type, arg1_type, arg1_value
+        command.arg2_type, command.arg2_value = arg2_type, arg2_value
+        command.opcode = op_commands[command_type]
+        return command
+
+    def fields(self) -> CommandFields:
+        return self.command_type, self.arg1_type, self.arg1_value, self.arg2_type, self.arg2_value
 
     def __str__(self):
         if op_commands[self.command_type] in two_op_commands:
@@ -134,6 +175,22 @@ def get_data_line(line: int) -> str:
     return format(0, "012b") + int_to_binary(line) + format(0, "036b")
 
 
+def to_word(value: int) -> int:
+    value &= (MAX_NUM << 1) - 1
+    if value >= MAX_NUM:
+        value -= MAX_NUM << 1
+
+    return value
+
+
+def data_to_hex(value: int) -> str:
+    return format((value & ((MAX_NUM << 1) - 1)) << 36, "020x")
+
+
+def hex_to_data(hex_string: str) -> int:
+    return hex_to_integer(hex_string[3:11])
+
+
 def binary_to_integer(binary: str) -> int:
     if binary[0] == "1":
         complement = "".join(["1" if x == "0" else "0" for x in binary])
@@ -144,19 +201,47 @@ def binary_to_integer(binary: str) -> int:
     return integer
 
 
+def hex_to_integer(hex_string: str) -> int:
+    value = int(hex_string, 16)
+    if value >= MAX_NUM:
+        value -= MAX_NUM << 1
+
+    return value
+
+
 def parse_command(hex_string):
     command = hex_string[:2]
     data = hex_string[2:]
 
     command_type = int(command, 16)
     arg1_type = int(data[:1], 16)
-    arg1_value = binary_to_integer(format(int(data[1:9], 16), "032b"))
+    arg1_value = hex_to_integer(data[1:9])
     arg2_type = int(data[9:10], 16)
-    arg2_value = binary_to_integer(format(int(data[10:18], 16), "032b"))
+    arg2_value = hex_to_integer(data[10:18])
 
     return command_type, arg1_type, arg1_value, arg2_type, arg2_value
 
 
+def encode_command(command_type: int, arg1_type: int, arg1_value: int, arg2_type: int, arg2_value: int) -> str:
+    word = command_type << 72 | arg1_type << 68 | (arg1_value & WORD_MASK) << 36 | arg2_type << 32
+    return format(word | arg2_value & WORD_MASK, "020x")
+
+
+def decode_code(code: Sequence[str | Command]) -> list[Command]:
+    decoded: dict[str, Command] = {}
+    commands: list[Command] = []
+
+    for word in code:
+        if isinstance(word, Command):
+            commands.append(word)
+            continue
+        if word not in decoded:
+            decoded[word] = Command(word)
+        commands.append(decoded[word])
+
+    return commands
+
+
 def write_code(instructions: list[Instruction], source: str):
     with open(source, "w") as file:
         for instruction in instructions:
@@ -175,3 +260,52 @@ def read_code(filename: str):
     start_addr = 0
 
     return start_addr, instr
+
+
+# Command fields in the order of Command.fields(), stored in the order of OBJECT_CODE_WORD
+def pack_code_word(command_type: int, arg1_type: int, arg1_value: int, arg2_type: int, arg2_value: int) -> bytes:
+    return OBJECT_CODE_WORD.pack(command_type, arg1_type, arg2_type, arg1_value, arg2_value)
+
+
+def unpack_code_words(buffer) -> Iterator[CommandFields]:
+    for command_type, arg1_type, arg2_type, arg1_value, arg2_value in OBJECT_CODE_WORD.iter_unpack(buffer):
+        yield command_type, arg1_type, arg1_value, arg2_type, arg2_value
+
+
+def write_object(code: list[Instruction], data: list[Instruction], target: str, start_addr: int = 0):
+    with open(target, "wb") as file:
+        file.write(OBJECT_HEADER.pack(OBJECT_MAGIC, OBJECT_VERSION, 0, start_addr, len(code), len(data)))
+        for instruction in code:
+            file.write(pack_code_word(*parse_command(format(instruction.word, "020x"))))
+        for instruction in data:
+            file.write(OBJECT_DATA_WORD.pack(hex_to_data(format(instruction.word, "020x"))))
+
+
+def is_object(filename: str) -> bool:
+    with open(filename, "rb") as file:
+        return file.read(len(OBJECT_MAGIC)) == OBJECT_MAGIC
+
+
+def read_object(filename: str) -> tuple[int, list[Command], array[int]]:
+    with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        magic, version, _, start_addr, code_size, data_size = OBJECT_HEADER.unpack_from(buffer)
+        if magic != OBJECT_MAGIC or version != OBJECT_VERSION:
+            raise ValueError(filename)
+
+        code_end = OBJECT_HEADER.size + code_size * OBJECT_CODE_WORD.size
+        data_end = code_end + data_size * OBJECT_DATA_WORD.size
+        with memoryview(buffer) as view:
+            decoded: dict[CommandFields, Command] = {}
+            code: list[Command] = []
+            for fields in unpack_code_words(view[OBJECT_HEADER.size : code_end]):
+                if fields not in decoded:
+                    decoded[fields] = Command.from_fields(*fields)
+                code.append(decoded[fields])
+
+            data = array("i")
+            data.frombytes(view[code_end:data_end])
+
+    if sys.byteorder == "big":
+        data.byteswap()
+
+    return start_addr, code, data
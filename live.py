@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from collections.abc import AsyncIterable, Awaitable, Callable
+from typing import Final
+
+from isa import MAX_MEMORY
+from machine import (
+    DEFAULT_LIMIT,
+    ControlUnit,
+    DataPath,
+    InputSchedule,
+    InputToken,
+    OutputSink,
+    Port,
+    TraceLevel,
+    make_control_unit,
+    port_output,
+)
+
+LIVE_SLICE: Final = 1 << 12
+
+
+class LiveInput(InputSchedule):
+    # Input that arrives while the machine runs. Values fed during a slice are stamped with the tick at which the
+    # next slice starts, so the machine sees them at once and raises the interrupt as for a scheduled token.
+    def __init__(self) -> None:
+        super().__init__(())
+        self.fed: deque[str | int] = deque()
+        self.pending: deque[InputToken] = deque()
+        self.closed = False
+        self.arrived = asyncio.Event()
+
+    def feed(self, value: str | int) -> None:
+        # a string is split into characters, a number stays one token
+        self.fed.extend(value if isinstance(value, str) else [value])
+        self.arrived.set()
+
+    def close(self) -> None:
+        self.closed = True
+        self.arrived.set()
+
+    def deliver(self, tick: int) -> None:
+        self.pending.extend((tick, value) for value in self.fed)
+        self.fed.clear()
+        if self.head is None and self.pending:
+            self.head = self.pending.popleft()
+
+    def pop(self) -> InputToken:
+        token = super().pop()
+        self.head = self.pending.popleft() if self.pending else None
+        return token
+
+    def idle(self) -> bool:
+        # nothing to deliver now, but more may come
+        return not self.fed and not self.closed
+
+    async def pump(self, source: AsyncIterable[str | int]) -> None:
+        try:
+            async for value in source:
+                self.feed(value)
+        finally:
+            self.close()
+
+
+class AsyncSink(OutputSink):
+    # Collects the characters written during a slice; the run loop awaits `write` with them between slices.
+    def __init__(self, write: Callable[[str], Awaitable[object]]):
+        self.write = write
+        self.buffer: list[str] = []
+
+    def append(self, char: str) -> None:
+        self.buffer.append(char)
+
+    async def drain(self) -> None:
+        if self.buffer:
+            text = "".join(self.buffer)
+            self.buffer.clear()
+            await self.write(text)
+
+
+async def drain_ports(ports: dict[int, Port]) -> None:
+    for port in ports.values():
+        if isinstance(port, AsyncSink):
+            await port.drain()
+
+
+# Runs command_cycle in slices of slice_size instructions and gives the event loop a turn after each one. A
+# program parked in an idle loop waits for the input port instead of spinning, then goes on with the new input.
+async def run_live(control_unit: ControlUnit, slice_size: int = LIVE_SLICE) -> None:
+    data_path = control_unit.data_path
+    input_port = data_path.ports[0]
+    assert isinstance(input_port, LiveInput), "Port 0 should be a LiveInput"
+    try:
+        while not control_unit.finished():
+            input_port.deliver(control_unit.current_tick())
+            control_unit.command_cycle(control_unit.instr_counter + slice_size)
+            await drain_ports(data_path.ports)
+            if control_unit.waiting() and input_port.idle():
+                input_port.arrived.clear()
+                await input_port.arrived.wait()
+            else:
+                await asyncio.sleep(0)
+    finally:
+        data_path.flush_ports()
+        await drain_ports(data_path.ports)
+
+
+async def live_simulation(
+    data_memory,
+    code_memory,
+    source: AsyncIterable[str | int],
+    memory_size=MAX_MEMORY,
+    limit=DEFAULT_LIMIT,
+    start_addr=0,
+    engine="threaded",
+    trace=TraceLevel.off,
+    ports=None,
+    slice_size=LIVE_SLICE,
+):
+    # like simulation, but the input comes from `source` while the program runs
+    input_port = LiveInput()
+    ports = {0: input_port, 1: [], **(ports or {})}
+    data_path = DataPath(data_memory, memory_size, ports, start_addr)
+    control_unit = make_control_unit(engine, data_path, limit, code_memory, memory_size, trace)
+    feeder = asyncio.create_task(input_port.pump(source))
+    try:
+        await run_live(control_unit, slice_size)
+    finally:
+        feeder.cancel()
+    return port_output(ports[1]), control_unit.instr_counter, control_unit.current_tick()
@@ -1,24 +1,48 @@
 from __future__ import annotations
 
+import abc
+import argparse
+import ast
+import contextlib
+import io
+import itertools
+import json
 import logging
+import operator
+import os
+import re
+import struct
 import sys
-from typing import Callable
+import tempfile
+import zlib
+from array import array
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator, Mapping
+from enum import Enum
+from pathlib import Path
+from typing import BinaryIO, Final, TextIO, TypeVar
 
 from isa import (
     MAX_MEMORY,
     MAX_NUM,
     Command,
+    CommandFields,
     Commands,
     Registers,
     alu_commands,
-    binary_to_hex,
     branch_commands,
-    get_data_line,
+    data_to_hex,
+    decode_code,
+    hex_to_data,
     is_integer,
     op_commands,
+    pack_code_word,
     read_code,
+    read_object,
     registers,
+    to_word,
     two_op_commands,
+    unpack_code_words,
     zero_op_commands,
 )
 
@@ -34,6 +58,36 @@ ALU_OP_HANDLERS: dict[int, Callable[[int, int], int]] = {
     op_commands.index(Commands.cmp): lambda left, right: left - right,
 }
 
+ALU_OPERATORS: dict[Commands, Callable[[int, int], int]] = {
+    Commands.add: operator.add,
+    Commands.sub: operator.sub,
+    Commands.mod: operator.mod,
+    Commands.div: operator.floordiv,
+    Commands.mul: operator.mul,
+    Commands.xor: operator.xor,
+    Commands.and_: operator.and_,
+    Commands.or_: operator.or_,
+    Commands.cmp: operator.sub,
+}
+
+
+class TraceLevel(str, Enum):
+    off = "off"
+    summary = "summary"
+    full = "full"
+
+    def __str__(self) -> str:
+        return self.value
+
+
+def format_flags(n: int, z: int, of: int) -> str:
+    return f"N: {n} Z: {z} OF: {of}"
+
+
+def format_state(mode: str, tick: int, reg: Mapping[Registers, int], flags: str, command: object) -> str:
+    register_values = ", ".join(f"{name}: {value}" for name, value in reg.items())
+    return f"{mode}Tick: {tick} | Registers: {register_values} Flags: {flags} | Instruction: {command}"
+
 
 class ALU:
     def __init__(self):
@@ -42,7 +96,7 @@ class ALU:
         self.OF = 0
 
     def __str__(self):
-        return f"N: {self.N} Z: {self.Z} OF: {self.OF}"
+        return format_flags(self.N, self.Z, self.OF)
 
     def perform(self, op: int, left: int, right: int) -> int:
         handler = ALU_OP_HANDLERS[op]
@@ -66,16 +120,184 @@ class ALU:
         return value
 
 
+InputToken = tuple[int, str | int]
+T = TypeVar("T")
+
+RE_INPUT_TOKEN: Final = re.compile(
+    r"[\s,\[\]]*\(\s*(-?\d+)\s*,\s*"
+    r"(?:'([^'\\]*)'|\"([^\"\\]*)\"|('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|(-?\d+))\s*\)"
+)
+INPUT_SEPARATORS: Final = "[], \t\r\n"
+INPUT_CHUNK_SIZE: Final = 1 << 16
+DEFAULT_LIMIT: Final = 20000
+OUTPUT_BUFFER_SIZE: Final = 1 << 12
+
+
+class InputSchedule:
+    def __init__(self, tokens: Iterable[InputToken]):
+        self.tokens = iter(tokens)
+        self.head: InputToken | None = next(self.tokens, None)
+        self.consumed = 0
+
+    def __bool__(self) -> bool:
+        return self.head is not None
+
+    def ready(self, tick: int) -> bool:
+        return self.head is not None and self.head[0] <= tick
+
+    def pop(self) -> InputToken:
+        token = self.head
+        if token is None:
+            raise EOFError()
+        self.head = next(self.tokens, None)
+        self.consumed += 1
+        return token
+
+
+def parse_input_token(match: re.Match[str]) -> InputToken:
+    tick, single_quoted, double_quoted, escaped, number = match.groups()
+    if single_quoted is not None:
+        return int(tick), single_quoted
+    if double_quoted is not None:
+        return int(tick), double_quoted
+    if escaped is not None:
+        return int(tick), ast.literal_eval(escaped)
+    return int(tick), int(number)
+
+
+def check_input_gap(gap: str) -> None:
+    if gap.strip(INPUT_SEPARATORS):
+        raise ValueError(gap.strip(INPUT_SEPARATORS))
+
+
+def scan_input(file: TextIO, chunk_size=INPUT_CHUNK_SIZE) -> Iterator[InputToken]:
+    buffer = ""
+    while chunk := file.read(chunk_size):
+        buffer += chunk
+        end = 0
+        for match in RE_INPUT_TOKEN.finditer(buffer):
+            if match.start() != end:
+                check_input_gap(buffer[end : match.start()])
+            end = match.end()
+            yield parse_input_token(match)
+        buffer = buffer[end:]
+    check_input_gap(buffer)
+
+
+def read_input(inputs_file, chunk_size=INPUT_CHUNK_SIZE) -> Iterator[InputToken]:
+    with open(inputs_file, encoding="utf-8") as file:
+        yield from scan_input(file, chunk_size)
+
+
+def parse_input(text: str) -> list[InputToken]:
+    # the input file format given as a string
+    return list(scan_input(io.StringIO(text)))
+
+
+class OutputSink(abc.ABC):
+    # Receives the characters written to an output port. A plain list works as a sink too and keeps everything.
+    @abc.abstractmethod
+    def append(self, char: str) -> None: ...
+
+    def flush(self) -> None:
+        pass
+
+    def text(self) -> str:
+        # the part of the output still held in memory
+        return ""
+
+
+class WriterSink(OutputSink):
+    # Streams to a text file (or sys.stdout), holding at most buffer_size characters.
+    def __init__(self, file: TextIO, buffer_size: int = OUTPUT_BUFFER_SIZE):
+        self.file = file
+        self.buffer_size = buffer_size
+        self.buffer: list[str] = []
+
+    def append(self, char: str) -> None:
+        self.buffer.append(char)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self.file.write("".join(self.buffer))
+        self.file.flush()
+        self.buffer.clear()
+
+
+class BytesSink(OutputSink):
+    def __init__(self, encoding: str = "utf-8"):
+        self.data = bytearray()
+        self.encoding = encoding
+
+    def append(self, char: str) -> None:
+        self.data += char.encode(self.encoding)
+
+    def text(self) -> str:
+        return self.data.decode(self.encoding)
+
+
+class CallbackSink(OutputSink):
+    def __init__(self, callback: Callable[[str], object]):
+        self.callback = callback
+
+    def append(self, char: str) -> None:
+        self.callback(char)
+
+
+Port = InputSchedule | list[str] | OutputSink
+
+
+def port_output(port: Port) -> str:
+    assert not isinstance(port, InputSchedule), "Input port has no output"
+    return "".join(port) if isinstance(port, list) else port.text()
+
+
+class SparseMemory(dict[int, T]):
+    # Only words that were loaded or written are stored, a never written word reads as `default`, so the size of
+    # the address space costs nothing. Addresses follow list indexing: negative ones count from the end and
+    # anything else outside the memory raises IndexError.
+    def __init__(self, size: int, default: T, words: Iterable[T] | Mapping[int, T] = ()):
+        super().__init__(words if isinstance(words, Mapping) else enumerate(words))
+        assert len(self) <= size, "Memory size should be more"
+        self.size = size
+        self.default = default
+
+    def address(self, addr: int) -> int:
+        if 0 <= addr < self.size:
+            return addr
+        if -self.size <= addr < 0:
+            return addr + self.size
+        raise IndexError(addr)
+
+    def __missing__(self, addr: int) -> T:
+        return self.get(self.address(addr), self.default)
+
+    def __setitem__(self, addr: int, value: T) -> None:
+        if not 0 <= addr < self.size:
+            addr = self.address(addr)
+        dict.__setitem__(self, addr, value)
+
+    def dump(self) -> list[T]:
+        return [self.get(addr, self.default) for addr in range(self.size)]
+
+
 class DataPath:
-    memory: list[str]
-    alu: ALU = ALU()
-    ports: dict[int, list[str | tuple[int, str]]]
+    memory: SparseMemory[int]
+    alu: ALU
+    ports: dict[int, Port]
+    recorder: TraceRecorder | None = None
+    # where the trace of the run goes, the root logger unless a run collects it for itself
+    logger: logging.Logger = logging.getLogger()
 
     def __init__(self, data_memory, data_memory_size, ports, start_addr):
         assert data_memory_size > len(data_memory), "Data_memory size should be more"
         self.data_memory_size = data_memory_size
-        self.memory = data_memory + [format(0, "020x")] * (data_memory_size - len(data_memory))
+        words = data_memory if isinstance(data_memory, array) else map(hex_to_data, data_memory)
+        self.memory = SparseMemory(data_memory_size, 0, words)
+        self.alu = ALU()
         self.ports = ports
+        self.log_ports = True
         self.reg = {name: 0 for name in registers}
         self.set_reg(Registers.rip, start_addr)
         self.set_reg(Registers.rsp, data_memory_size - 1)
@@ -93,28 +315,48 @@ class DataPath:
     def reg_add(self, reg: Registers, val: int) -> None:
         self.reg[reg] += val
 
+    def dump_memory(self) -> list[str]:
+        return [data_to_hex(value) for value in self.memory.dump()]
+
     def wr(self, addr: int, value: int) -> None:
-        self.memory[addr] = binary_to_hex(get_data_line(value))
+        self.memory[addr] = to_word(value)
 
     def wr_port(self, port: int, val: int) -> None:
-        self.ports[port].append(chr(val))
-        logging.info(
-            "OUTPUT: "
-            + str(self.ports[port][:-1])
-            + " <- "
-            + (str(self.ports[port][-1]) if str(self.ports[port][-1]) != "\n" else "\\n")
-        )
+        output_port = self.ports[port]
+        assert not isinstance(output_port, InputSchedule), f"Port {port} is not an output port"
+        char = chr(val)
+        output_port.append(char)
+        if self.recorder is not None:
+            self.recorder.record_output(port, char, isinstance(output_port, list))
+        if self.log_ports:
+            written = output_port[:-1] if isinstance(output_port, list) else f"port {port}"
+            self.logger.info("OUTPUT: %s <- %s", written, char if char != "\n" else "\\n")
+
+    def flush_ports(self) -> None:
+        for port in self.ports.values():
+            if isinstance(port, OutputSink):
+                port.flush()
 
     def rd(self, reg: Registers, addr: int) -> None:
-        self.set_reg(reg, Command(self.memory[addr]).arg1_value)
+        self.set_reg(reg, self.memory[addr])
 
     def rd_port(self, port: int, addr: int) -> None:
-        if is_integer(str(self.ports[port][0][1])):
-            logging.info("INPUT: " + str(self.ports[port][0][1]))
-            self.memory[addr] = binary_to_hex(get_data_line(int(self.ports[port].pop(0)[1])))
+        input_port = self.ports[port]
+        assert isinstance(input_port, InputSchedule), f"Port {port} is not an input port"
+        if self.recorder is not None and not input_port:
+            # pop raises EOFError, command_cycle warns about it
+            self.recorder.record_event(TRACE_EOF)
+        _, token = input_port.pop()
+        if self.recorder is not None:
+            self.recorder.record_input(str(token))
+        if isinstance(token, int) or is_integer(token):
+            if self.log_ports:
+                self.logger.info("INPUT: %s", token)
+            self.memory[addr] = to_word(int(token))
         else:
-            logging.info("INPUT: " + (self.ports[port][0][1] if self.ports[port][0][1] != "\n" else "\\n"))
-            self.memory[addr] = binary_to_hex(get_data_line(ord(self.ports[port].pop(0)[1])))
+            if self.log_ports:
+                self.logger.info("INPUT: %s", token if token != "\n" else "\\n")
+            self.memory[addr] = to_word(ord(token))
 
     def latch_ip(self, prev_: str, value: int = -1):
         self.prev = prev_
@@ -129,32 +371,229 @@ class DataPath:
         if arg_type == 1:
             return self.get_reg(registers[val])
         if arg_type == 2:
-            return Command(self.memory[val]).arg1_value
+            return self.memory[val]
         if arg_type == 4:
-            return self.get_arg(2, Command(self.memory[val]).arg1_value)
+            return self.memory[self.memory[val]]
 
         return 0
 
+    def arg_reader(self, arg_type: int, val: int = 0) -> Callable[[], int]:
+        memory = self.memory
+        reg = self.reg
+        if arg_type == 0:
+            return lambda: val
+        if arg_type == 1:
+            name = registers[val]
+            return lambda: reg[name]
+        if arg_type == 2:
+            return lambda: memory[val]
+        if arg_type == 4:
+            return lambda: memory[memory[val]]
+
+        return lambda: 0
+
     def get_addr(self, arg_type: int, val: int) -> int:
         if arg_type == 2:
             return val
         if arg_type == 4:
-            return Command(self.memory[val]).arg1_value
+            return self.memory[val]
 
         return 0
 
 
-class ControlUnit:
-    memory: list[str]
+class Profile:
+    # Executions and ticks per code address; the instruction that halts the machine is counted with the ticks it
+    # took. Interrupt entries are not instructions and are counted on their own.
+    def __init__(self) -> None:
+        self.hits: Counter[int] = Counter()
+        self.ticks: Counter[int] = Counter()
+        # per handler counters of the threaded engine: address, ticks per execution, executions
+        self.counters: list[tuple[int, int, list[int]]] = []
+        self.interrupts = 0
+        self.interrupt_ticks = 0
+
+    def record(self, addr: int, ticks: int) -> None:
+        self.hits[addr] += 1
+        self.ticks[addr] += ticks
+
+    def record_interrupt(self, ticks: int) -> None:
+        self.interrupts += 1
+        self.interrupt_ticks += ticks
+
+    def counting(self, addr: int, cost: int, handler: Callable[[], Handled]) -> Callable[[], Handled]:
+        count = [0]
+        self.counters.append((addr, cost, count))
+
+        def counted():
+            count[0] += 1
+            return handler()
+
+        return counted
+
+    def collect(self) -> None:
+        for addr, cost, count in self.counters:
+            self.hits[addr] += count[0]
+            self.ticks[addr] += count[0] * cost
+        # a compiled block shares one counter between all its addresses
+        for _, _, count in self.counters:
+            count[0] = 0
+
+    def total_ticks(self) -> int:
+        return sum(self.ticks.values()) + self.interrupt_ticks
+
+
+TRACE_MAGIC: Final = b"CSA3TRCE"
+TRACE_VERSION: Final = 1
+TRACE_BUFFER_SIZE: Final = 1 << 16
+# record tags of a binary trace; a state record holds the registers and flags that changed since the previous one
+TRACE_STATE, TRACE_COMMAND, TRACE_MEMORY, TRACE_INPUT, TRACE_OUTPUT, TRACE_EVENT, TRACE_END = range(7)
+# the warnings of command_cycle
+TRACE_EOF, TRACE_LIMIT = range(2)
+TRACE_FLAGS: Final = 1 << len(registers)
+
+
+def write_varint(buffer: bytearray, value: int) -> None:
+    # zigzag, so that small negative numbers stay short too
+    value = value << 1 if value >= 0 else (-value << 1) - 1
+    while value >= 0x80:
+        buffer.append(value & 0x7F | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def write_text(buffer: bytearray, text: str) -> None:
+    encoded = text.encode("utf-8")
+    write_varint(buffer, len(encoded))
+    buffer += encoded
+
+
+class TraceRecorder:
+    # Records what a full trace logs as compact binary records: a state record per logged line of command_cycle
+    # (the instruction as an index into the command texts written so far, the tick delta, the changed registers as
+    # deltas and the flags when they changed), memory writes, port events and warnings. tracelog.py renders the text.
+    def __init__(self, file: BinaryIO, buffer_size: int = TRACE_BUFFER_SIZE):
+        self.file = file
+        self.buffer_size = buffer_size
+        self.buffer = bytearray(TRACE_MAGIC)
+        write_varint(self.buffer, TRACE_VERSION)
+        self.commands: dict[Command | Commands, int] = {}
+        self.values = (0,) * len(registers)
+        self.flags = 0
+        self.tick = 0
+
+    def attach(self, data_path: DataPath) -> None:
+        # before the control unit is made, so that its handlers bind the recorded memory
+        data_path.recorder = self
+        data_path.memory = RecordedMemory(self, data_path.memory)
+
+    def log_state(self, _: str, control_unit: ControlUnit) -> None:
+        # takes the place of logging.info("%s", control_unit)
+        self.record_state(control_unit)
+
+    def record_state(self, control_unit: ControlUnit) -> None:
+        buffer = self.buffer
+        command = control_unit.command
+        index = self.commands.get(command)
+        if index is None:
+            index = self.commands[command] = len(self.commands)
+            buffer.append(TRACE_COMMAND)
+            write_text(buffer, str(command))
+        alu = control_unit.data_path.alu
+        values = tuple(control_unit.data_path.reg.values())
+        flags = alu.N | alu.Z << 1 | alu.OF << 2 | (control_unit.mode != "") << 3
+        tick = control_unit.current_tick()
+        buffer.append(TRACE_STATE)
+        write_varint(buffer, index)
+        write_varint(buffer, tick - self.tick)
+        mask = TRACE_FLAGS if flags != self.flags else 0
+        if values != self.values:
+            for bit, (value, previous) in enumerate(zip(values, self.values)):
+                if value != previous:
+                    mask |= 1 << bit
+        buffer.append(mask)
+        if values != self.values:
+            for value, previous in zip(values, self.values):
+                if value != previous:
+                    write_varint(buffer, value - previous)
+        if flags != self.flags:
+            buffer.append(flags)
+        self.values, self.flags, self.tick = values, flags, tick
+        if len(buffer) >= self.buffer_size:
+            self.flush()
+
+    def record_memory(self, addr: int, value: int) -> None:
+        self.buffer.append(TRACE_MEMORY)
+        write_varint(self.buffer, addr)
+        write_varint(self.buffer, value)
+
+    def record_input(self, token: str) -> None:
+        self.buffer.append(TRACE_INPUT)
+        write_text(self.buffer, token)
+
+    def record_output(self, port: int, char: str, listed: bool) -> None:
+        # a list port logs what it held before, other ports their number
+        self.buffer.append(TRACE_OUTPUT)
+        write_varint(self.buffer, port << 1 | listed)
+        write_text(self.buffer, char)
+
+    def record_event(self, event: int) -> None:
+        self.buffer.append(TRACE_EVENT)
+        write_varint(self.buffer, event)
+
+    def finish(self, control_unit: ControlUnit, output: str) -> None:
+        if control_unit.instr_counter >= control_unit.limit:
+            self.record_event(TRACE_LIMIT)
+        self.buffer.append(TRACE_END)
+        write_text(self.buffer, output)
+        self.flush()
+
+    def flush(self) -> None:
+        self.file.write(self.buffer)
+        self.buffer.clear()
+
+
+class RecordedMemory(SparseMemory[int]):
+    def __init__(self, recorder: TraceRecorder, memory: SparseMemory[int]):
+        super().__init__(memory.size, memory.default, dict(memory))
+        self.recorder = recorder
+
+    def __setitem__(self, addr: int, value: int) -> None:
+        super().__setitem__(addr, value)
+        self.recorder.record_memory(addr if addr >= 0 else addr + self.size, value)
+
+
+@contextlib.contextmanager
+def recording(data_path: DataPath, record: str | None) -> Iterator[TraceRecorder | None]:
+    if record is None:
+        yield None
+        return
+    with open(record, "wb") as file:
+        recorder = TraceRecorder(file)
+        recorder.attach(data_path)
+        try:
+            yield recorder
+        finally:
+            recorder.flush()
 
-    def __init__(self, data_path, limit, command_memory, command_memory_size):
-        self.memory = command_memory + [format(0, "020x")] * (command_memory_size - len(command_memory))
+
+class ControlUnit:
+    instructions: SparseMemory[Command]
+    command: Command | Commands
+    profile: Profile | None = None
+
+    def __init__(self, data_path, limit, command_memory, command_memory_size, trace=TraceLevel.full):
+        nop = Command(format(0, "020x"))
+        code = command_memory if isinstance(command_memory, Mapping) else decode_code(command_memory)
+        self.instructions = SparseMemory(command_memory_size, nop, code)
         self.data_path = data_path
         self.instr_counter = 0
         self._tick = 0
         self.limit = limit
         self.command = Commands.nop
         self.mode = ""
+        self.halted = False
+        self.trace = trace
+        self.data_path.log_ports = trace == TraceLevel.full
 
     def tick(self):
         self._tick += 1
@@ -162,30 +601,89 @@ class ControlUnit:
     def current_tick(self):
         return self._tick
 
-    def command_cycle(self):
-        logging.info("%s", self)
+    def finished(self) -> bool:
+        return self.halted or self.instr_counter >= self.limit
+
+    def pause_point(self, pause_at: int | None) -> int:
+        if self.halted:
+            return self.instr_counter
+        return self.limit if pause_at is None else min(pause_at, self.limit)
+
+    def enable_profile(self, profile: Profile) -> None:
+        self.profile = profile
+
+    def waiting(self) -> bool:
+        # true when only new input can move the program on; this engine does not look for idle loops
+        return False
+
+    def collect_profile(self) -> None:
+        if self.profile is not None:
+            self.profile.collect()
+
+    def profiled_step(self):
+        assert self.profile is not None
+        addr, start = self.data_path.get_reg(Registers.rip), self._tick
+        try:
+            self.decode_and_execute_instruction()
+        finally:
+            self.profile.record(addr, self._tick - start)
+
+    # Log records carry the function name, so command_cycle logs by itself; a run resumed from a snapshot or
+    # continued after a pause has already logged its start.
+    def logs_start(self) -> bool:
+        return self.trace != TraceLevel.off and self._tick == 0
+
+    def logs_summary(self) -> bool:
+        return self.trace == TraceLevel.summary and self.finished()
+
+    # The state line of every step goes to the log in a full trace or to a trace recorder, which also takes the
+    # start state; None when neither wants it.
+    def begin_trace(self) -> Callable[[str, ControlUnit], None] | None:
+        recorder = self.data_path.recorder
+        if recorder is None:
+            return self.data_path.logger.info if self.trace == TraceLevel.full else None
+        if self._tick == 0:
+            recorder.record_state(self)
+        return recorder.log_state
+
+    # Runs until hlt, the end of input or the instruction limit; pause_at stops earlier so that the run can be
+    # checkpointed and continued by another call.
+    def command_cycle(self, pause_at: int | None = None):
+        stop = self.pause_point(pause_at)
+        log = self.begin_trace()
+        step = self.decode_and_execute_instruction if self.profile is None else self.profiled_step
+        if self.logs_start():
+            self.data_path.logger.info("%s", self)
         try:
-            while self.instr_counter < self.limit:
-                self.decode_and_execute_instruction()
-                prev = self.memory[self.data_path.get_reg(Registers.rip)]
+            while self.instr_counter < stop:
+                step()
+                prev = self.instructions[self.data_path.get_reg(Registers.rip)].hex_string
                 self.data_path.latch_ip(prev)
-                logging.info("%s", self)
+                if log is not None:
+                    log("%s", self)
                 self.instr_counter += 1
                 self.interruption_cycle()
         except EOFError:
-            logging.warning("Input buffer is empty!")
+            self.halted = True
+            self.data_path.logger.warning("Input buffer is empty!")
         except StopIteration:
-            logging.info("%s", self)
+            self.halted = True
+            if log is not None:
+                log("%s", self)
 
+        if self.logs_summary():
+            self.data_path.logger.info("%s", self)
         if self.instr_counter >= self.limit:
-            logging.warning("Limit exceeded!")
+            self.data_path.logger.warning("Limit exceeded!")
 
     def update_interruption_state(self):
         input_port = self.data_path.ports[0]
-        if len(input_port) and input_port[0][0] <= self.current_tick():
+        assert isinstance(input_port, InputSchedule)
+        if input_port.ready(self.current_tick()):
             self.data_path.set_reg(Registers.rst, self.data_path.get_reg(Registers.rst) | 2)
 
     def execute_interruption(self):
+        start = self._tick
         self.mode = "TRAP:"
         self.data_path.set_reg(Registers.rst, 0)
         self.tick()
@@ -200,6 +698,8 @@ class ControlUnit:
 
         self.data_path.rd(Registers.rip, 1)
         self.tick()
+        if self.profile is not None:
+            self.profile.record_interrupt(self._tick - start)
 
     def decode_and_execute_control_zero_arg_instruction(self, opcode):
         if opcode == Commands.ei:
@@ -266,7 +766,7 @@ class ControlUnit:
             self.tick()
 
     def decode_and_execute_control_flow_instruction(self, instr, opcode):
-        prev = self.memory[self.data_path.get_reg(Registers.rip)]
+        prev = self.instructions[self.data_path.get_reg(Registers.rip)].hex_string
         if opcode == Commands.jmp:
             self.data_path.latch_ip(prev, instr.arg1_value)
             self.tick()
@@ -291,12 +791,15 @@ class ControlUnit:
                 self.data_path.latch_ip(prev, instr.arg1_value)
             self.tick()
 
-    def get_instruction(self) -> str:
-        return self.memory[self.data_path.get_reg(Registers.rip)]
+    def write_instruction(self, addr: int, hex_string: str) -> None:
+        self.instructions[addr] = Command(hex_string)
+
+    def get_instruction(self) -> Command:
+        return self.instructions[self.data_path.get_reg(Registers.rip)]
 
     def decode_and_execute_instruction(self):
-        instr = Command(self.get_instruction())
-        opcode = op_commands[instr.command_type]
+        instr = self.get_instruction()
+        opcode = instr.opcode
         self.tick()
         self.command = instr
 
@@ -318,41 +821,1040 @@ class ControlUnit:
             self.execute_interruption()
 
     def __repr__(self):
-        register_values = ", ".join(f"{name}: {value}" for name, value in self.data_path.reg.items())
-        return (
-            f"{self.mode}Tick: {self.current_tick()} | Registers: {register_values} "
-            f"Flags: {self.data_path.alu} | Instruction: {self.command}"
+        return format_state(self.mode, self.current_tick(), self.data_path.reg, str(self.data_path.alu), self.command)
+
+
+FETCH_TICKS: Final = 1
+NO_DEADLINE: Final = float("inf")
+
+Flags = tuple[int, int, int]
+IdleStep = Callable[[Flags], Flags | None]
+
+BRANCH_CONDITIONS: dict[Commands, Callable[[int, int], bool]] = {
+    Commands.jmp: lambda n, z: True,
+    Commands.jz: lambda n, z: bool(z),
+    Commands.jnz: lambda n, z: not z,
+    Commands.jn: lambda n, z: bool(n),
+    Commands.jp: lambda n, z: not n,
+}
+
+
+def branch_target(addr: int, instr: Command) -> int:
+    # latch_ip treats a negative target as "no target", so a taken jump to it skips one extra word
+    return instr.arg1_value if instr.arg1_value >= 0 else addr + 2
+
+
+def compare_step(left: Callable[[], int], right: Callable[[], int]) -> IdleStep:
+    def step(flags: Flags) -> Flags:
+        value = left() - right()
+        overflow = 0
+        if value >= MAX_NUM:
+            overflow, value = 1, value - MAX_NUM
+        elif value <= -MAX_NUM:
+            overflow, value = 1, value + MAX_NUM
+        return int(value < 0), int(value == 0), overflow
+
+    return step
+
+
+def branch_step(condition: Callable[[int, int], bool], taken: bool) -> IdleStep:
+    # the loop goes on only while the branch outcome equals `taken`
+    def step(flags: Flags) -> Flags | None:
+        return flags if condition(flags[0], flags[1]) == taken else None
+
+    return step
+
+
+class IdleLoop:
+    # A backward branch to `head` whose body only compares and conditionally leaves the loop:
+    # no stores, no I/O, no register writes, so an iteration is a pure function of the flags.
+    def __init__(self, head: int, steps: list[IdleStep], length: int, ticks: int, addrs: list[int]):
+        self.head = head
+        self.steps = steps
+        self.length = length
+        self.ticks = ticks
+        # the address of the instruction behind each step
+        self.addrs = addrs
+
+    def is_idle(self, flags: Flags) -> bool:
+        state = flags
+        for step in self.steps:
+            next_state = step(state)
+            if next_state is None:
+                return False
+            state = next_state
+        return state == flags
+
+    def parks(self, addr: int, flags: Flags) -> bool:
+        # true when the loop never leaves once rip is at addr with these flags
+        state: Flags | None = flags
+        for step_addr, step in zip(self.addrs, self.steps):
+            if step_addr >= addr and state is not None:
+                state = step(state)
+        return state is not None and self.is_idle(state)
+
+
+Handled = bool | IdleLoop | None
+
+
+def instruction_ticks(instr: Command) -> int:
+    opcode = instr.opcode
+    if opcode in branch_commands or opcode in (Commands.movi, Commands.movo, Commands.ei, Commands.di):
+        return FETCH_TICKS + 1
+    if opcode in alu_commands:
+        ticks = 0 if instr.arg1_type == 1 else 2
+        return FETCH_TICKS + ticks + (opcode != Commands.cmp)
+    if opcode == Commands.mov:
+        return FETCH_TICKS + (1 if instr.arg1_type == 1 or instr.arg2_type == 1 else 2)
+    if opcode == Commands.iret:
+        return FETCH_TICKS + 3
+    return FETCH_TICKS
+
+
+class CompiledCode(dict[int, T]):
+    # Filled on first use, so code memory that is never executed is never compiled.
+    def __init__(self, compile_address: Callable[[int], T]):
+        super().__init__()
+        self.compile_address = compile_address
+
+    def __missing__(self, addr: int) -> T:
+        value = self[addr] = self.compile_address(addr)
+        return value
+
+
+class ThreadedControlUnit(ControlUnit):
+    handlers: CompiledCode[Callable[[], Handled]]
+    costs: CompiledCode[int]
+    idle_loops: dict[int, IdleLoop]
+    idle_skip = True
+
+    def __init__(self, data_path, limit, command_memory, command_memory_size, trace=TraceLevel.full):
+        super().__init__(data_path, limit, command_memory, command_memory_size, trace)
+        self.costs = CompiledCode(lambda addr: instruction_ticks(self.instructions[addr]))
+        self.idle_loops = self.find_idle_loops()
+        self.handlers = CompiledCode(lambda addr: self.compile_instruction(addr, self.instructions[addr]))
+
+    # Profiling wraps every handler in a counter, so a run without a profile pays nothing for it.
+    def enable_profile(self, profile: Profile) -> None:
+        super().enable_profile(profile)
+        self.handlers = CompiledCode(
+            lambda addr: profile.counting(
+                addr, self.costs[addr], self.compile_instruction(addr, self.instructions[addr])
+            )
         )
 
+    def halt(self) -> None:
+        # an instruction that halts the machine only takes its fetch, the profile charged it in full
+        self._tick += FETCH_TICKS
+        self.halted = True
+        if self.profile is not None:
+            addr = self.data_path.reg[Registers.rip]
+            self.profile.ticks[addr] -= self.costs[addr] - FETCH_TICKS
+
+    def write_instruction(self, addr: int, hex_string: str) -> None:
+        super().write_instruction(addr, hex_string)
+        self.costs.pop(addr, None)
+        previous, self.idle_loops = self.idle_loops, self.find_idle_loops()
+        for changed in {addr} | (previous.keys() ^ self.idle_loops.keys()):
+            self.handlers.pop(changed, None)
+
+    def find_idle_loops(self) -> dict[int, IdleLoop]:
+        loops = {}
+        for addr, instr in sorted(self.instructions.items()):
+            if instr.opcode in branch_commands and 0 <= branch_target(addr, instr) <= addr:
+                loop = self.idle_loop(addr)
+                if loop is not None:
+                    loops[addr] = loop
+        return loops
+
+    def idle_loop(self, back_edge: int) -> IdleLoop | None:
+        head = branch_target(back_edge, self.instructions[back_edge])
+        steps: list[IdleStep] = []
+        addrs = []
+        for addr in range(head, back_edge):
+            instr = self.instructions[addr]
+            if instr.opcode == Commands.nop:
+                continue
+            if instr.opcode == Commands.cmp and Registers.rip not in self.register_operands(instr):
+                left = self.data_path.arg_reader(instr.arg1_type, instr.arg1_value)
+                right = self.data_path.arg_reader(instr.arg2_type, instr.arg2_value)
+                steps.append(compare_step(left, right))
+            elif instr.opcode in branch_commands[1:] and not head <= branch_target(addr, instr) <= back_edge:
+                steps.append(branch_step(BRANCH_CONDITIONS[instr.opcode], taken=False))
+            else:
+                return None
+            addrs.append(addr)
+        steps.append(branch_step(BRANCH_CONDITIONS[self.instructions[back_edge].opcode], taken=True))
+        addrs.append(back_edge)
+        ticks = sum(self.costs[addr] for addr in range(head, back_edge + 1))
+        return IdleLoop(head, steps, back_edge - head + 1, ticks, addrs)
+
+    @staticmethod
+    def register_operands(instr: Command) -> list[Registers]:
+        operands = [(instr.arg1_type, instr.arg1_value), (instr.arg2_type, instr.arg2_value)]
+        return [registers[value] for arg_type, value in operands if arg_type == 1]
+
+    # Handlers execute one instruction without touching the tick counter (the run loop adds costs[addr]).
+    # A handler returns True when it may have changed rst or the input port, so interrupts must be rechecked,
+    # and the IdleLoop it closes when it is the taken back edge of an idle loop.
+    def compile_instruction(self, addr: int, instr: Command) -> Callable[[], Handled]:
+        opcode = instr.opcode
+        if opcode in branch_commands:
+            handler = self.compile_branch(addr, instr)
+        elif opcode in alu_commands:
+            handler = self.compile_alu(instr)
+        elif opcode == Commands.mov:
+            handler = self.compile_mov(instr)
+        elif opcode in (Commands.movi, Commands.movo):
+            handler = self.compile_port(instr)
+        else:
+            handler = self.compile_control(instr)
+        return handler if self.jumps_in_code(addr, instr) else self.checked_jump(handler)
 
-def simulation(data_memory, code_memory, input_tokens, memory_size, limit, start_addr):
-    data_path = DataPath(data_memory, memory_size, {0: input_tokens, 1: []}, start_addr)
-    control_unit = ControlUnit(data_path, limit, code_memory, memory_size)
-    control_unit.command_cycle()
-    logging.info("output_buffer: %s", repr("".join(data_path.ports[1])))
-    return "".join(data_path.ports[1]), control_unit.instr_counter, control_unit.current_tick()
+    def jumps_in_code(self, addr: int, instr: Command) -> bool:
+        # true when the instruction cannot leave rip just behind a word outside code memory
+        opcode = instr.opcode
+        if opcode in branch_commands:
+            return -self.instructions.size <= branch_target(addr, instr) - 1 < self.instructions.size
+        if opcode == Commands.iret:
+            return False
+        writes = opcode == Commands.mov or (opcode in alu_commands and opcode != Commands.cmp)
+        return not (writes and instr.arg1_type == 1 and registers[instr.arg1_value] == Registers.rip)
+
+    # The reference engine reads the word before the new rip right after every instruction, so a jump out of code
+    # memory fails at once, not at the next fetch (which the instruction limit or an interrupt could prevent).
+    def checked_jump(self, handler: Callable[[], Handled]) -> Callable[[], Handled]:
+        instructions = self.instructions
+        reg = self.data_path.reg
+        rip = Registers.rip
+
+        def jump():
+            changed = handler()
+            instructions.address(reg[rip] - 1)
+            return changed
+
+        return jump
+
+    def compile_branch(self, addr: int, instr: Command) -> Callable[[], Handled]:
+        reg = self.data_path.reg
+        alu = self.data_path.alu
+        rip = Registers.rip
+        taken = branch_target(addr, instr)
+        fallthrough = addr + 1
+        conditions: dict[Commands, Callable[[], bool]] = {
+            Commands.jmp: lambda: True,
+            Commands.jz: lambda: bool(alu.Z),
+            Commands.jnz: lambda: not alu.Z,
+            Commands.jn: lambda: bool(alu.N),
+            Commands.jp: lambda: not alu.N,
+        }
+        condition = conditions[instr.opcode]
+        loop = self.idle_loops.get(addr)
+
+        def branch():
+            reg[rip] = taken if condition() else fallthrough
+
+        def loop_back():
+            if condition():
+                reg[rip] = taken
+                return loop
+            reg[rip] = fallthrough
+            return None
+
+        return branch if loop is None else loop_back
+
+    def compile_alu(self, instr: Command) -> Callable[[], Handled]:
+        data_path = self.data_path
+        reg = data_path.reg
+        memory = data_path.memory
+        alu = data_path.alu
+        rip = Registers.rip
+        fn = ALU_OPERATORS[instr.opcode]
+        store = instr.opcode != Commands.cmp
+        left = data_path.arg_reader(instr.arg1_type, instr.arg1_value)
+        right = data_path.arg_reader(instr.arg2_type, instr.arg2_value)
+        target = instr.arg1_value
+        to_register = instr.arg1_type == 1
+        name = registers[target] if to_register else Registers.rax
+        changes_state = store and to_register and name == Registers.rst
+
+        def perform():
+            value = fn(left(), right())
+            if value >= MAX_NUM:
+                alu.OF = 1
+                value -= MAX_NUM
+            elif value <= -MAX_NUM:
+                alu.OF = 1
+                value += MAX_NUM
+            else:
+                alu.OF = 0
+            alu.Z = int(value == 0)
+            alu.N = int(value < 0)
+            if store:
+                if to_register:
+                    reg[name] = value
+                else:
+                    memory[target] = to_word(value)
+            reg[rip] += 1
+            return changes_state
 
+        return perform
 
-def main(codes_file, datas_file, inputs_file):
-    with open(inputs_file, encoding="utf-8") as file:
-        input_text = file.read()
-        if not input_text:
-            input_token = []
+    def compile_mov(self, instr: Command) -> Callable[[], Handled]:
+        data_path = self.data_path
+        reg = data_path.reg
+        memory = data_path.memory
+        alu = data_path.alu
+        rip = Registers.rip
+        right = data_path.arg_reader(instr.arg2_type, instr.arg2_value)
+
+        if instr.arg1_type == 1:
+            name = registers[instr.arg1_value]
+            changes_state = name == Registers.rst
+
+            def load():
+                value = right()
+                alu.Z = int(value == 0)
+                alu.N = int(value < 0)
+                reg[name] = value
+                reg[rip] += 1
+                return changes_state
+
+            return load
+
+        if instr.arg2_type == 1:
+            target = instr.arg1_value
+
+            def store():
+                memory[target] = to_word(right())
+                reg[rip] += 1
+
+            return store
+
+        arg1_type, arg1_value = instr.arg1_type, instr.arg1_value
+
+        def move():
+            value = right()
+            memory[data_path.get_addr(arg1_type, arg1_value)] = to_word(value)
+            reg[rip] += 1
+
+        return move
+
+    def compile_port(self, instr: Command) -> Callable[[], Handled]:
+        data_path = self.data_path
+        reg = data_path.reg
+        rip = Registers.rip
+        arg1_value, arg2_value = instr.arg1_value, instr.arg2_value
+
+        if instr.opcode == Commands.movi:
+
+            def port_in():
+                data_path.rd_port(arg2_value, arg1_value)
+                reg[rip] += 1
+                return True
+
+            return port_in
+
+        right = data_path.arg_reader(instr.arg2_type, instr.arg2_value)
+
+        def port_out():
+            data_path.wr_port(arg1_value, right())
+            reg[rip] += 1
+
+        return port_out
+
+    def compile_control(self, instr: Command) -> Callable[[], Handled]:
+        reg = self.data_path.reg
+        memory = self.data_path.memory
+        rip, rst, rsp, rax = Registers.rip, Registers.rst, Registers.rsp, Registers.rax
+
+        def halt():
+            raise StopIteration()
+
+        def enable():
+            reg[rst] |= 1
+            reg[rip] += 1
+            return True
+
+        def disable():
+            reg[rst] &= ~1
+            reg[rip] += 1
+            return True
+
+        def interrupt_return():
+            self.mode = ""
+            reg[rsp] += 1
+            reg[rax] = memory[reg[rsp]]
+            reg[rsp] += 1
+            reg[rip] = memory[reg[rsp]]
+            reg[rst] |= 1
+            return True
+
+        def nop():
+            reg[rip] += 1
+
+        handlers: dict[Commands, Callable[[], Handled]] = {
+            Commands.hlt: halt,
+            Commands.ei: enable,
+            Commands.di: disable,
+            Commands.iret: interrupt_return,
+        }
+        return handlers.get(instr.opcode, nop)
+
+    def next_deadline(self) -> float:
+        input_port = self.data_path.ports[0]
+        assert isinstance(input_port, InputSchedule)
+        return NO_DEADLINE if input_port.head is None else input_port.head[0]
+
+    def waiting(self) -> bool:
+        # parked in an idle loop with interrupts enabled and no input pending, the program would spin until the limit
+        reg, alu = self.data_path.reg, self.data_path.alu
+        if self.halted or reg[Registers.rst] & 3 != 1 or self.next_deadline() != NO_DEADLINE:
+            return False
+        addr, flags = reg[Registers.rip], (alu.N, alu.Z, alu.OF)
+        return any(
+            loop.head <= addr < loop.head + loop.length and loop.parks(addr, flags) for loop in self.idle_loops.values()
+        )
+
+    # Iterations of an idle loop started with the same flags repeat each other exactly, so they can be
+    # skipped in bulk as long as none of them would reach the input deadline or the instruction limit.
+    def fast_forward(self, loop: IdleLoop, tick: int, counter: int, deadline: float, stop: int) -> tuple[int, int]:
+        alu = self.data_path.alu
+        if self.data_path.reg[Registers.rst] & 2:
+            # the pending bit is already latched, later input arrivals change nothing
+            deadline = NO_DEADLINE
+        iterations = (stop - counter) // loop.length
+        if deadline != NO_DEADLINE:
+            iterations = min(iterations, (int(deadline) - tick - 1) // loop.ticks)
+        if iterations <= 0 or not loop.is_idle((alu.N, alu.Z, alu.OF)):
+            return tick, counter
+        if self.profile is not None:
+            for addr in range(loop.head, loop.head + loop.length):
+                self.profile.hits[addr] += iterations
+                self.profile.ticks[addr] += iterations * self.costs[addr]
+        return tick + iterations * loop.ticks, counter + iterations * loop.length
+
+    def run_untraced(self, stop: int):
+        reg = self.data_path.reg
+        handlers = self.handlers
+        costs = self.costs
+        idle_skip = self.idle_skip
+        rip, rst = Registers.rip, Registers.rst
+        tick, counter = self._tick, self.instr_counter
+        deadline = self.next_deadline()
+        addr = None
+        try:
+            while counter < stop:
+                addr = reg[rip]
+                changed = handlers[addr]()
+                tick += costs[addr]
+                counter += 1
+                if tick >= deadline or changed:
+                    deadline = self.next_deadline()
+                    if tick >= deadline:
+                        reg[rst] |= 2
+                    if reg[rst] & 3 == 3:
+                        self._tick = tick
+                        self.execute_interruption()
+                        tick = self._tick
+                    elif idle_skip and isinstance(changed, IdleLoop):
+                        tick, counter = self.fast_forward(changed, tick, counter, deadline, stop)
+        finally:
+            self._tick, self.instr_counter = tick, counter
+            if addr is not None:
+                self.command = self.instructions[addr]
+
+    def command_cycle(self, pause_at: int | None = None):
+        reg = self.data_path.reg
+        handlers = self.handlers
+        costs = self.costs
+        instructions = self.instructions
+        rip = Registers.rip
+        stop = self.pause_point(pause_at)
+        log = self.begin_trace()
+        if self.logs_start():
+            self.data_path.logger.info("%s", self)
+        try:
+            if log is None:
+                self.run_untraced(stop)
+            while self.instr_counter < stop:
+                addr = reg[rip]
+                self.command = instructions[addr]
+                handlers[addr]()
+                self._tick += costs[addr]
+                if log is not None:
+                    log("%s", self)
+                self.instr_counter += 1
+                self.interruption_cycle()
+        except EOFError:
+            self.halt()
+            self.data_path.logger.warning("Input buffer is empty!")
+        except StopIteration:
+            self.halt()
+            if log is not None:
+                log("%s", self)
+        self.collect_profile()
+
+        if self.logs_summary():
+            self.data_path.logger.info("%s", self)
+        if self.instr_counter >= self.limit:
+            self.data_path.logger.warning("Limit exceeded!")
+
+
+HOT_BLOCK: Final = 64
+
+BLOCK_OPERATORS: dict[Commands, str] = {
+    Commands.add: "+",
+    Commands.sub: "-",
+    Commands.mod: "%",
+    Commands.div: "//",
+    Commands.mul: "*",
+    Commands.xor: "^",
+    Commands.and_: "&",
+    Commands.or_: "|",
+    Commands.cmp: "-",
+}
+
+# branch conditions over the value that set the flags last in the block, or over the flags it started with
+BLOCK_CONDITIONS: dict[Commands, tuple[str, str]] = {
+    Commands.jz: ("{} == 0", "alu.Z"),
+    Commands.jnz: ("{} != 0", "not alu.Z"),
+    Commands.jn: ("{} < 0", "alu.N"),
+    Commands.jp: ("{} >= 0", "not alu.N"),
+}
+
+
+class Block:
+    # Straight-line code from `head` up to its first branch or the next branch target. It has no port, control,
+    # rip or rst instructions, so nothing in it can raise an interrupt except the deadline passing.
+    def __init__(self, head: int, length: int, ticks: int, heat: int):
+        self.head = head
+        self.length = length
+        self.ticks = ticks
+        # runs left until the block is compiled; negative for blocks too short to compile
+        self.heat = heat
+        self.run: Callable[[], Handled] | None = None
+
+
+class BlockSource:
+    # Python source of one block: registers live in locals and are written back once, flags are set once
+    # from the last value that would have set them.
+    def __init__(self, head: int) -> None:
+        self.head = head
+        self.lines: list[str] = []
+        self.registers: dict[str, Registers] = {}
+        self.written: set[str] = set()
+        self.flags: str | None = None
+        self.overflow = False
+        self.exit: list[str] = []
+
+    def operand(self, arg_type: int, value: int) -> str:
+        if arg_type == 0:
+            return f"({value})"
+        if arg_type == 1:
+            name = registers[value]
+            self.registers[name.value] = name
+            return name.value
+        if arg_type == 2:
+            return f"memory[{value}]"
+        if arg_type == 4:
+            return f"memory[memory[{value}]]"
+        return "0"
+
+    def destination(self, instr: Command) -> str:
+        name = self.operand(instr.arg1_type, instr.arg1_value)
+        self.written.add(name)
+        return name
+
+    def alu(self, index: int, instr: Command) -> None:
+        value = f"v{index}"
+        left = self.operand(instr.arg1_type, instr.arg1_value)
+        right = self.operand(instr.arg2_type, instr.arg2_value)
+        self.lines += [
+            f"{value} = {left} {BLOCK_OPERATORS[instr.opcode]} {right}",
+            f"if {value} >= MAX_NUM:",
+            f"    {value} -= MAX_NUM",
+            "    of = 1",
+            f"elif {value} <= -MAX_NUM:",
+            f"    {value} += MAX_NUM",
+            "    of = 1",
+            "else:",
+            "    of = 0",
+        ]
+        self.flags, self.overflow = value, True
+        if instr.opcode == Commands.cmp:
+            return
+        if instr.arg1_type == 1:
+            self.lines.append(f"{self.destination(instr)} = {value}")
+        else:
+            self.lines.append(f"memory[{instr.arg1_value}] = to_word({value})")
+
+    def mov(self, index: int, instr: Command) -> None:
+        right = self.operand(instr.arg2_type, instr.arg2_value)
+        if instr.arg1_type == 1:
+            value = self.flags = f"v{index}"
+            self.lines += [f"{value} = {right}", f"{self.destination(instr)} = {value}"]
+        elif instr.arg2_type == 1:
+            self.lines.append(f"memory[{instr.arg1_value}] = to_word({right})")
         else:
-            input_token = eval(input_text)
+            target = {2: str(instr.arg1_value), 4: f"memory[{instr.arg1_value}]"}.get(instr.arg1_type, "0")
+            self.lines.append(f"memory[{target}] = to_word({right})")
+
+    def branch(self, addr: int, instr: Command, loop: IdleLoop | None) -> None:
+        taken = [f"reg[rip] = {branch_target(addr, instr)}"] + ([] if loop is None else ["return loop"])
+        if instr.opcode == Commands.jmp:
+            self.exit = taken
+            return
+        on_value, on_flags = BLOCK_CONDITIONS[instr.opcode]
+        condition = on_flags if self.flags is None else on_value.format(self.flags)
+        self.exit = [f"if {condition}:", *(f"    {line}" for line in taken), "else:", f"    reg[rip] = {addr + 1}"]
+
+    def function(self, end: int) -> str:
+        lines = [f"{name} = reg[REG_{name}]" for name in self.registers] + self.lines
+        lines += [f"reg[REG_{name}] = {name}" for name in sorted(self.written)]
+        if self.flags is not None:
+            lines += [f"alu.Z = int({self.flags} == 0)", f"alu.N = int({self.flags} < 0)"]
+        if self.overflow:
+            lines.append("alu.OF = of")
+        lines += self.exit or [f"reg[rip] = {end}"]
+        return "def block():\n" + "".join(f"    {line}\n" for line in lines)
+
+
+class BlockControlUnit(ThreadedControlUnit):
+    # The threaded engine plus basic blocks: a block entered `hot_block` times is compiled into one Python
+    # function. It runs whole only when it cannot reach the input deadline or the instruction limit, otherwise
+    # its instructions go through the handlers one by one, so interrupts come at the same ticks.
+    blocks: CompiledCode[Block]
+    leaders: set[int]
+    hot_block = HOT_BLOCK
+
+    def __init__(self, data_path, limit, command_memory, command_memory_size, trace=TraceLevel.full) -> None:
+        super().__init__(data_path, limit, command_memory, command_memory_size, trace)
+        self.reset_blocks()
+
+    def reset_blocks(self) -> None:
+        self.leaders = {
+            branch_target(addr, instr) for addr, instr in self.instructions.items() if instr.opcode in branch_commands
+        }
+        self.blocks = CompiledCode(self.find_block)
+
+    def enable_profile(self, profile: Profile) -> None:
+        super().enable_profile(profile)
+        self.reset_blocks()
+
+    def write_instruction(self, addr: int, hex_string: str) -> None:
+        super().write_instruction(addr, hex_string)
+        self.reset_blocks()
+
+    def inlined(self, addr: int, instr: Command) -> bool:
+        opcode = instr.opcode
+        if opcode == Commands.nop:
+            return True
+        if opcode in branch_commands:
+            return self.jumps_in_code(addr, instr)
+        if opcode not in alu_commands and opcode != Commands.mov:
+            return False
+        return not {Registers.rip, Registers.rst} & set(self.register_operands(instr))
+
+    def find_block(self, head: int) -> Block:
+        addr = head
+        while addr < self.instructions.size and self.inlined(addr, self.instructions[addr]):
+            addr += 1
+            if self.instructions[addr - 1].opcode in branch_commands or addr in self.leaders:
+                break
+        length = addr - head
+        ticks = sum(self.costs[addr] for addr in range(head, head + length))
+        return Block(head, length, ticks, self.hot_block if length > 1 else -1)
+
+    def compile_block(self, block: Block) -> Callable[[], Handled]:
+        source = BlockSource(block.head)
+        end = block.head + block.length
+        for index, addr in enumerate(range(block.head, end)):
+            instr = self.instructions[addr]
+            if instr.opcode in branch_commands:
+                source.branch(addr, instr, self.idle_loops.get(addr))
+            elif instr.opcode in alu_commands:
+                source.alu(index, instr)
+            elif instr.opcode == Commands.mov:
+                source.mov(index, instr)
+        data_path = self.data_path
+        namespace = {
+            "reg": data_path.reg,
+            "memory": data_path.memory,
+            "alu": data_path.alu,
+            "to_word": to_word,
+            "MAX_NUM": MAX_NUM,
+            "rip": Registers.rip,
+            "loop": self.idle_loops.get(end - 1),
+            **{f"REG_{name}": register for name, register in source.registers.items()},
+        }
+        exec(compile(source.function(end), f"<block {block.head}>", "exec"), namespace)
+        run = namespace["block"]
+        if self.profile is None:
+            return run
+        count = [0]
+        self.profile.counters += [(addr, self.costs[addr], count) for addr in range(block.head, end)]
+
+        def counted():
+            count[0] += 1
+            return run()
+
+        return counted
+
+    def warm(self, block: Block) -> None:
+        block.heat -= 1
+        if block.heat == 0:
+            block.run = self.compile_block(block)
+
+    def run_untraced(self, stop: int):
+        reg = self.data_path.reg
+        handlers = self.handlers
+        costs = self.costs
+        blocks = self.blocks
+        idle_skip = self.idle_skip
+        rip, rst = Registers.rip, Registers.rst
+        tick, counter = self._tick, self.instr_counter
+        deadline = self.next_deadline()
+        addr = None
+        try:
+            while counter < stop:
+                addr = reg[rip]
+                block = blocks[addr]
+                # with the pending bit latched and interrupts off, passing the deadline changes nothing
+                if (
+                    block.run is not None
+                    and counter + block.length <= stop
+                    and (tick + block.ticks < deadline or reg[rst] & 3 == 2)
+                ):
+                    changed = block.run()
+                    tick += block.ticks
+                    counter += block.length
+                    addr += block.length - 1
+                else:
+                    if block.run is None:
+                        self.warm(block)
+                    changed = handlers[addr]()
+                    tick += costs[addr]
+                    counter += 1
+                if tick >= deadline or changed:
+                    deadline = self.next_deadline()
+                    if tick >= deadline:
+                        reg[rst] |= 2
+                    if reg[rst] & 3 == 3:
+                        self._tick = tick
+                        self.execute_interruption()
+                        tick = self._tick
+                    elif idle_skip and isinstance(changed, IdleLoop):
+                        tick, counter = self.fast_forward(changed, tick, counter, deadline, stop)
+        finally:
+            self._tick, self.instr_counter = tick, counter
+            if addr is not None:
+                self.command = self.instructions[addr]
+
+
+ENGINES: dict[str, type[ControlUnit]] = {
+    "reference": ControlUnit,
+    "threaded": ThreadedControlUnit,
+    "jit": BlockControlUnit,
+}
 
-    start_addr, code = read_code(codes_file)
-    _, data = read_code(datas_file)
-    output, instr_counter, ticks = simulation(
-        data, code, input_tokens=input_token, memory_size=MAX_MEMORY, limit=20000, start_addr=start_addr
-    )
 
+SNAPSHOT_MAGIC: Final = b"CSA3SNAP"
+SNAPSHOT_VERSION: Final = 4
+# magic, version, length of the JSON state that follows; then zlib of the stored data words (int64 addresses,
+# int64 values) and the stored code words (int64 addresses, object file code words)
+SNAPSHOT_HEADER: Final = struct.Struct("<8sHI")
+SNAPSHOT_WORD: Final = array("q").itemsize
+
+
+def make_control_unit(engine, data_path, limit, code_memory, code_memory_size, trace, idle_skip=True) -> ControlUnit:
+    control_unit = ENGINES[engine](data_path, limit, code_memory, code_memory_size, trace)
+    if isinstance(control_unit, ThreadedControlUnit):
+        control_unit.idle_skip = idle_skip
+    return control_unit
+
+
+# Ports past 0 and 1 go into the snapshot with their output; a sink that streams it away or another input port
+# could not be given back on resume, so a snapshot of such a run is refused.
+def saved_ports(ports: dict[int, Port]) -> dict[str, dict[str, str]]:
+    saved = {}
+    for port, value in ports.items():
+        if port in (0, 1):
+            continue
+        if isinstance(value, list):
+            saved[str(port)] = {"output": "".join(value)}
+        elif isinstance(value, BytesSink):
+            saved[str(port)] = {"output": value.text(), "encoding": value.encoding}
+        else:
+            raise TypeError(port)
+    return saved
+
+
+def restored_ports(saved: dict[str, dict[str, str]]) -> dict[int, Port]:
+    ports: dict[int, Port] = {}
+    for port, state in saved.items():
+        if "encoding" not in state:
+            ports[int(port)] = list(state["output"])
+            continue
+        sink = BytesSink(state["encoding"])
+        sink.data += state["output"].encode(sink.encoding)
+        ports[int(port)] = sink
+    return ports
+
+
+def save_snapshot(control_unit: ControlUnit, filename: str) -> None:
+    data_path = control_unit.data_path
+    input_port, output_port = data_path.ports[0], data_path.ports[1]
+    assert isinstance(input_port, InputSchedule)
+    command = control_unit.command
+    state = {
+        "registers": {str(name): value for name, value in data_path.reg.items()},
+        "flags": [data_path.alu.N, data_path.alu.Z, data_path.alu.OF],
+        "tick": control_unit.current_tick(),
+        "instr_counter": control_unit.instr_counter,
+        "limit": control_unit.limit,
+        "mode": control_unit.mode,
+        "halted": control_unit.halted,
+        "command": command.hex_string if isinstance(command, Command) else None,
+        "input_consumed": input_port.consumed,
+        "output": port_output(output_port),
+        "ports": saved_ports(data_path.ports),
+        "memory_size": data_path.memory.size,
+        "memory_words": len(data_path.memory),
+        "code_memory_size": control_unit.instructions.size,
+        "code_words": len(control_unit.instructions),
+    }
+    addresses = array("q", [*data_path.memory.keys(), *control_unit.instructions.keys()])
+    memory = array("q", data_path.memory.values())
+    if sys.byteorder == "big":
+        addresses.byteswap()
+        memory.byteswap()
+    code = b"".join(pack_code_word(*instr.fields()) for instr in control_unit.instructions.values())
+    metadata = json.dumps(state).encode()
+
+    # write to a temporary file first so that a crash never leaves a truncated checkpoint behind
+    fd, tmp_name = tempfile.mkstemp(dir=Path(filename).resolve().parent, suffix=".tmp")
+    with os.fdopen(fd, "wb") as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(metadata)))
+        file.write(metadata)
+        file.write(zlib.compress(addresses.tobytes() + memory.tobytes() + code))
+    Path(tmp_name).replace(filename)
+
+
+def load_snapshot(
+    filename, input_tokens, engine="reference", trace=TraceLevel.full, limit=None, idle_skip=True, skip_consumed=True
+) -> ControlUnit:
+    with open(filename, "rb") as file:
+        blob = file.read()
+    magic, version, metadata_size = SNAPSHOT_HEADER.unpack_from(blob)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(filename)
+    state = json.loads(blob[SNAPSHOT_HEADER.size : SNAPSHOT_HEADER.size + metadata_size])
+    payload = zlib.decompress(blob[SNAPSHOT_HEADER.size + metadata_size :])
+
+    memory_words, code_words = state["memory_words"], state["code_words"]
+    addresses, memory = array("q"), array("q")
+    addresses.frombytes(payload[: (memory_words + code_words) * SNAPSHOT_WORD])
+    memory.frombytes(payload[len(addresses) * SNAPSHOT_WORD :][: memory_words * SNAPSHOT_WORD])
+    if sys.byteorder == "big":
+        addresses.byteswap()
+        memory.byteswap()
+    decoded: dict[CommandFields, Command] = {}
+    code: dict[int, Command] = {}
+    code_offset = (2 * memory_words + code_words) * SNAPSHOT_WORD
+    for addr, fields in zip(addresses[memory_words:], unpack_code_words(payload[code_offset:])):
+        if fields not in decoded:
+            decoded[fields] = Command.from_fields(*fields)
+        code[addr] = decoded[fields]
+
+    # the schedule is given from its beginning: tokens read before the snapshot are skipped
+    consumed = state["input_consumed"]
+    schedule = InputSchedule(itertools.islice(input_tokens, consumed, None) if skip_consumed else input_tokens)
+    schedule.consumed = consumed
+    ports = {0: schedule, 1: list(state["output"]), **restored_ports(state["ports"])}
+    data_path = DataPath(array("q"), state["memory_size"], ports, 0)
+    data_path.memory.update(zip(addresses[:memory_words], memory))
+    data_path.reg.update({Registers(name): value for name, value in state["registers"].items()})
+    data_path.alu.N, data_path.alu.Z, data_path.alu.OF = state["flags"]
+
+    limit = state["limit"] if limit is None else limit
+    control_unit = make_control_unit(engine, data_path, limit, code, state["code_memory_size"], trace, idle_skip)
+    control_unit._tick = state["tick"]
+    control_unit.instr_counter = state["instr_counter"]
+    control_unit.mode = state["mode"]
+    control_unit.halted = state["halted"]
+    if state["command"] is not None:
+        control_unit.command = Command(state["command"])
+    return control_unit
+
+
+def run_with_checkpoints(control_unit: ControlUnit, checkpoint=None, checkpoint_every=None) -> None:
+    if checkpoint is None:
+        control_unit.command_cycle()
+        return
+    # ports a snapshot cannot keep are refused before the run, not at its first checkpoint
+    saved_ports(control_unit.data_path.ports)
+
+    while True:
+        pause_at = None if checkpoint_every is None else control_unit.instr_counter + checkpoint_every
+        control_unit.command_cycle(pause_at)
+        control_unit.data_path.flush_ports()
+        save_snapshot(control_unit, checkpoint)
+        if control_unit.finished():
+            break
+
+
+def simulation(
+    data_memory,
+    code_memory,
+    input_tokens,
+    memory_size,
+    limit,
+    start_addr,
+    engine="reference",
+    trace=TraceLevel.full,
+    idle_skip=True,
+    checkpoint=None,
+    checkpoint_every=None,
+    profile=None,
+    ports=None,
+    record=None,
+    logger=None,
+):
+    # ports replaces the default output list of port 1 with a sink or adds more input and output ports;
+    # record writes a binary trace of the run to this file instead of the text log, whatever the trace level;
+    # logger takes the text log in place of the root logger
+    if record is not None:
+        trace = TraceLevel.off
+    ports = {0: InputSchedule(input_tokens), 1: [], **(ports or {})}
+    data_path = DataPath(data_memory, memory_size, ports, start_addr)
+    if logger is not None:
+        data_path.logger = logger
+    with recording(data_path, record) as recorder:
+        control_unit = make_control_unit(engine, data_path, limit, code_memory, memory_size, trace, idle_skip)
+        if profile is not None:
+            control_unit.enable_profile(profile)
+        try:
+            run_with_checkpoints(control_unit, checkpoint, checkpoint_every)
+        finally:
+            data_path.flush_ports()
+        output = port_output(ports[1])
+        if recorder is not None:
+            recorder.finish(control_unit, output)
+    if trace != TraceLevel.off:
+        data_path.logger.info("output_buffer: %s", repr(output))
+    return output, control_unit.instr_counter, control_unit.current_tick()
+
+
+def resume_simulation(
+    snapshot_file,
+    input_tokens,
+    limit=None,
+    engine="reference",
+    trace=TraceLevel.full,
+    idle_skip=True,
+    checkpoint=None,
+    checkpoint_every=None,
+    skip_consumed=True,
+    profile=None,
+    ports=None,
+):
+    control_unit = load_snapshot(snapshot_file, input_tokens, engine, trace, limit, idle_skip, skip_consumed)
+    data_path = control_unit.data_path
+    # a sink given for port 1 receives only the output written after the snapshot
+    data_path.ports.update(ports or {})
+    if profile is not None:
+        control_unit.enable_profile(profile)
+    try:
+        run_with_checkpoints(control_unit, checkpoint, checkpoint_every)
+    finally:
+        data_path.flush_ports()
+    output = port_output(data_path.ports[1])
+    if trace != TraceLevel.off:
+        data_path.logger.info("output_buffer: %s", repr(output))
+    return output, control_unit.instr_counter, control_unit.current_tick()
+
+
+def print_result(output, instr_counter, ticks):
     print("".join(output))
     print("instr_counter: ", instr_counter, "ticks:", ticks)
 
 
+def run_program(code, data, start_addr, input_tokens, memory_size=MAX_MEMORY, limit=DEFAULT_LIMIT, **options):
+    print_result(
+        *simulation(
+            data,
+            code,
+            input_tokens=input_tokens,
+            memory_size=memory_size,
+            limit=limit,
+            start_addr=start_addr,
+            **options,
+        )
+    )
+
+
+def main(codes_file, datas_file, inputs_file, **options):
+    input_token = read_input(inputs_file)
+
+    start_addr, code = read_code(codes_file)
+    _, data = read_code(datas_file)
+    run_program(code, data, start_addr, input_token, **options)
+
+
+def main_object(object_file, inputs_file, **options):
+    input_token = read_input(inputs_file)
+
+    start_addr, code, data = read_object(object_file)
+    run_program(code, data, start_addr, input_token, **options)
+
+
+def main_resume(snapshot_file, inputs_file, **options):
+    print_result(*resume_simulation(snapshot_file, read_input(inputs_file), **options))
+
+
 if __name__ == "__main__":
-    logging.getLogger().setLevel(logging.DEBUG)
-    assert len(sys.argv) == 4, "Wrong arguments: machine.py <code_file> <data_file> <input_file>"
-    _, code_file, data_file, input_file = sys.argv
-    main(code_file, data_file, input_file)
+    logging.basicConfig(level=logging.DEBUG)
+    parser = argparse.ArgumentParser(description="Simulate a translated program")
+    parser.add_argument(
+        "files", nargs="+", help="<code_file> <data_file> <input_file> | <object_file> <input_file> | <input_file>"
+    )
+    parser.add_argument("--memory-size", type=int, default=MAX_MEMORY, help="words of data and code memory")
+    parser.add_argument("--limit", type=int, help=f"instructions to execute, {DEFAULT_LIMIT} unless resumed")
+    parser.add_argument("--engine", choices=list(ENGINES), default="reference")
+    parser.add_argument("--trace", type=TraceLevel, choices=list(TraceLevel), help="full unless the run is recorded")
+    parser.add_argument("--no-idle-skip", dest="idle_skip", action="store_false", help="step through idle loops")
+    parser.add_argument("--checkpoint", help="save the machine state to this file when the run stops")
+    parser.add_argument("--checkpoint-every", type=int, help="also save it every N instructions")
+    parser.add_argument("--resume", metavar="SNAPSHOT", help="continue from a saved state, only <input_file> is read")
+    parser.add_argument("--output", help="stream port 1 to this file ('-' for stdout) while the program runs")
+    parser.add_argument("--record", help="write a binary trace to this file, tracelog.py renders it as text")
+    args = parser.parse_args()
+    if args.record is not None and args.trace not in (None, TraceLevel.off):
+        parser.error("--record writes the trace to its file, the text log is off")
+    options = {
+        "engine": args.engine,
+        "trace": args.trace or (TraceLevel.full if args.record is None else TraceLevel.off),
+        "idle_skip": args.idle_skip,
+        "checkpoint": args.checkpoint,
+        "checkpoint_every": args.checkpoint_every,
+    }
+    if args.limit is not None:
+        options["limit"] = args.limit
+    if args.record is not None:
+        assert args.resume is None, "A resumed run cannot be recorded"
+        options["record"] = args.record
+    with contextlib.ExitStack() as stack:
+        if args.output is not None:
+            file = sys.stdout if args.output == "-" else stack.enter_context(open(args.output, "w", encoding="utf-8"))
+            options["ports"] = {1: WriterSink(file)}
+        if args.resume is not None:
+            assert len(args.files) == 1, "Wrong arguments: machine.py --resume <snapshot_file> <input_file>"
+            main_resume(args.resume, args.files[0], **options)
+        elif len(args.files) == 2:
+            object_file, input_file = args.files
+            main_object(object_file, input_file, memory_size=args.memory_size, **options)
+        else:
+            assert len(args.files) == 3, "Wrong arguments: machine.py <code_file> <data_file> <input_file>"
+            code_file, data_file, input_file = args.files
+            main(code_file, data_file, input_file, memory_size=args.memory_size, **options)
@@ -0,0 +1,164 @@
+from __future__ import annotations
+
+import argparse
+from bisect import bisect_right
+from collections import Counter
+from pathlib import Path
+from typing import Final
+
+from isa import MAX_MEMORY, Instruction
+from machine import DEFAULT_LIMIT, ENGINES, Profile, TraceLevel, print_result, read_input, simulation
+from translator import clean_line, read_source
+
+TOP: Final = 20
+START_FRAME: Final = "<start>"
+INTERRUPT_FRAME: Final = "<interrupt>"
+
+
+class SourceMap:
+    # Code address -> the label it follows and the line of the text source it was assembled from.
+    def __init__(self, labels: dict[str, int], lines: list[int], text: list[str]):
+        self.labels = sorted((addr, name) for name, addr in labels.items())
+        self.starts = [addr for addr, _ in self.labels]
+        self.lines = lines
+        self.text = text
+
+    def frame(self, addr: int) -> tuple[str, int]:
+        index = bisect_right(self.starts, addr) - 1
+        if index < 0:
+            return START_FRAME, addr
+        start, name = self.labels[index]
+        return name, addr - start
+
+    def label(self, addr: int) -> str:
+        name, offset = self.frame(addr)
+        return name if offset == 0 else f"{name}+{offset}"
+
+    def line(self, addr: int) -> int | None:
+        return self.lines[addr] if 0 <= addr < len(self.lines) else None
+
+    def source(self, addr: int) -> str:
+        line = self.line(addr)
+        return "?" if line is None else clean_line(self.text[line - 1])
+
+
+def read_program(text_file: str, data_file: str) -> tuple[list[Instruction], list[Instruction], SourceMap]:
+    # sources are joined the way translator.main joins them, line numbers are moved back into the text file
+    data_source = Path(data_file).read_text(encoding="utf-8")
+    text_source = Path(text_file).read_text(encoding="utf-8")
+    assembler = read_source(data_source + "\n" + text_source)
+    data, code = assembler.finish()
+    offset = len((data_source + "\n").splitlines())
+    lines = [line - offset for line in assembler.lines]
+    return data, code, SourceMap(assembler.labels, lines, text_source.splitlines())
+
+
+def opcode(code: list[Instruction], addr: int) -> str:
+    return code[addr].mnemonic.split(" ", 1)[0] if 0 <= addr < len(code) else "?"
+
+
+def share(ticks: int, total: int) -> str:
+    return f"{100 * ticks / total:.1f}%" if total else "-"
+
+
+def hot_spots(profile: Profile, code: list[Instruction], source_map: SourceMap, top: int = TOP) -> str:
+    total = profile.total_ticks()
+    lines = [
+        f"instructions: {sum(profile.hits.values())} ticks: {total} "
+        f"interrupts: {profile.interrupts} ({profile.interrupt_ticks} ticks)",
+        "",
+        f"{'addr':>6} {'hits':>10} {'ticks':>10} {'share':>6}  {'label':<16} {'line':>5}  source",
+    ]
+    by_ticks = sorted(profile.ticks.items(), key=lambda item: (-item[1], item[0]))
+    for addr, spent in by_ticks[:top]:
+        line = source_map.line(addr)
+        lines.append(
+            f"{addr:>6} {profile.hits[addr]:>10} {spent:>10} {share(spent, total):>6}  "
+            f"{source_map.label(addr):<16} {'?' if line is None else line:>5}  {source_map.source(addr)}"
+        )
+
+    for title, key in (("opcode", lambda addr: opcode(code, addr)), ("label", lambda addr: source_map.frame(addr)[0])):
+        hits: Counter[str] = Counter()
+        ticks: Counter[str] = Counter()
+        for addr, spent in profile.ticks.items():
+            hits[key(addr)] += profile.hits[addr]
+            ticks[key(addr)] += spent
+        if title == "label" and profile.interrupts:
+            hits[INTERRUPT_FRAME], ticks[INTERRUPT_FRAME] = profile.interrupts, profile.interrupt_ticks
+        lines += ["", f"{title:<16} {'hits':>10} {'ticks':>10} {'share':>6}"]
+        for name, spent in ticks.most_common():
+            lines.append(f"{name:<16} {hits[name]:>10} {spent:>10} {share(spent, total):>6}")
+
+    return "\n".join(lines) + "\n"
+
+
+# Lines of the collapsed stack format read by flamegraph.pl, speedscope and similar tools: program, label and
+# instruction frames weighted by ticks.
+def collapsed_stacks(profile: Profile, source_map: SourceMap, program: str) -> list[str]:
+    stacks = []
+    for addr, ticks in sorted(profile.ticks.items()):
+        if ticks:
+            name, _ = source_map.frame(addr)
+            stacks.append(f"{program};{name};{addr} {source_map.source(addr)} {ticks}")
+    if profile.interrupt_ticks:
+        stacks.append(f"{program};{INTERRUPT_FRAME} {profile.interrupt_ticks}")
+    return stacks
+
+
+def profile_program(
+    text_file, data_file, input_tokens, engine="threaded", limit=DEFAULT_LIMIT, memory_size=MAX_MEMORY, idle_skip=True
+) -> tuple[Profile, tuple[str, int, int], list[Instruction], SourceMap]:
+    data, code, source_map = read_program(text_file, data_file)
+    profile = Profile()
+    result = simulation(
+        [format(word.word, "020x") for word in data],
+        [format(instruction.word, "020x") for instruction in code],
+        input_tokens,
+        memory_size,
+        limit,
+        0,
+        engine=engine,
+        trace=TraceLevel.off,
+        idle_skip=idle_skip,
+        profile=profile,
+    )
+    return profile, result, code, source_map
+
+
+def main(text_file, data_file, inputs_file, report=None, collapsed=None, top=TOP, **options):
+    profile, result, code, source_map = profile_program(text_file, data_file, read_input(inputs_file), **options)
+    print_result(*result)
+
+    text = hot_spots(profile, code, source_map, top)
+    if report is None:
+        print(text, end="")
+    else:
+        Path(report).write_text(text, encoding="utf-8")
+    if collapsed is not None:
+        stacks = collapsed_stacks(profile, source_map, Path(text_file).stem)
+        Path(collapsed).write_text("".join(stack + "\n" for stack in stacks), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile a program: executions and ticks per instruction")
+    parser.add_argument("input_text_file")
+    parser.add_argument("input_data_file")
+    parser.add_argument("input_file")
+    parser.add_argument("--report", help="write the hot spot report to a file instead of stdout")
+    parser.add_argument("--collapsed", help="write collapsed stacks for flame graph tools to this file")
+    parser.add_argument("--top", type=int, default=TOP, help="instructions listed in the report")
+    parser.add_argument("--engine", choices=list(ENGINES), default="threaded")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--memory-size", type=int, default=MAX_MEMORY)
+    args = parser.parse_args()
+    main(
+        args.input_text_file,
+        args.input_data_file,
+        args.input_file,
+        args.report,
+        args.collapsed,
+        args.top,
+        engine=args.engine,
+        limit=args.limit,
+        memory_size=args.memory_size,
+    )
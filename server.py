@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import argparse
+import functools
+import json
+import logging
+import os
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Final
+
+from isa import MAX_MEMORY
+from machine import DEFAULT_LIMIT
+from toolchain import Program
+from translator import clean_source, source_key
+
+PROGRAM_CACHE: Final = 64
+WARM_SOURCE: Final = "section .data\nsection .text\n hlt"
+
+# translated programs of this worker by the hash of their source, least recently used first
+programs: OrderedDict[str, Program] = OrderedDict()
+
+
+def init_worker() -> None:
+    # a server answers over its protocol, the limit and empty input warnings would only fill stderr
+    logging.disable(logging.WARNING)
+
+
+def cached_program(text: str, data: str = "", optimize: bool = False) -> tuple[Program, bool]:
+    # the key of translate_cached: sources that differ only in comments and spacing share a program
+    key = source_key(clean_source(f"{data}\n{text}"), optimize)
+    program = programs.get(key)
+    if program is not None:
+        programs.move_to_end(key)
+        return program, True
+    program = programs[key] = Program.translate(text, data, optimize)
+    if len(programs) > PROGRAM_CACHE:
+        programs.popitem(last=False)
+    return program, False
+
+
+def error_response(request_id, error: BaseException) -> dict:
+    return {"id": request_id, "error": f"{type(error).__name__}: {error}"}
+
+
+def handle(request: dict) -> dict:
+    # a run request: program source, input schedule (token pairs or input file text), limit and engine
+    response = {"id": request.get("id")}
+    try:
+        program, cached = cached_program(request["text"], request.get("data", ""), request.get("optimize", False))
+        input_tokens = request.get("input", [])
+        result = program.run(
+            input_tokens if isinstance(input_tokens, str) else [tuple(token) for token in input_tokens],
+            limit=request.get("limit", DEFAULT_LIMIT),
+            memory_size=request.get("memory_size", MAX_MEMORY),
+            engine=request.get("engine", "threaded"),
+        )
+    except Exception as error:
+        # a bad request or a crashing program gets an answer, the worker stays up
+        return error_response(response["id"], error)
+    response.update(output=result.output, instr_counter=result.instr_counter, ticks=result.ticks, cached=cached)
+    return response
+
+
+def warm_up(executor: ProcessPoolExecutor, workers: int) -> None:
+    # starts the workers and runs the translator and the machine once in each before the first request
+    wait([executor.submit(handle, {"text": WARM_SOURCE}) for _ in range(workers)])
+
+
+def serve_lines(lines: Iterable[str], send: Callable[[str], object], executor: ProcessPoolExecutor) -> None:
+    # one JSON request per line; answers go out as they are ready, their "id" tells which request they answer
+    answered = threading.Condition()
+    pending: set[Future] = set()
+
+    def respond(response: dict) -> None:
+        with answered:
+            send(json.dumps(response) + "\n")
+
+    def done(request_id, future: Future) -> None:
+        try:
+            try:
+                response = future.result()
+            except Exception as error:
+                # a worker that died or a pool that broke still gets the request an answer
+                response = error_response(request_id, error)
+            respond(response)
+        finally:
+            # a client that went away must not keep the connection waiting
+            with answered:
+                pending.discard(future)
+                answered.notify_all()
+
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            respond(error_response(None, error))
+            continue
+        if not isinstance(request, dict):
+            respond(error_response(None, TypeError(f"a request should be a JSON object, not {type(request).__name__}")))
+            continue
+        try:
+            future = executor.submit(handle, request)
+        except RuntimeError as error:
+            # BrokenProcessPool, or a pool shut down under the connection
+            respond(error_response(request.get("id"), error))
+            continue
+        with answered:
+            pending.add(future)
+        future.add_done_callback(functools.partial(done, request.get("id")))
+    # the connection stays open until the last answer is written
+    with answered:
+        answered.wait_for(lambda: not pending)
+
+
+def serve_stdio(executor: ProcessPoolExecutor) -> None:
+    def send(text: str) -> None:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+    serve_lines(sys.stdin, send, executor)
+
+
+class UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, executor: ProcessPoolExecutor):
+        self.executor = executor
+        super().__init__(path, ConnectionHandler)
+
+
+class ConnectionHandler(socketserver.StreamRequestHandler):
+    server: UnixServer
+
+    def handle(self) -> None:
+        lines = (line.decode("utf-8") for line in self.rfile)
+        serve_lines(lines, lambda text: self.wfile.write(text.encode("utf-8")), self.server.executor)
+
+
+def main(socket_path=None, workers=None) -> None:
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        warm_up(executor, workers)
+        if socket_path is None:
+            serve_stdio(executor)
+            return
+        Path(socket_path).unlink(missing_ok=True)
+        with UnixServer(socket_path, executor) as server:
+            try:
+                server.serve_forever()
+            finally:
+                Path(socket_path).unlink(missing_ok=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run simulation requests in warm worker processes")
+    parser.add_argument("--socket", help="listen on this Unix socket instead of stdin and stdout")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    main(args.socket, args.workers)
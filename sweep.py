@@ -0,0 +1,474 @@
+from __future__ import annotations
+
+import argparse
+import itertools
+from collections.abc import Callable, Sequence
+from typing import Final
+
+import numpy as np
+from isa import (
+    MAX_MEMORY,
+    MAX_NUM,
+    Command,
+    Commands,
+    Registers,
+    alu_commands,
+    branch_commands,
+    data_to_hex,
+    decode_code,
+    hex_to_data,
+    is_integer,
+    read_code,
+    registers,
+    to_word,
+)
+from machine import (
+    DEFAULT_LIMIT,
+    FETCH_TICKS,
+    CompiledCode,
+    InputToken,
+    SparseMemory,
+    TraceLevel,
+    branch_target,
+    instruction_ticks,
+    print_result,
+    read_input,
+    simulation,
+)
+
+Lanes = np.ndarray
+Reader = Callable[[Lanes], np.ndarray]
+Operation = Callable[[Lanes], None]
+
+INTERRUPT_TICKS: Final = 4
+# operands below these bounds keep the result of the operation exact in int64
+MUL_BOUND: Final = MAX_NUM
+WIDE_BOUND: Final = 1 << 62
+
+VECTOR_OPERATORS: dict[Commands, Callable[[np.ndarray, np.ndarray], np.ndarray]] = {
+    Commands.add: np.add,
+    Commands.sub: np.subtract,
+    Commands.mod: np.mod,
+    Commands.div: np.floor_divide,
+    Commands.mul: np.multiply,
+    Commands.xor: np.bitwise_xor,
+    Commands.and_: np.bitwise_and,
+    Commands.or_: np.bitwise_or,
+    Commands.cmp: np.subtract,
+}
+
+
+def to_words(values: np.ndarray) -> np.ndarray:
+    return ((values + MAX_NUM) & ((MAX_NUM << 1) - 1)) - MAX_NUM
+
+
+def token_value(token: str | int) -> int:
+    return int(token) if isinstance(token, int) or is_integer(token) else ord(token)
+
+
+def enables_interrupts(instr: Command) -> bool:
+    if instr.opcode in (Commands.ei, Commands.iret):
+        return True
+    writes = instr.opcode in alu_commands or instr.opcode == Commands.mov
+    return writes and instr.arg1_type == 1 and registers[instr.arg1_value] == Registers.rst
+
+
+class VectorMachine:
+    # Instances of one program run in lockstep: registers, flags and counters are NumPy arrays with an element per
+    # instance (lane), data memory has a column per lane. A step takes the lowest rip among the running instances
+    # and executes that instruction for every lane standing on it; the others wait. An instance the arrays cannot follow exactly
+    # (a register outgrowing int64, an address outside memory, division by zero, another port) is evicted and
+    # later rerun on its own by the threaded engine.
+    def __init__(self, data_memories, code_memory, input_schedules, memory_size, limit, start_addr) -> None:
+        count = len(data_memories)
+        assert len(input_schedules) == count, "Every instance needs an input schedule"
+        self.size = memory_size
+        self.limit = limit
+        self.instructions = SparseMemory(memory_size, Command(format(0, "020x")), decode_code(code_memory))
+        # a row per address, so one address of all lanes is contiguous
+        self.memory = np.zeros((memory_size, count), dtype=np.int64)
+        for row, data in enumerate(data_memories):
+            assert memory_size > len(data), "Data_memory size should be more"
+            self.memory[: len(data), row] = [hex_to_data(word) for word in data]
+        self.reg = {name: np.zeros(count, dtype=np.int64) for name in registers}
+        self.reg[Registers.rip][:] = start_addr
+        self.reg[Registers.rsp][:] = memory_size - 1
+        self.flag_n = np.zeros(count, dtype=np.int64)
+        self.flag_z = np.ones(count, dtype=np.int64)
+        self.flag_of = np.zeros(count, dtype=np.int64)
+        self.tick = np.zeros(count, dtype=np.int64)
+        self.counter = np.zeros(count, dtype=np.int64)
+        self.halted = np.zeros(count, dtype=bool)
+        self.evicted = np.zeros(count, dtype=bool)
+        self.inputs: list[list[InputToken]] = [list(schedule) for schedule in input_schedules]
+        self.consumed = [0] * count
+        self.deadline = np.array([tokens[0][0] if tokens else np.inf for tokens in self.inputs], dtype=np.float64)
+        self.outputs: list[list[str]] = [[] for _ in range(count)]
+        self.costs = CompiledCode(lambda addr: instruction_ticks(self.instructions[addr]))
+        self.operations = CompiledCode(lambda addr: self.compile_instruction(addr, self.instructions[addr]))
+        # instructions that can set the interrupt enable bit; without them or pending input no interrupt can start
+        self.enables = CompiledCode(lambda addr: enables_interrupts(self.instructions[addr]))
+        self.waiting = bool(np.isfinite(self.deadline).any())
+        self.stopped = False
+        self.steps = 0
+
+    def evict(self, lanes: Lanes) -> None:
+        self.evicted[lanes] = True
+        self.stopped = True
+
+    def address(self, lanes: Lanes, addr: np.ndarray) -> np.ndarray:
+        # list indexing like SparseMemory: negative addresses count from the end, the rest fail
+        outside = (addr < -self.size) | (addr >= self.size)
+        if outside.any():
+            self.evict(lanes[outside])
+            addr = np.where(outside, 0, addr)
+        return np.where(addr < 0, addr + self.size, addr)
+
+    def static_address(self, addr: int) -> int | None:
+        if -self.size <= addr < self.size:
+            return addr % self.size
+        return None
+
+    def in_code(self, addr: np.ndarray) -> np.ndarray:
+        return (addr >= -self.size) & (addr < self.size)
+
+    def reader(self, arg_type: int, value: int) -> Reader:
+        memory = self.memory
+        if arg_type == 0:
+            return lambda lanes: np.full(lanes.shape, value, dtype=np.int64)
+        if arg_type == 1:
+            register = self.reg[registers[value]]
+            return lambda lanes: register[lanes]
+        if arg_type in (2, 4):
+            addr = self.static_address(value)
+            if addr is None:
+                return self.failing_reader
+            if arg_type == 2:
+                return lambda lanes: memory[addr, lanes]
+            return lambda lanes: memory[self.address(lanes, memory[addr, lanes]), lanes]
+        return lambda lanes: np.zeros(lanes.shape, dtype=np.int64)
+
+    def failing_reader(self, lanes: Lanes) -> np.ndarray:
+        self.evict(lanes)
+        return np.zeros(lanes.shape, dtype=np.int64)
+
+    def set_flags(self, lanes: Lanes, values: np.ndarray) -> None:
+        self.flag_z[lanes] = values == 0
+        self.flag_n[lanes] = values < 0
+
+    def write_register(self, lanes: Lanes, name: Registers, values: np.ndarray, addr: int) -> None:
+        if name != Registers.rip:
+            self.reg[name][lanes] = values
+            self.reg[Registers.rip][lanes] = addr + 1
+            return
+        # the reference engine reads the word at the written value right away, see ThreadedControlUnit.checked_jump
+        outside = ~self.in_code(values)
+        if outside.any():
+            self.evict(lanes[outside])
+        self.reg[Registers.rip][lanes] = values + 1
+
+    def write_memory(self, lanes: Lanes, addr: int | np.ndarray | None, values: np.ndarray) -> None:
+        if addr is None:
+            self.evict(lanes)
+            return
+        self.memory[addr, lanes] = to_words(values)
+
+    def compile_instruction(self, addr: int, instr: Command) -> Operation:
+        opcode = instr.opcode
+        if opcode in branch_commands:
+            return self.compile_branch(addr, instr)
+        if opcode in alu_commands:
+            return self.compile_alu(addr, instr)
+        if opcode == Commands.mov:
+            return self.compile_mov(addr, instr)
+        if opcode == Commands.movi:
+            return self.compile_port_in(addr, instr)
+        if opcode == Commands.movo:
+            return self.compile_port_out(addr, instr)
+        return self.compile_control(addr, instr)
+
+    def compile_branch(self, addr: int, instr: Command) -> Operation:
+        rip = self.reg[Registers.rip]
+        taken = branch_target(addr, instr)
+        conditions: dict[Commands, Callable[[Lanes], np.ndarray]] = {
+            Commands.jmp: lambda lanes: np.ones(lanes.shape, dtype=bool),
+            Commands.jz: lambda lanes: self.flag_z[lanes] != 0,
+            Commands.jnz: lambda lanes: self.flag_z[lanes] == 0,
+            Commands.jn: lambda lanes: self.flag_n[lanes] != 0,
+            Commands.jp: lambda lanes: self.flag_n[lanes] == 0,
+        }
+        condition = conditions[instr.opcode]
+        leaves_code = self.static_address(taken - 1) is None
+
+        def branch(lanes: Lanes) -> None:
+            jumps = condition(lanes)
+            if leaves_code and jumps.any():
+                self.evict(lanes[jumps])
+            rip[lanes] = np.where(jumps, taken, addr + 1)
+
+        return branch
+
+    def compile_alu(self, addr: int, instr: Command) -> Operation:
+        opcode = instr.opcode
+        fn = VECTOR_OPERATORS[opcode]
+        bound = MUL_BOUND if opcode == Commands.mul else WIDE_BOUND
+        divides = opcode in (Commands.div, Commands.mod)
+        left = self.reader(instr.arg1_type, instr.arg1_value)
+        right = self.reader(instr.arg2_type, instr.arg2_value)
+        to_register = instr.arg1_type == 1
+        name = registers[instr.arg1_value] if to_register else Registers.rax
+        target = None if to_register else self.static_address(instr.arg1_value)
+
+        def perform(lanes: Lanes) -> None:
+            a, b = left(lanes), right(lanes)
+            inexact = (np.abs(a) >= bound) | (np.abs(b) >= bound)
+            if divides:
+                zero = b == 0
+                inexact |= zero
+                b = np.where(zero, 1, b)
+            if inexact.any():
+                self.evict(lanes[inexact])
+                a, b = np.where(inexact, 0, a), np.where(inexact, 1, b)
+            values = fn(a, b)
+            overflow = values >= MAX_NUM
+            underflow = values <= -MAX_NUM
+            values = values - MAX_NUM * overflow + MAX_NUM * underflow
+            self.flag_of[lanes] = overflow | underflow
+            self.set_flags(lanes, values)
+            if opcode == Commands.cmp:
+                self.reg[Registers.rip][lanes] = addr + 1
+            elif to_register:
+                self.write_register(lanes, name, values, addr)
+            else:
+                self.write_memory(lanes, target, values)
+                self.reg[Registers.rip][lanes] = addr + 1
+
+        return perform
+
+    def compile_mov(self, addr: int, instr: Command) -> Operation:
+        right = self.reader(instr.arg2_type, instr.arg2_value)
+        rip = self.reg[Registers.rip]
+
+        if instr.arg1_type == 1:
+            name = registers[instr.arg1_value]
+
+            def load(lanes: Lanes) -> None:
+                values = right(lanes)
+                self.set_flags(lanes, values)
+                self.write_register(lanes, name, values, addr)
+
+            return load
+
+        if instr.arg2_type == 1 or instr.arg1_type == 2:
+            target = self.static_address(instr.arg1_value)
+
+            def store(lanes: Lanes) -> None:
+                self.write_memory(lanes, target, right(lanes))
+                rip[lanes] = addr + 1
+
+            return store
+
+        pointer = self.static_address(instr.arg1_value) if instr.arg1_type == 4 else 0
+
+        def move(lanes: Lanes) -> None:
+            values = right(lanes)
+            if pointer is None:
+                self.write_memory(lanes, None, values)
+            else:
+                target = self.address(lanes, self.memory[pointer, lanes]) if instr.arg1_type == 4 else 0
+                self.write_memory(lanes, target, values)
+            rip[lanes] = addr + 1
+
+        return move
+
+    def compile_port_in(self, addr: int, instr: Command) -> Operation:
+        target = self.static_address(instr.arg1_value)
+        rip = self.reg[Registers.rip]
+
+        def port_in(lanes: Lanes) -> None:
+            if instr.arg2_value != 0 or target is None:
+                self.evict(lanes)
+                return
+            for lane in lanes.tolist():
+                tokens, position = self.inputs[lane], self.consumed[lane]
+                if position == len(tokens):
+                    # the end of input stops the machine after the fetch, like EOFError in the other engines
+                    self.halted[lane] = True
+                    self.tick[lane] += FETCH_TICKS
+                    continue
+                self.memory[target, lane] = to_word(token_value(tokens[position][1]))
+                self.consumed[lane] = position = position + 1
+                self.deadline[lane] = tokens[position][0] if position < len(tokens) else np.inf
+            self.waiting = bool(np.isfinite(self.deadline).any())
+            self.stopped = True
+            rip[lanes] = addr + 1
+
+        return port_in
+
+    def compile_port_out(self, addr: int, instr: Command) -> Operation:
+        right = self.reader(instr.arg2_type, instr.arg2_value)
+        rip = self.reg[Registers.rip]
+
+        def port_out(lanes: Lanes) -> None:
+            if instr.arg1_value != 1:
+                self.evict(lanes)
+                return
+            for lane, value in zip(lanes.tolist(), right(lanes).tolist()):
+                if 0 <= value < 0x110000:
+                    self.outputs[lane].append(chr(value))
+                else:
+                    self.evict(np.array([lane]))
+            rip[lanes] = addr + 1
+
+        return port_out
+
+    def compile_control(self, addr: int, instr: Command) -> Operation:
+        reg, memory = self.reg, self.memory
+        rip, rst, rsp, rax = reg[Registers.rip], reg[Registers.rst], reg[Registers.rsp], reg[Registers.rax]
+
+        def halt(lanes: Lanes) -> None:
+            self.halted[lanes] = True
+            self.stopped = True
+            self.tick[lanes] += FETCH_TICKS
+
+        def enable(lanes: Lanes) -> None:
+            rst[lanes] |= 1
+            rip[lanes] = addr + 1
+
+        def disable(lanes: Lanes) -> None:
+            rst[lanes] &= ~1
+            rip[lanes] = addr + 1
+
+        def interrupt_return(lanes: Lanes) -> None:
+            rsp[lanes] += 1
+            rax[lanes] = memory[self.address(lanes, rsp[lanes]), lanes]
+            rsp[lanes] += 1
+            self.write_register(lanes, Registers.rip, memory[self.address(lanes, rsp[lanes]), lanes] - 1, addr)
+            rst[lanes] |= 1
+
+        def nop(lanes: Lanes) -> None:
+            rip[lanes] = addr + 1
+
+        operations: dict[Commands, Operation] = {
+            Commands.hlt: halt,
+            Commands.ei: enable,
+            Commands.di: disable,
+            Commands.iret: interrupt_return,
+        }
+        return operations.get(instr.opcode, nop)
+
+    def interrupt(self, lanes: Lanes) -> None:
+        reg, memory = self.reg, self.memory
+        rsp = reg[Registers.rsp]
+        reg[Registers.rst][lanes] = 0
+        memory[self.address(lanes, rsp[lanes]), lanes] = to_words(reg[Registers.rip][lanes])
+        rsp[lanes] -= 1
+        memory[self.address(lanes, rsp[lanes]), lanes] = to_words(reg[Registers.rax][lanes])
+        rsp[lanes] -= 1
+        reg[Registers.rip][lanes] = memory[1, lanes]
+        self.tick[lanes] += INTERRUPT_TICKS
+
+    def step(self, lanes: Lanes, addr: int) -> None:
+        try:
+            operation = self.operations[addr]
+        except IndexError:
+            # fetching outside code memory
+            self.evict(lanes)
+            return
+        self.stopped = False
+        operation(lanes)
+        self.steps += 1
+        if self.stopped:
+            lanes = lanes[~(self.halted[lanes] | self.evicted[lanes])]
+        self.tick[lanes] += self.costs[addr]
+        self.counter[lanes] += 1
+        if not (self.waiting or self.enables[addr]):
+            return
+        rst = self.reg[Registers.rst]
+        rst[lanes[self.deadline[lanes] <= self.tick[lanes]]] |= 2
+        ready = lanes[rst[lanes] & 3 == 3]
+        if ready.size:
+            self.interrupt(ready)
+
+    def run(self) -> None:
+        rip = self.reg[Registers.rip]
+        while True:
+            running = ~(self.halted | self.evicted) & (self.counter < self.limit)
+            if not running.any():
+                return
+            addr = int(rip[running].min())
+            self.step(np.flatnonzero(running & (rip == addr)), addr)
+
+    def results(self) -> list[tuple[str, int, int]]:
+        return [
+            ("".join(output), int(counter), int(tick))
+            for output, counter, tick in zip(self.outputs, self.counter.tolist(), self.tick.tolist())
+        ]
+
+
+def sweep(
+    data_memories: Sequence[list[str]],
+    code_memory,
+    input_schedules: Sequence[list[InputToken]],
+    memory_size=MAX_MEMORY,
+    limit=DEFAULT_LIMIT,
+    start_addr=0,
+) -> list[tuple[str, int, int]]:
+    # the (output, instr_counter, ticks) of simulation for every data memory and input schedule pair
+    vector = VectorMachine(data_memories, code_memory, input_schedules, memory_size, limit, start_addr)
+    vector.run()
+    results = vector.results()
+    for index in np.flatnonzero(vector.evicted).tolist():
+        results[index] = simulation(
+            data_memories[index],
+            code_memory,
+            input_schedules[index],
+            memory_size,
+            limit,
+            start_addr,
+            engine="threaded",
+            trace=TraceLevel.off,
+        )
+    return results
+
+
+def vary(data: list[str], values: dict[int, list[int]]) -> list[list[str]]:
+    # every combination of the listed values of the listed data words
+    variants = []
+    for combination in itertools.product(*values.values()):
+        variant = list(data)
+        for addr, value in zip(values, combination):
+            variant[addr] = data_to_hex(value)
+        variants.append(variant)
+    return variants
+
+
+def parse_variation(text: str) -> tuple[int, list[int]]:
+    addr, values = text.split("=", 1)
+    return int(addr), [int(value) for value in values.split(",")]
+
+
+def main(codes_file, datas_file, inputs_file, variations, memory_size=MAX_MEMORY, limit=DEFAULT_LIMIT):
+    start_addr, code = read_code(codes_file)
+    _, data = read_code(datas_file)
+    values = dict(variations)
+    variants = vary(data, values)
+    input_tokens = list(read_input(inputs_file))
+    results = sweep(variants, code, [input_tokens] * len(variants), memory_size, limit, start_addr)
+    for combination, result in zip(itertools.product(*values.values()), results):
+        print(" ".join(f"#{addr}={value}" for addr, value in zip(values, combination)), end=": ")
+        print_result(*result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one program over many data memory variants in lockstep")
+    parser.add_argument("code_file")
+    parser.add_argument("data_file")
+    parser.add_argument("input_file")
+    parser.add_argument(
+        "--vary", type=parse_variation, action="append", default=[], help="ADDR=V1,V2,... values of a data word"
+    )
+    parser.add_argument("--memory-size", type=int, default=MAX_MEMORY)
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    args = parser.parse_args()
+    main(args.code_file, args.data_file, args.input_file, args.vary, args.memory_size, args.limit)
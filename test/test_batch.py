@@ -0,0 +1,59 @@
+import contextlib
+import io
+import os
+import tempfile
+
+import batch
+import machine
+import translator
+from isa import MAX_MEMORY, Command, hex_to_data, read_code
+
+
+def test_batch_matches_simulation():
+    schedules = [
+        [(8, "h"), (18, "e"), (20, "l"), (60, "l"), (100, "o"), (120, "\n")],
+        [(1, "a"), (2, "\n")],
+        [(50, "x"), (51, "y"), (400, "\n")],
+        [],
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp_dir_name:
+        target_t = os.path.join(tmp_dir_name, "target_t.0")
+        target_d = os.path.join(tmp_dir_name, "target_d.0")
+        with contextlib.redirect_stdout(io.StringIO()):
+            translator.main("example/text/cat.text", "example/data/cat.data", target_t, target_d)
+
+        results = sorted(batch.run_batch(target_t, target_d, schedules, workers=2, chunk_size=3))
+
+        start_addr, code = read_code(target_t)
+        _, data = read_code(target_d)
+
+    expected = [
+        (index, *machine.simulation(data, code, list(schedule), MAX_MEMORY, 20000, start_addr))
+        for index, schedule in enumerate(schedules)
+    ]
+    assert results == expected
+
+
+def test_worker_decodes_the_program_once(tmp_path, monkeypatch):
+    target_t, target_d = str(tmp_path / "target_t.0"), str(tmp_path / "target_d.0")
+    with contextlib.redirect_stdout(io.StringIO()):
+        translator.main("example/text/cat.text", "example/data/cat.data", target_t, target_d)
+    start_addr, code = read_code(target_t)
+    _, data = read_code(target_d)
+    monkeypatch.setattr(batch, "worker_options", {})
+
+    batch.init_worker(
+        {"data_memory": data, "code_memory": code, "memory_size": MAX_MEMORY, "limit": 20000, "start_addr": start_addr}
+    )
+    code_memory, data_memory = batch.worker_options["code_memory"], batch.worker_options["data_memory"]
+    assert all(isinstance(command, Command) for command in code_memory)
+    assert list(data_memory) == [hex_to_data(word) for word in data]
+
+    # the jobs of a worker reuse its decoded program and leave it as it was
+    jobs = [(0, [(1, "a"), (2, "\n")]), (1, [(3, "b"), (9, "c"), (12, "\n")]), (2, [(1, "a"), (2, "\n")])]
+    results = batch.run_chunk(jobs)
+    assert results[0][1:] == results[2][1:]
+    assert results[1][1] == "bc\n"
+    assert batch.worker_options["code_memory"] is code_memory
+    assert list(data_memory) == [hex_to_data(word) for word in data]
@@ -0,0 +1,21 @@
+import copy
+
+import benchmark
+
+
+def test_benchmark_report():
+    report = benchmark.run_benchmark(scale=1, repeat=1)
+
+    names = [case["name"] for case in report["cases"]]
+    assert names == ["cat", "hello", "hello_user_name", "prob1", "test", "prob1_x1", "cat_x1"]
+    for case in report["cases"]:
+        runs = list(case["engines"].values())
+        assert all(run["instructions"] == runs[0]["instructions"] for run in runs)
+        assert all(run["ticks"] == runs[0]["ticks"] for run in runs)
+        assert all(run["peak_memory_bytes"] > 0 for run in runs)
+    assert report["cases"][-1]["engines"]["threaded"]["output_length"] == 1001
+
+    slower = copy.deepcopy(report)
+    slower["cases"][0]["engines"]["threaded"]["instructions_per_second"] /= 2
+    assert benchmark.compare(report, report, 0.1) == []
+    assert len(benchmark.compare(report, slower, 0.1)) == 1
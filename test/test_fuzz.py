@@ -0,0 +1,44 @@
+import fuzz
+import machine
+
+
+def test_engines_agree_on_random_programs():
+    failures = list(fuzz.run_fuzz(60, seed=1000, workers=2, chunk_size=20))
+    assert failures == []
+
+
+class MovKeepsFlags(machine.ThreadedControlUnit):
+    # mov to a register that forgets to set the flags
+    def compile_mov(self, instr):
+        handler = super().compile_mov(instr)
+        alu = self.data_path.alu
+
+        def mov():
+            flags = alu.Z, alu.N
+            changed = handler()
+            alu.Z, alu.N = flags
+            return changed
+
+        return mov if instr.arg1_type == 1 else handler
+
+
+def test_mismatches_are_minimized(monkeypatch):
+    monkeypatch.setitem(machine.ENGINES, "broken", MovKeepsFlags)
+    variants = [("broken", False)]
+    case = next(case for case in map(fuzz.random_case, range(100)) if fuzz.find_mismatch(case, variants) is not None)
+
+    minimized = fuzz.minimize(case, variants)
+
+    assert "broken (idle_skip=False) differs" in fuzz.find_mismatch(minimized, variants)
+    assert len(minimized.code) == 1
+    assert minimized.listing()[0].startswith("0 mov %")
+    assert minimized.limit == 1
+
+
+def test_jump_out_of_code_fails_at_once():
+    # found by the fuzzer: iret to a word outside code memory, then the limit before the next fetch
+    nop, iret = "00000000000000000000", "12000000000000000000"
+    case = fuzz.FuzzCase(90760, [nop, "05100000005000000034", iret], [0] * 13 + [1 << 30], [], 3)
+
+    assert fuzz.run_case(case) == ("error", "IndexError", "")
+    assert fuzz.find_mismatch(case, fuzz.default_variants()) is None
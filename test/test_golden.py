@@ -1,3 +1,4 @@
+import concurrent.futures
 import contextlib
 import io
 import logging
@@ -6,19 +7,21 @@ import tempfile
 
 import machine
 import pytest
+import toolchain
 import translator
 
 
-@pytest.mark.golden_test("../golden/*.yml")
-def test_translator_and_machine(golden, caplog):
-    caplog.set_level(logging.INFO)
-
+def translate_and_run(golden, run_machine):
+    # translates the golden sources in a temporary directory, then runs the machine by run_machine(targets, input)
     with tempfile.TemporaryDirectory() as tmp_dir_name:
         source_text = os.path.join(tmp_dir_name, "source.text")
         source_data = os.path.join(tmp_dir_name, "source.data")
         input_stream = os.path.join(tmp_dir_name, "test.txt")
-        target_t = os.path.join(tmp_dir_name, "target_t.0")
-        target_d = os.path.join(tmp_dir_name, "target_d.0")
+        targets = {
+            "text": os.path.join(tmp_dir_name, "target_t.0"),
+            "data": os.path.join(tmp_dir_name, "target_d.0"),
+            "object": os.path.join(tmp_dir_name, "target.o"),
+        }
 
         with open(source_text, "w", encoding="utf-8") as file:
             file.write(golden["in_source_text"])
@@ -28,16 +31,106 @@ def test_translator_and_machine(golden, caplog):
             file.write(golden["in_stdin"])
 
         with contextlib.redirect_stdout(io.StringIO()) as stdout:
-            translator.main(source_text, source_data, target_t, target_d)
+            translator.main(source_text, source_data, targets["text"], targets["data"], targets["object"])
             print("============================================================")
-            machine.main(target_t, target_d, input_stream)
+            run_machine(targets, input_stream)
 
-        with open(target_t, encoding="utf-8") as file:
+        with open(targets["text"], encoding="utf-8") as file:
             code = file.read()
-        with open(target_d, encoding="utf-8") as file:
+        with open(targets["data"], encoding="utf-8") as file:
             data = file.read()
 
-        assert code == golden.out["out_code"]
-        assert data == golden.out["out_data"]
-        assert stdout.getvalue() == golden.out["out_stdout"]
-        assert caplog.text == golden.out["out_log"]
+    return stdout.getvalue(), code, data
+
+
+@pytest.mark.golden_test("../golden/*.yml")
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_translator_and_machine(golden, caplog, engine):
+    caplog.set_level(logging.INFO)
+
+    stdout, code, data = translate_and_run(
+        golden,
+        lambda targets, input_stream: machine.main(targets["text"], targets["data"], input_stream, engine=engine),
+    )
+
+    assert code == golden.out["out_code"]
+    assert data == golden.out["out_data"]
+    assert stdout == golden.out["out_stdout"]
+    assert caplog.text == golden.out["out_log"]
+
+
+@pytest.mark.golden_test("../golden/*.yml")
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_machine_without_trace(golden, caplog, engine):
+    caplog.set_level(logging.INFO)
+
+    stdout, _, _ = translate_and_run(
+        golden,
+        lambda targets, input_stream: machine.main(
+            targets["text"], targets["data"], input_stream, engine=engine, trace=machine.TraceLevel.off
+        ),
+    )
+
+    assert stdout == golden.out["out_stdout"]
+    assert caplog.text == ""
+
+
+@pytest.mark.golden_test("../golden/*.yml")
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_object_without_trace(golden, caplog, engine):
+    caplog.set_level(logging.INFO)
+
+    stdout, _, _ = translate_and_run(
+        golden,
+        lambda targets, input_stream: machine.main_object(
+            targets["object"], input_stream, engine=engine, trace=machine.TraceLevel.off
+        ),
+    )
+
+    assert stdout == golden.out["out_stdout"]
+    assert caplog.text == ""
+
+
+@pytest.mark.golden_test("../golden/*.yml")
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_program_api(golden, caplog, engine):
+    caplog.set_level(logging.INFO)
+
+    program = toolchain.Program.translate(golden["in_source_text"], golden["in_source_data"])
+    result = program.run(golden["in_stdin"], engine=engine, trace=machine.TraceLevel.full)
+
+    stdout = (
+        f"source LoC: {program.source_lines} code instr: {len(program.code)}\n"
+        f"{'=' * 60}\n"
+        f"{result.output}\ninstr_counter:  {result.instr_counter} ticks: {result.ticks}\n"
+    )
+    assert program.code_listing() == golden.out["out_code"]
+    assert program.data_listing() == golden.out["out_data"]
+    assert stdout == golden.out["out_stdout"]
+    # the trace is collected by a logger of the run, the root logger does not see it
+    assert caplog.text == ""
+    lines = golden.out["out_log"].splitlines()
+    assert len(result.trace) == len(lines)
+    assert all(line.endswith(message) for line, message in zip(lines, result.trace))
+
+    # a program runs again from its initial memory
+    assert program.run(golden["in_stdin"], engine=engine).output == result.output
+
+
+def test_traced_runs_leave_the_root_logger_alone(caplog):
+    with (
+        open("example/text/cat.text", encoding="utf-8") as text_file,
+        open("example/data/cat.data", encoding="utf-8") as data_file,
+    ):
+        program = toolchain.Program.translate(text_file.read(), data_file.read())
+    inputs = ["[(8, 'h'), (18, 'i'), (20, '\\n')]", "[(3, 'o'), (40, 'k'), (90, '\\n')]"] * 4
+    expected = [program.run(text, trace=machine.TraceLevel.full).trace for text in inputs]
+    caplog.set_level(logging.WARNING)
+    root_level = logging.getLogger().level
+
+    # runs on several threads at once get their own lines
+    with concurrent.futures.ThreadPoolExecutor(len(inputs)) as executor:
+        results = list(executor.map(lambda text: program.run(text, trace=machine.TraceLevel.full), inputs))
+    assert [result.trace for result in results] == expected
+    assert caplog.text == ""
+    assert logging.getLogger().level == root_level
@@ -0,0 +1,80 @@
+import asyncio
+
+import live
+import machine
+import pytest
+import toolchain
+from isa import MAX_MEMORY
+
+
+def program(name):
+    with (
+        open(f"example/text/{name}.text", encoding="utf-8") as text_file,
+        open(f"example/data/{name}.data", encoding="utf-8") as data_file,
+    ):
+        compiled = toolchain.Program.translate(text_file.read(), data_file.read())
+    return compiled.data_words, compiled.code_words
+
+
+async def typed(text):
+    for char in text:
+        await asyncio.sleep(0)
+        yield char
+
+
+@pytest.mark.parametrize("engine", ["threaded", "jit"])
+def test_live_sessions_share_one_event_loop(engine):
+    data, code = program("cat")
+    # digits would be read as numbers, so sessions are told apart by letters
+    texts = ["session " + "".join(chr(ord("a") + int(digit)) for digit in str(index)) + "\n" for index in range(200)]
+    received = [[] for _ in texts]
+
+    async def write(index, text):
+        received[index].append(text)
+
+    async def run_all():
+        sessions = [
+            live.live_simulation(
+                data,
+                code,
+                typed(text),
+                limit=2000,
+                engine=engine,
+                ports={1: live.AsyncSink(lambda text, index=index: write(index, text))},
+                slice_size=64,
+            )
+            for index, text in enumerate(texts)
+        ]
+        return await asyncio.gather(*sessions)
+
+    results = asyncio.run(run_all())
+
+    assert ["".join(chunks) for chunks in received] == texts
+    # sessions wait for input instead of spending the instruction limit in the loop
+    assert all(instr_counter < 2000 for _, instr_counter, _ in results)
+
+
+def test_live_machine_waits_for_input():
+    data, code = program("cat")
+    output = []
+
+    async def session():
+        input_port = live.LiveInput()
+        data_path = machine.DataPath(data, MAX_MEMORY, {0: input_port, 1: output}, 0)
+        control_unit = machine.make_control_unit("threaded", data_path, 1000, code, MAX_MEMORY, machine.TraceLevel.off)
+        runner = asyncio.create_task(live.run_live(control_unit, slice_size=10))
+        input_port.feed("ab")
+        for _ in range(100):
+            await asyncio.sleep(0)
+        assert output == ["a", "b"]
+        assert control_unit.waiting()
+        assert not control_unit.finished()
+        waited_at = control_unit.instr_counter
+
+        # once the input is closed, the loop spins until the limit like with a schedule that ran out
+        input_port.close()
+        await runner
+        assert waited_at < control_unit.instr_counter == 1000
+
+    asyncio.run(session())
+    assert output == ["a", "b"]
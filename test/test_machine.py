@@ -0,0 +1,389 @@
+import io
+import itertools
+import os
+import tempfile
+
+import isa
+import machine
+import pytest
+import translator
+
+
+def test_read_input_streams_schedule():
+    schedule = "[(1, 'a'), (2, \"'\"), (3, ')'),\n (4, '\\n'), (5, 77), (6, -3), (7, '\\'')]"
+    expected = [(1, "a"), (2, "'"), (3, ")"), (4, "\n"), (5, 77), (6, -3), (7, "'")]
+
+    with tempfile.TemporaryDirectory() as tmp_dir_name:
+        input_stream = os.path.join(tmp_dir_name, "input.txt")
+        with open(input_stream, "w", encoding="utf-8") as file:
+            file.write(schedule)
+
+        for chunk_size in (1, 3, 1 << 16):
+            assert list(machine.read_input(input_stream, chunk_size)) == expected
+
+        with open(input_stream, "w", encoding="utf-8") as file:
+            file.write("[(1, 'a'), __import__('os')]")
+        with pytest.raises(ValueError, match="__import__"):
+            list(machine.read_input(input_stream))
+
+
+def test_input_schedule_reports_empty_buffer():
+    schedule = machine.InputSchedule([(3, "a")])
+
+    assert not schedule.ready(2)
+    assert schedule.ready(3)
+    assert schedule.pop() == (3, "a")
+    assert not schedule
+    with pytest.raises(EOFError):
+        schedule.pop()
+
+
+def build_machine(engine, code, data=None, input_tokens=(), limit=1000):
+    data = data if data is not None else [1] * 16
+    data_path = machine.DataPath(
+        [isa.data_to_hex(value) for value in data], 64, {0: machine.InputSchedule(input_tokens), 1: []}, 0
+    )
+    control_unit = machine.ENGINES[engine](data_path, limit, code, 64, machine.TraceLevel.off)
+    return data_path, control_unit
+
+
+def translate(text, data="section .data\n char: 0"):
+    data_words, code_words = translator.translate(translator.clean_text(data + "\n" + text))
+    return [isa.binary_to_hex(word.binary_code) for word in code_words], [
+        isa.hex_to_data(isa.binary_to_hex(word.binary_code)) for word in data_words
+    ]
+
+
+@pytest.mark.parametrize("opcode", [opcode for opcode in isa.op_commands if opcode != isa.Commands.hlt])
+@pytest.mark.parametrize(("arg1_type", "arg2_type"), list(itertools.product([0, 1, 2, 4], repeat=2)))
+def test_instruction_ticks_match_reference(opcode, arg1_type, arg2_type):
+    arg2_value = 0 if opcode == isa.Commands.movi else 2
+    command = isa.encode_command(isa.op_commands.index(opcode), arg1_type, 1, arg2_type, arg2_value)
+    data_path, control_unit = build_machine("reference", [command], input_tokens=[(0, "a")])
+    data_path.reg.update({name: 1 for name in isa.registers})
+    data_path.set_reg(isa.Registers.rip, 0)
+    data_path.set_reg(isa.Registers.rsp, 5)
+
+    control_unit.decode_and_execute_instruction()
+
+    assert control_unit.current_tick() == machine.instruction_ticks(isa.Command(command))
+
+
+@pytest.mark.parametrize(
+    ("text", "input_tokens"),
+    [
+        ("section .text\n movi #char !0\n movi #char !0\n hlt", [(0, "a")]),
+        ("section .text\n mov %rbx 3\n add %rip %rbx\n nop\n nop\n movo !1 %rbx\n hlt", []),
+        ("section .text\n jmp -4\n nop\n movo !1 65\n hlt", []),
+        ("section .text\n mov #INT .int\n mov %rst 1\n .loop: jmp .loop\n .int: movi #char !0\n hlt", [(9, "x")]),
+        (
+            "section .text\n mov #INT .int\n .l: add %rax 1\n cmp %rax 5\n jn .l\n ei\n .w: jmp .w\n"
+            " .int: movi #char !0\n movo !1 #char\n iret",
+            [(3, "x"), (4, "y")],
+        ),
+    ],
+)
+def test_engines_agree(text, input_tokens):
+    code, data = translate(text)
+    results = []
+    for engine in machine.ENGINES:
+        data_path, control_unit = build_machine(engine, code, data, list(input_tokens), limit=200)
+        control_unit.command_cycle()
+        results.append(
+            (
+                "".join(data_path.ports[1]),
+                control_unit.instr_counter,
+                control_unit.current_tick(),
+                dict(data_path.reg),
+                str(data_path.alu),
+                data_path.dump_memory(),
+            )
+        )
+    assert all(result == results[0] for result in results)
+
+
+@pytest.mark.parametrize(
+    ("text", "input_tokens", "limit"),
+    [
+        (
+            "section .text\n mov #INT .int\n ei\n .loop: cmp #char #stop\n jz .exit\n jmp .loop\n .exit: hlt\n"
+            " .int: movi #char !0\n movo !1 #char\n iret",
+            [(1000, "a"), (7001, "b"), (7002, "c"), (25000, "\n")],
+            40000,
+        ),
+        ("section .text\n .w: nop\n cmp #char 0\n jz .w\n hlt", [(500, "x")], 30001),
+        (
+            "section .text\n mov #INT .int\n .w: cmp %rax 0\n jn .exit\n jmp .w\n .exit: hlt\n .int: iret",
+            [(9, 1)],
+            30000,
+        ),
+        ("section .text\n .w: jmp .w", [], 29999),
+    ],
+)
+def test_idle_skip_matches_stepping(text, input_tokens, limit):
+    code, data = translate(text, "section .data\n char: 0\n stop: 10")
+    results = []
+    for engine, idle_skip in [("reference", False), ("threaded", False), ("threaded", True)]:
+        data_path, control_unit = build_machine(engine, code, data, list(input_tokens), limit=limit)
+        if idle_skip:
+            calls = itertools.count()
+            compiled = control_unit.handlers
+            control_unit.handlers = machine.CompiledCode(
+                lambda addr: lambda handler=compiled[addr]: next(calls) is None or handler()
+            )
+        else:
+            control_unit.idle_skip = False
+        control_unit.command_cycle()
+        results.append(
+            (
+                "".join(data_path.ports[1]),
+                control_unit.instr_counter,
+                control_unit.current_tick(),
+                dict(data_path.reg),
+                str(data_path.alu),
+                data_path.dump_memory(),
+            )
+        )
+    assert all(result == results[0] for result in results)
+    assert next(calls) < results[0][1] // 10
+
+
+@pytest.mark.parametrize(
+    ("text", "input_tokens", "limit"),
+    [
+        # sums with overflow, stores through a pointer, interrupts land inside the loop body
+        (
+            "section .text\n mov #INT .int\n ei\n .l: add %rax 7\n mul %rax 3\n mov #sum %rax\n mov %rbx #ptr\n"
+            " mov *ptr %rbx\n sub %rdx 1\n mod %rdx 5\n jmp .l\n .int: movi #char !0\n movo !1 #char\n iret",
+            [(15, "a"), (16, "b"), (300, "c"), (1001, "d")],
+            1500,
+        ),
+        # a branch on flags set by an earlier block, the limit stops in the middle of a block
+        ("section .text\n .l: cmp %rax 40\n jz .e\n .n: add %rax 1\n nop\n jmp .l\n .e: jp .n\n hlt", [], 1001),
+        (
+            "section .text\n mov #INT .int\n ei\n .w: cmp #char 0\n jz .w\n hlt\n .int: movi #char !0\n iret",
+            [(700, 1)],
+            5000,
+        ),
+    ],
+)
+def test_jit_blocks_match_reference(text, input_tokens, limit):
+    code, data = translate(text, "section .data\n char: 0\n sum: 0\n ptr: 1")
+    results = []
+    for engine, idle_skip in [("reference", False), ("jit", False), ("jit", True)]:
+        data_path, control_unit = build_machine(engine, code, data, list(input_tokens), limit=limit)
+        if engine == "jit":
+            control_unit.hot_block = 2
+            control_unit.idle_skip = idle_skip
+        control_unit.command_cycle()
+        results.append(
+            (
+                "".join(data_path.ports[1]),
+                control_unit.instr_counter,
+                control_unit.current_tick(),
+                dict(data_path.reg),
+                str(data_path.alu),
+                data_path.dump_memory(),
+            )
+        )
+    assert all(result == results[0] for result in results)
+    assert any(block.run is not None for block in control_unit.blocks.values())
+
+
+CAT = (
+    "section .text\n mov #INT .int\n ei\n .loop: cmp #char #stop\n jz .exit\n jmp .loop\n .exit: hlt\n"
+    " .int: movi #char !0\n movo !1 #char\n iret"
+)
+CAT_DATA = "section .data\n char: 0\n stop: 10"
+CAT_INPUT = [(10, "h"), (35, "e"), (36, "l"), (90, "l"), (200, "o"), (201, "\n")]
+
+
+def test_object_file_round_trips_wide_operands(tmp_path):
+    data, code = translator.assemble(
+        "section .data\n char: 0\nsection .text\n mov 302 %rax\n cmp -1 %rax\n mov %rax 70000\n add -300 -2\n hlt"
+    )
+    target = str(tmp_path / "wide.o")
+    isa.write_object(code, data, target)
+
+    start_addr, commands, words = isa.read_object(target)
+    assert start_addr == 0
+    assert [command.hex_string for command in commands] == [format(instruction.word, "020x") for instruction in code]
+    assert [str(command) for command in commands] == [instruction.mnemonic for instruction in code]
+    assert list(words) == [isa.hex_to_data(format(instruction.word, "020x")) for instruction in data]
+
+
+@pytest.mark.parametrize("engine", list(machine.ENGINES))
+@pytest.mark.parametrize("resume_engine", list(machine.ENGINES))
+def test_resume_from_snapshot_matches_single_run(tmp_path, engine, resume_engine):
+    code, data = translate(CAT, "section .data\n char: 0\n stop: 10")
+    data = [isa.data_to_hex(value) for value in data]
+    run = {"memory_size": 64, "start_addr": 0, "trace": machine.TraceLevel.off}
+    expected = machine.simulation(data, code, list(CAT_INPUT), limit=1000, **run)
+    snapshot = str(tmp_path / "state.snap")
+
+    # a run cut short by its limit is continued with a larger one instead of being repeated
+    machine.simulation(data, code, list(CAT_INPUT), limit=40, engine=engine, checkpoint=snapshot, **run)
+    resumed = machine.resume_simulation(
+        snapshot, list(CAT_INPUT), limit=1000, engine=resume_engine, trace=machine.TraceLevel.off
+    )
+    assert resumed == expected
+
+    checkpointed = machine.simulation(
+        data, code, list(CAT_INPUT), limit=1000, engine=engine, checkpoint=snapshot, checkpoint_every=7, **run
+    )
+    assert checkpointed == expected
+    assert machine.load_snapshot(snapshot, []).halted
+
+
+@pytest.mark.parametrize("engine", list(machine.ENGINES))
+def test_snapshot_keeps_wide_operands(tmp_path, engine):
+    # operands above a byte and below zero, in the first and the second position
+    text = (
+        "section .text\n mov %rax 300\n mov 300 %rax\n .loop: add %rax -7\n cmp -1 %rax\n jn .loop\n"
+        " add %rax 73\n movo !1 %rax\n hlt"
+    )
+    code, data = translate(text)
+    data = [isa.data_to_hex(value) for value in data]
+    run = {"memory_size": 1024, "start_addr": 0, "engine": engine, "trace": machine.TraceLevel.off}
+    expected = machine.simulation(data, code, [], limit=10000, **run)
+    assert expected[0] == "H"
+    snapshot = str(tmp_path / "wide.snap")
+
+    machine.simulation(data, code, [], limit=50, checkpoint=snapshot, **run)
+    resumed = machine.resume_simulation(snapshot, [], limit=10000, engine=engine, trace=machine.TraceLevel.off)
+    assert resumed == expected
+    assert machine.simulation(data, code, [], limit=10000, checkpoint=snapshot, checkpoint_every=9, **run) == expected
+
+
+def test_snapshot_forks_with_another_input(tmp_path):
+    code, data = translate(CAT, "section .data\n char: 0\n stop: 10")
+    data = [isa.data_to_hex(value) for value in data]
+    snapshot = str(tmp_path / "prefix.snap")
+    machine.simulation(data, code, CAT_INPUT[:2], 64, 60, 0, trace=machine.TraceLevel.off, checkpoint=snapshot)
+
+    for tail in ([(300, "!"), (301, "\n")], [(250, "?"), (260, "?"), (270, "\n")]):
+        output, _, _ = machine.resume_simulation(
+            snapshot, list(tail), limit=1000, trace=machine.TraceLevel.off, skip_consumed=False
+        )
+        expected, _, _ = machine.simulation(data, code, CAT_INPUT[:2] + tail, 64, 1000, 0, trace=machine.TraceLevel.off)
+        assert output == expected
+
+
+def test_load_snapshot_rejects_other_files(tmp_path):
+    path = tmp_path / "other.snap"
+    path.write_bytes(b"CSA3" + bytes(32))
+    with pytest.raises(ValueError, match=r"other\.snap"):
+        machine.load_snapshot(str(path), [])
+
+
+@pytest.mark.parametrize("engine", list(machine.ENGINES))
+def test_large_sparse_memory(tmp_path, engine):
+    code, data = translate(CAT, "section .data\n char: 0\n stop: 10")
+    data = [isa.data_to_hex(value) for value in data]
+    size = 1 << 24
+    run = {"start_addr": 0, "engine": engine, "trace": machine.TraceLevel.off}
+    expected = machine.simulation(data, code, list(CAT_INPUT), 64, 1000, **run)
+
+    snapshot = tmp_path / "large.snap"
+    assert machine.simulation(data, code, list(CAT_INPUT), size, 1000, checkpoint=str(snapshot), **run) == expected
+    assert snapshot.stat().st_size < 4096
+    control_unit = machine.load_snapshot(str(snapshot), [], engine)
+    assert control_unit.data_path.memory.size == size
+    assert control_unit.instructions.size == size
+
+
+def test_sparse_memory_indexes_like_a_list():
+    memory = machine.SparseMemory(8, 0, [5, 6])
+    words = [5, 6, 0, 0, 0, 0, 0, 0]
+    for addr in (0, 1, 7, -1, -8):
+        assert memory[addr] == words[addr]
+    memory[-1] = 9
+    words[-1] = 9
+    assert memory.dump() == words
+    assert len(memory) == 3
+    for addr in (8, -9):
+        with pytest.raises(IndexError):
+            memory[addr]
+        with pytest.raises(IndexError):
+            memory[addr] = 1
+
+
+class RecordingFile(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, text):
+        self.writes.append(text)
+        return super().write(text)
+
+
+@pytest.mark.parametrize("engine", list(machine.ENGINES))
+def test_output_sinks_stream_port_output(engine):
+    code, data = translate(CAT, "section .data\n char: 0\n stop: 10")
+    data = [isa.data_to_hex(value) for value in data]
+    run = {"memory_size": 64, "limit": 1000, "start_addr": 0, "engine": engine, "trace": machine.TraceLevel.full}
+    expected, instr_counter, ticks = machine.simulation(data, code, list(CAT_INPUT), **run)
+
+    file = RecordingFile()
+    result = machine.simulation(data, code, list(CAT_INPUT), ports={1: machine.WriterSink(file, 4)}, **run)
+    assert result == ("", instr_counter, ticks)
+    assert file.writes == ["hell", "o\n"]
+
+    chars = []
+    sink = machine.BytesSink()
+    assert machine.simulation(data, code, list(CAT_INPUT), ports={1: sink}, **run) == (expected, instr_counter, ticks)
+    machine.simulation(data, code, list(CAT_INPUT), ports={1: machine.CallbackSink(chars.append)}, **run)
+    assert "".join(chars) == expected
+
+
+@pytest.mark.parametrize("engine", list(machine.ENGINES))
+def test_snapshot_keeps_more_output_ports(tmp_path, engine):
+    code, data = translate(CAT.replace("movo !1 #char", "movo !1 #char\n movo !2 #char\n movo !3 #char"), CAT_DATA)
+    data = [isa.data_to_hex(value) for value in data]
+    run = {"memory_size": 64, "start_addr": 0, "engine": engine, "trace": machine.TraceLevel.off}
+    listed, sink = [], machine.BytesSink()
+    expected = machine.simulation(data, code, list(CAT_INPUT), limit=1000, ports={2: listed, 3: sink}, **run)
+    snapshot = str(tmp_path / "ports.snap")
+
+    machine.simulation(
+        data, code, list(CAT_INPUT), limit=40, checkpoint=snapshot, ports={2: [], 3: machine.BytesSink()}, **run
+    )
+    control_unit = machine.load_snapshot(snapshot, list(CAT_INPUT), engine, machine.TraceLevel.off, limit=1000)
+    control_unit.command_cycle()
+    ports = control_unit.data_path.ports
+    assert "".join(ports[1]) == expected[0]
+    assert "".join(ports[2]) == "".join(listed) == expected[0]
+    assert ports[3].text() == sink.text() == expected[0]
+
+
+def test_snapshot_refuses_ports_it_cannot_restore(tmp_path):
+    code, data = translate(CAT, CAT_DATA)
+    data = [isa.data_to_hex(value) for value in data]
+    for port in (machine.CallbackSink(print), machine.InputSchedule([(0, "x")])):
+        with pytest.raises(TypeError, match="2"):
+            machine.simulation(data, code, [], 64, 100, 0, checkpoint=str(tmp_path / "s.snap"), ports={2: port})
+    assert not (tmp_path / "s.snap").exists()
+
+
+def test_output_sink_needs_append():
+    class FlushOnly(machine.OutputSink):
+        def flush(self):
+            pass
+
+    # a sink without append fails when it is made, not at the first write of a run
+    with pytest.raises(TypeError, match="append"):
+        FlushOnly()
+
+
+@pytest.mark.parametrize("engine", list(machine.ENGINES))
+def test_programs_use_more_ports(engine):
+    text = "section .text\n movo !1 #msg\n movi #char !3\n movo !2 #char\n movo !2 msg[1]\n hlt"
+    code, data = translate(text, 'section .data\n char: 0\n msg: "hi"')
+    data = [isa.data_to_hex(value) for value in data]
+    extra = machine.BytesSink()
+    ports = {2: extra, 3: machine.InputSchedule([(0, "x")])}
+    output, _, _ = machine.simulation(
+        data, code, [], 64, 100, 0, engine=engine, trace=machine.TraceLevel.off, ports=ports
+    )
+    assert (output, extra.text()) == ("h", "xi")
@@ -0,0 +1,46 @@
+import machine
+import profiler
+import pytest
+
+
+def run(name, input_tokens=None, **options):
+    if input_tokens is None:
+        input_tokens = list(machine.read_input(f"example/input/{name}.txt"))
+    return profiler.profile_program(f"example/text/{name}.text", f"example/data/{name}.data", input_tokens, **options)
+
+
+@pytest.mark.parametrize("name", ["cat", "prob1", "hello_user_name"])
+def test_profile_accounts_for_every_tick(name):
+    profiles = []
+    for engine, idle_skip in [("reference", False), ("threaded", False), ("threaded", True), ("jit", True)]:
+        profile, (_, instr_counter, ticks), _, _ = run(name, engine=engine, idle_skip=idle_skip)
+        assert profile.total_ticks() == ticks
+        # the final hlt is executed but not counted by instr_counter
+        assert sum(profile.hits.values()) == instr_counter + 1
+        profiles.append((dict(profile.hits), dict(profile.ticks), profile.interrupts, profile.interrupt_ticks))
+    assert all(profile == profiles[0] for profile in profiles)
+
+
+def test_profile_counts_skipped_idle_iterations():
+    input_tokens = [(1000, "a"), (7001, "b"), (25000, "\n")]
+    profiles = []
+    for idle_skip in (False, True):
+        profile, _, _, _ = run("cat", list(input_tokens), limit=100000, idle_skip=idle_skip)
+        profiles.append((dict(profile.hits), dict(profile.ticks)))
+    assert profiles[0] == profiles[1]
+    assert profiles[0][0][2] > 1000
+
+
+def test_report_maps_addresses_to_source():
+    profile, _, code, source_map = run("cat")
+
+    report = profiler.hot_spots(profile, code, source_map, top=3)
+    assert "interrupts: 6 (24 ticks)" in report
+    assert "     2          9         27  19.4%  .loop                4  .loop: cmp #char #stop\n" in report
+    assert "\nhlt                       1          1   0.7%\n" in report
+    assert "\n<interrupt>               6         24  17.3%\n" in report
+
+    stacks = profiler.collapsed_stacks(profile, source_map, "cat")
+    assert "cat;.loop;3 jz .exit 18" in stacks
+    assert "cat;<interrupt> 24" in stacks
+    assert sum(int(stack.rsplit(" ", 1)[1]) for stack in stacks) == profile.total_ticks()
@@ -0,0 +1,116 @@
+import functools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import server
+import toolchain
+
+
+def source(name):
+    with (
+        open(f"example/text/{name}.text", encoding="utf-8") as text_file,
+        open(f"example/data/{name}.data", encoding="utf-8") as data_file,
+    ):
+        return text_file.read(), data_file.read()
+
+
+def expected(name, input_text, limit=20000):
+    result = toolchain.Program.translate(*source(name)).run(input_text, limit=limit, engine="threaded")
+    return result.output, result.instr_counter, result.ticks
+
+
+def test_programs_are_cached_by_source(monkeypatch):
+    monkeypatch.setattr(server, "programs", server.OrderedDict())
+    monkeypatch.setattr(server, "PROGRAM_CACHE", 2)
+    texts = [source(name) for name in ("cat", "hello", "prob1")]
+
+    first, cached = server.cached_program(*texts[0])
+    assert not cached
+    assert server.cached_program(*texts[0]) == (first, True)
+    server.cached_program(*texts[1])
+    server.cached_program(*texts[2])
+    assert not server.cached_program(*texts[0])[1]
+
+    # comments and spacing do not change the translation, nor the cache entry
+    text, data = texts[0]
+    commented = "; cat\n" + text.replace("\n", "   ; a comment\n\n")
+    assert server.cached_program(commented, data) == (server.cached_program(*texts[0])[0], True)
+
+
+def test_stdio_server_answers_run_requests():
+    text, data = source("cat")
+    requests = [
+        {"id": 1, "text": text, "data": data, "input": [[8, "h"], [18, "i"], [20, "\n"]]},
+        {"id": 2, "text": text, "data": data, "input": "[(1, 'o'), (5, 'k'), (9, '\\n')]", "limit": 40},
+        {"id": 3, "text": "section .text\n jmp .missing"},
+    ]
+    lines = "\n".join(map(json.dumps, requests)) + "\nnot json\n"
+
+    completed = subprocess.run(
+        [sys.executable, "server.py", "--workers", "2"], input=lines, capture_output=True, text=True, timeout=120
+    )
+
+    responses = {response["id"]: response for response in map(json.loads, completed.stdout.splitlines())}
+    assert (responses[1]["output"], responses[1]["instr_counter"], responses[1]["ticks"]) == expected(
+        "cat", "[(8, 'h'), (18, 'i'), (20, '\\n')]"
+    )
+    assert (responses[2]["output"], responses[2]["instr_counter"], responses[2]["ticks"]) == expected(
+        "cat", requests[1]["input"], limit=40
+    )
+    assert responses[3]["error"].startswith("KeyError")
+    assert responses[None]["error"].startswith("JSONDecodeError")
+
+
+def test_unix_socket_server_reuses_warm_programs(tmp_path):
+    text, data = source("prob1")
+    path = str(tmp_path / "server.sock")
+    with ProcessPoolExecutor(max_workers=1, initializer=server.init_worker) as executor:
+        server.warm_up(executor, 1)
+        with server.UnixServer(path, executor) as unix_server:
+            thread = threading.Thread(target=unix_server.serve_forever)
+            thread.start()
+            try:
+                with socket.socket(socket.AF_UNIX) as client:
+                    client.connect(path)
+                    for index in range(2):
+                        client.sendall(json.dumps({"id": index, "text": text, "data": data}).encode() + b"\n")
+                    client.shutdown(socket.SHUT_WR)
+                    with client.makefile(encoding="utf-8") as answers:
+                        responses = [json.loads(line) for line in answers]
+            finally:
+                unix_server.shutdown()
+                thread.join()
+
+    assert [response["cached"] for response in responses] == [False, True]
+    assert all(
+        (response["output"], response["instr_counter"], response["ticks"]) == expected("prob1", "")
+        for response in responses
+    )
+
+
+def test_requests_that_are_not_objects_get_an_error():
+    sent = []
+    with ProcessPoolExecutor(max_workers=1, initializer=server.init_worker) as executor:
+        server.serve_lines(["[1]\n", '"x"\n', "3\n", "null\n"], sent.append, executor)
+
+    responses = [json.loads(line) for line in sent]
+    assert len(responses) == 4
+    assert all(response["id"] is None and response["error"].startswith("TypeError") for response in responses)
+
+
+def test_requests_to_a_broken_pool_get_an_error():
+    text, data = source("cat")
+    lines = [json.dumps({"id": index, "text": text, "data": data}) for index in range(3)]
+    sent = []
+    # every worker exits as it starts, so the pool breaks under the first request
+    with ProcessPoolExecutor(max_workers=1, initializer=functools.partial(os._exit, 1)) as executor:
+        server.serve_lines(lines, sent.append, executor)
+
+    responses = {response["id"]: response for response in map(json.loads, sent)}
+    assert sorted(responses) == [0, 1, 2]
+    assert all(response["error"].startswith("BrokenProcessPool") for response in responses.values())
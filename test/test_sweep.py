@@ -0,0 +1,54 @@
+import contextlib
+import logging
+import random
+
+import fuzz
+import machine
+import pytest
+import toolchain
+from isa import MAX_MEMORY, data_to_hex
+
+sweep = pytest.importorskip("sweep")
+
+
+def test_sweep_matches_simulation_on_prob1():
+    with (
+        open("example/text/prob1.text", encoding="utf-8") as text_file,
+        open("example/data/prob1.data", encoding="utf-8") as data_file,
+    ):
+        program = toolchain.Program.translate(text_file.read(), data_file.read())
+    start_addr, code, data = program.start_addr, program.code_words, program.data_words
+
+    variants = sweep.vary(data, {3: [2, 5, 7], 4: [3, 10, 11, 40]})
+    tokens = list(machine.read_input("example/input/prob1.txt"))
+    results = sweep.sweep(variants, code, [tokens] * len(variants), MAX_MEMORY, 100000, start_addr)
+
+    expected = [machine.simulation(variant, code, tokens, MAX_MEMORY, 100000, start_addr) for variant in variants]
+    assert results == expected
+    assert len(set(results)) > 1
+
+
+def test_sweep_matches_reference_on_random_programs(caplog):
+    caplog.set_level(logging.ERROR)
+    evicted = 0
+    for seed in range(40):
+        case = fuzz.random_case(seed, 24)
+        rng = random.Random(seed)
+        datas, schedules, expected = [], [], []
+        for _ in range(6):
+            data = list(case.data)
+            data[rng.randrange(len(data))] = fuzz.random_value(rng)
+            schedule = case.input_tokens[: rng.randrange(len(case.input_tokens) + 1)]
+            words = [data_to_hex(value) for value in data]
+            with contextlib.suppress(ArithmeticError, IndexError, KeyError, ValueError):
+                # programs that crash are left out, sweep raises the same error from the rerun
+                args = words, case.code, schedule, fuzz.MEMORY_SIZE, case.limit, 0
+                expected.append(machine.simulation(*args, trace=machine.TraceLevel.off))
+                datas.append(words)
+                schedules.append(schedule)
+        vector = sweep.VectorMachine(datas, case.code, schedules, fuzz.MEMORY_SIZE, case.limit, 0)
+        vector.run()
+        evicted += int(vector.evicted.sum())
+
+        assert sweep.sweep(datas, case.code, schedules, fuzz.MEMORY_SIZE, case.limit) == expected
+    assert evicted > 0
@@ -0,0 +1,65 @@
+import random
+
+import machine
+import pytest
+import timetravel
+import toolchain
+from machine import TraceLevel
+
+
+def travel_through(golden, engine, interval):
+    program = toolchain.Program.translate(golden["in_source_text"], golden["in_source_data"])
+    tokens = machine.parse_input(golden["in_stdin"])
+    return timetravel.TimeTravel(program.memory, program.commands, tokens, engine=engine, interval=interval)
+
+
+@pytest.mark.golden_test("../golden/*.yml")
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_seek_gives_the_states_of_a_straight_run(golden, engine):
+    # the same run without rewinding, paused after every instruction
+    straight = travel_through(golden, engine, interval=1 << 30).seek(0)
+    states = [str(straight)]
+    while not straight.finished():
+        straight.command_cycle(straight.instr_counter + 1)
+        # hlt stops the machine without counting, the halted state stands for its step
+        states[straight.instr_counter :] = [str(straight)]
+    travel = travel_through(golden, engine, interval=7)
+    assert travel.end == len(states) - 1
+    assert len(travel.states) == -(-travel.end // 7) + 1
+
+    steps = list(range(travel.end + 1))
+    random.Random(0).shuffle(steps)
+    for step in steps:
+        assert str(travel.seek(step)) == states[step]
+    middle = travel.end // 2
+    travel.seek(middle)
+    assert str(travel.back(3)) == states[middle - 3]
+    assert str(travel.step()) == states[middle - 2]
+    assert str(travel.seek(-5)) == states[0]
+    assert str(travel.seek(travel.end + 5)) == states[-1]
+
+
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_seek_tick_and_output(engine):
+    with (
+        open("example/text/cat.text", encoding="utf-8") as text_file,
+        open("example/data/cat.data", encoding="utf-8") as data_file,
+    ):
+        program = toolchain.Program.translate(text_file.read(), data_file.read())
+    tokens = [(10 + 40 * index, char) for index, char in enumerate("time travel\n")]
+    expected = program.run(tokens, engine=engine)
+    travel = timetravel.TimeTravel(program.memory, program.commands, tokens, engine=engine, interval=16)
+    assert travel.position() == (expected.instr_counter, expected.ticks)
+
+    ticks = [travel.seek(step).current_tick() for step in range(travel.end + 1)]
+    for step in range(0, travel.end, 5):
+        for tick in (ticks[step], ticks[step + 1] - 1):
+            assert travel.seek_tick(tick).instr_counter == step
+    assert travel.seek_tick(ticks[-1] + 100).instr_counter == travel.end
+
+    # the output written so far goes back with the state
+    output = travel.seek(travel.end).data_path.ports[1]
+    assert "".join(output) == expected.output
+    assert "".join(travel.seek(0).data_path.ports[1]) == ""
+    assert "".join(travel.seek(travel.end).data_path.ports[1]) == expected.output
+    assert travel.control_unit.trace == TraceLevel.off
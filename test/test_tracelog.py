@@ -0,0 +1,89 @@
+import contextlib
+import io
+import logging
+import subprocess
+import sys
+
+import machine
+import pytest
+import toolchain
+import tracelog
+from isa import MAX_MEMORY
+
+
+@pytest.mark.golden_test("../golden/*.yml")
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_recorded_trace_renders_golden_log(golden, tmp_path, engine):
+    trace_file = tmp_path / "run.trace"
+    program = toolchain.Program.translate(golden["in_source_text"], golden["in_source_data"])
+
+    result = program.run(golden["in_stdin"], engine=engine, record=str(trace_file))
+
+    state = tracelog.TraceState()
+    lines = list(tracelog.render(trace_file.read_bytes(), state))
+    assert "".join(f"{line}\n" for line in lines) == golden.out["out_log"]
+    assert result.trace is None
+    assert trace_file.stat().st_size < len(golden.out["out_log"]) // 4
+
+
+@pytest.mark.parametrize(
+    ("name", "input_text", "limit"),
+    [
+        # the interrupt handler reads past the end of input
+        ("hello_user_name", "[(5, 'A'), (9, 'l')]", 20000),
+        # no newline, so the loop spins until the limit
+        ("cat", "[(3, 'a'), (50, 'b')]", 300),
+    ],
+)
+def test_recorded_trace_renders_warnings_and_memory(name, input_text, limit, tmp_path, caplog):
+    trace_file = tmp_path / "run.trace"
+    with (
+        open(f"example/text/{name}.text", encoding="utf-8") as text_file,
+        open(f"example/data/{name}.data", encoding="utf-8") as data_file,
+    ):
+        program = toolchain.Program.translate(text_file.read(), data_file.read())
+    caplog.set_level(logging.INFO)
+    tokens = machine.parse_input(input_text)
+    # the text log of simulation goes to the root logger, as on the command line
+    machine.simulation(
+        program.memory, program.commands, tokens, MAX_MEMORY, limit, 0, "threaded", machine.TraceLevel.full
+    )
+    logged = caplog.text
+    caplog.clear()
+
+    program.run(input_text, limit=limit, engine="threaded", record=str(trace_file))
+
+    state = tracelog.TraceState()
+    rendered = "".join(f"{line}\n" for line in tracelog.render(trace_file.read_bytes(), state))
+    assert rendered == logged
+    assert "WARNING" in rendered
+    assert state.memory
+
+
+@pytest.mark.parametrize("engine", machine.ENGINES)
+def test_recorded_run_leaves_the_text_log_empty(tmp_path, caplog, engine):
+    with (
+        open("example/text/cat.text", encoding="utf-8") as text_file,
+        open("example/data/cat.data", encoding="utf-8") as data_file,
+    ):
+        program = toolchain.Program.translate(text_file.read(), data_file.read())
+    code_file, data_file_name, trace_file = tmp_path / "cat.code", tmp_path / "cat.data", tmp_path / "cat.trace"
+    code_file.write_text(program.code_listing(), encoding="utf-8")
+    data_file_name.write_text(program.data_listing(), encoding="utf-8")
+    files = [str(code_file), str(data_file_name), "example/input/cat.txt"]
+    caplog.set_level(logging.INFO)
+
+    # the full trace level is the default of the command line, the recorder takes its place
+    with contextlib.redirect_stdout(io.StringIO()) as stdout:
+        machine.main(*files, engine=engine, trace=machine.TraceLevel.full, record=str(trace_file))
+    assert caplog.text == ""
+    assert stdout.getvalue().startswith("hello")
+    assert any("INPUT" in line for line in tracelog.render(trace_file.read_bytes()))
+
+    command = [sys.executable, "machine.py", *files, "--engine", engine, "--record", str(trace_file)]
+    recorded = subprocess.run(command, capture_output=True, text=True, timeout=60)
+    assert recorded.returncode == 0
+    assert recorded.stderr == ""
+    rejected = subprocess.run([*command, "--trace", "full"], capture_output=True, text=True, timeout=60)
+    assert rejected.returncode == 2
+    assert "--record" in rejected.stderr
@@ -0,0 +1,140 @@
+import os
+from pathlib import Path
+
+import benchmark
+import pytest
+import toolchain
+import translator
+
+
+def listing(instructions):
+    return [str(instruction) for instruction in instructions]
+
+
+@pytest.mark.parametrize("name", [path.stem for path in sorted(Path("example/text").glob("*.text"))])
+def test_assemble_matches_translate_on_examples(name):
+    with open(f"example/data/{name}.data", encoding="utf-8") as file:
+        source = file.read()
+    with open(f"example/text/{name}.text", encoding="utf-8") as file:
+        source += "\n" + file.read()
+
+    data, code = translator.assemble(source)
+    expected_data, expected_code = translator.translate(translator.clean_text(source))
+
+    assert listing(data) == listing(expected_data)
+    assert listing(code) == listing(expected_code)
+
+
+@pytest.mark.parametrize("lines", [8, 1000])
+def test_assemble_matches_translate_on_generated_source(lines):
+    source = benchmark.generate_program(lines)
+
+    data, code = translator.assemble(source)
+    expected_data, expected_code = translator.translate(translator.clean_text(source))
+
+    assert listing(data) == listing(expected_data)
+    assert listing(code) == listing(expected_code)
+    assert [instruction.binary_code for instruction in code] == [
+        instruction.binary_code for instruction in expected_code
+    ]
+
+
+@pytest.mark.parametrize(
+    ("source", "error"),
+    [
+        ("section .data\n a: 1\n a: 2\nsection .text\n hlt", KeyError),
+        ("section .data\nsection .text\n jmp .missing", KeyError),
+        ("section .data\nsection .text\n mov %rzz 1", ValueError),
+        ("section .data\nsection .text\n push 1", ValueError),
+    ],
+)
+def test_assemble_rejects_invalid_source(source, error):
+    with pytest.raises(error):
+        translator.assemble(source)
+
+
+def test_translation_cache_reuses_unchanged_sources(tmp_path, monkeypatch):
+    source = benchmark.generate_program(64)
+    expected = translator.assemble(source)
+    cache = translator.TranslationCache(str(tmp_path))
+    translator.memo.clear()
+
+    data, code = translator.translate_cached(source, cache)
+    assert (listing(data), listing(code)) == tuple(map(listing, expected))
+    assert len(list(tmp_path.glob("*.lst"))) == 1
+
+    def fail(source):
+        raise AssertionError(source)
+
+    monkeypatch.setattr(translator, "assemble", fail)
+    # comments and indentation do not change the cleaned source, so the memo answers
+    data, code = translator.translate_cached(source.replace("\n", "  ; comment\n"), cache)
+    assert (listing(data), listing(code)) == tuple(map(listing, expected))
+
+    translator.memo.clear()
+    data, code = translator.translate_cached(source, cache)
+    assert (listing(data), listing(code)) == tuple(map(listing, expected))
+
+
+def test_translation_cache_evicts_least_recently_used(tmp_path):
+    sources = [benchmark.generate_program(8 * (index + 1)) for index in range(3)]
+    keys = [translator.source_key(translator.clean_source(source)) for source in sources]
+    listings = [translator.format_listing(*translator.assemble(source)) for source in sources]
+    cache = translator.TranslationCache(str(tmp_path), max_bytes=len(listings[0]) + len(listings[2]))
+
+    cache.put(keys[0], *translator.assemble(sources[0]))
+    cache.put(keys[1], *translator.assemble(sources[1]))
+    os.utime(cache.path(keys[1]), ns=(0, 0))
+    cache.put(keys[2], *translator.assemble(sources[2]))
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+
+
+@pytest.mark.parametrize("case", benchmark.example_cases(), ids=lambda case: case.name)
+def test_peephole_keeps_example_output(case):
+    savings = benchmark.peephole_savings(case)
+    assert savings["same_output"]
+    assert savings["optimized_code_words"] <= savings["code_words"]
+    assert savings["optimized_ticks"] <= savings["ticks"]
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        # jump threading, then the skipped jump and the jump to the next instruction go away
+        ("jmp .a\n .a: jmp .b\n nop\n .b: hlt", ["hlt"]),
+        # unreachable code after hlt, branch inversion
+        (
+            "jmp .b\n nop\n .a: hlt\n .b: cmp %rax 1\n jz .c\n jmp .a\n .c: hlt",
+            ["jmp 2", "hlt", "cmp %rax 1", "jnz 1", "hlt"],
+        ),
+        # repeated and reversed moves, a compare whose flags are never read
+        (
+            "mov %rbx %rax\n mov %rbx %rax\n mov %rax %rbx\n mov #char %rax\n mov %rax #char\n cmp %rax 1\n cmp %rax 2\n"
+            " jz .e\n .e: hlt",
+            ["mov %rbx %rax", "mov #2 %rax", "mov %rax #2", "cmp %rax 2", "hlt"],
+        ),
+        # the interrupt handler writes #char, so the main loop keeps rereading it
+        (
+            "mov #INT .h\n ei\n .l: mov %rbx #char\n mov %rbx #char\n jmp .l\n .h: movi #char !0\n iret",
+            ["mov #1 5", "ei", "mov %rbx #2", "mov %rbx #2", "jmp 2", "movi #2 !0", "iret"],
+        ),
+        # code addresses taken without labels leave the program as it is
+        ("mov %rbx 3\n add %rip %rbx\n jmp .a\n nop\n .a: hlt", ["mov %rbx 3", "add %rip %rbx", "jmp 4", "nop", "hlt"]),
+        ("jmp 2\n nop\n hlt", ["jmp 2", "nop", "hlt"]),
+        ("mov #INT 3\n ei\n .l: jmp .l\n hlt", ["mov #1 3", "ei", "jmp 2", "hlt"]),
+    ],
+)
+def test_peephole_rewrites(text, expected):
+    _, code = translator.assemble("section .data\n char: 0\nsection .text\n " + text, optimize=True)
+    assert [instruction.mnemonic for instruction in code] == expected
+
+
+def test_peephole_keeps_a_store_to_a_numbered_word():
+    # `mov 3 %rax` stores rax to word 3 (ch) after `mov %rax 3` loaded the number 3
+    data = "section .data\n a: 0\n ch: 0"
+    text = "section .text\n mov %rax 3\n mov 3 %rax\n add #ch 65\n movo !1 #ch\n hlt"
+    outputs = [toolchain.Program.translate(text, data, optimize).run().output for optimize in (False, True)]
+    assert outputs == ["D", "D"]
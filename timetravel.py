@@ -0,0 +1,166 @@
+from __future__ import annotations
+
+import argparse
+import bisect
+import itertools
+from typing import Final
+
+from isa import MAX_MEMORY, Command, Commands, Registers, read_code
+from machine import (
+    DEFAULT_LIMIT,
+    ControlUnit,
+    DataPath,
+    InputSchedule,
+    InputToken,
+    TraceLevel,
+    make_control_unit,
+    read_input,
+)
+
+SEEK_INTERVAL: Final = 10000
+
+
+class MachineState:
+    # What changes while a program runs, copied out of the data path and the control unit; the code memory is
+    # left out, instructions never write it.
+    def __init__(self, control_unit: ControlUnit):
+        data_path = control_unit.data_path
+        input_port, output_port = data_path.ports[0], data_path.ports[1]
+        assert isinstance(input_port, InputSchedule)
+        assert isinstance(output_port, list), "Only a list output port can be rewound"
+        self.registers = dict(data_path.reg)
+        self.flags = data_path.alu.N, data_path.alu.Z, data_path.alu.OF
+        self.memory = dict(data_path.memory)
+        self.prev = data_path.prev
+        self.tick = control_unit.current_tick()
+        self.instr_counter = control_unit.instr_counter
+        self.mode = control_unit.mode
+        self.halted = control_unit.halted
+        self.command: Command | Commands = control_unit.command
+        self.input_consumed = input_port.consumed
+        self.output_length = len(output_port)
+
+    def restore(self, control_unit: ControlUnit, input_tokens: list[InputToken], output: list[str]) -> None:
+        # in place: compiled handlers keep the register and memory objects they were made with
+        data_path = control_unit.data_path
+        data_path.reg.update(self.registers)
+        data_path.alu.N, data_path.alu.Z, data_path.alu.OF = self.flags
+        data_path.memory.clear()
+        dict.update(data_path.memory, self.memory)
+        data_path.prev = self.prev
+        schedule = InputSchedule(itertools.islice(input_tokens, self.input_consumed, None))
+        schedule.consumed = self.input_consumed
+        data_path.ports[0] = schedule
+        output_port = data_path.ports[1]
+        assert isinstance(output_port, list)
+        # the output of the whole run starts with the output of every step
+        del output_port[self.output_length :]
+        output_port.extend(output[len(output_port) : self.output_length])
+        control_unit._tick = self.tick
+        control_unit.instr_counter = self.instr_counter
+        control_unit.mode = self.mode
+        control_unit.halted = self.halted
+        control_unit.command = self.command
+
+
+class TimeTravel:
+    # Runs a program once, keeping a MachineState every `interval` instructions, indexed by the instruction
+    # counter and the tick. Any step is then reached from the nearest earlier state, so a seek replays at most
+    # `interval` instructions, however long the run.
+    def __init__(
+        self,
+        data_memory,
+        code_memory,
+        input_tokens,
+        memory_size=MAX_MEMORY,
+        limit=DEFAULT_LIMIT,
+        start_addr=0,
+        engine="threaded",
+        interval=SEEK_INTERVAL,
+    ) -> None:
+        self.input_tokens = list(input_tokens)
+        self.interval = interval
+        self.output: list[str] = []
+        data_path = DataPath(
+            data_memory, memory_size, {0: InputSchedule(self.input_tokens), 1: self.output}, start_addr
+        )
+        self.control_unit = make_control_unit(engine, data_path, limit, code_memory, memory_size, TraceLevel.off)
+        self.states: list[MachineState] = []
+        self.counters: list[int] = []
+        self.ticks: list[int] = []
+        self.record()
+        # the output of the whole run, as written at its end
+        self.output = list(self.output)
+
+    def keep(self) -> None:
+        state = MachineState(self.control_unit)
+        self.states.append(state)
+        self.counters.append(state.instr_counter)
+        self.ticks.append(state.tick)
+
+    def record(self) -> None:
+        control_unit = self.control_unit
+        self.keep()
+        while not control_unit.finished():
+            control_unit.command_cycle(control_unit.instr_counter + self.interval)
+            self.keep()
+
+    @property
+    def end(self) -> int:
+        return self.counters[-1]
+
+    def position(self) -> tuple[int, int]:
+        return self.control_unit.instr_counter, self.control_unit.current_tick()
+
+    def seek(self, step: int) -> ControlUnit:
+        # the machine after `step` instructions; past the end of the run it stays at the end
+        step = max(0, min(step, self.end))
+        index = bisect.bisect_right(self.counters, step) - 1
+        self.states[index].restore(self.control_unit, self.input_tokens, self.output)
+        if self.control_unit.instr_counter < step:
+            self.control_unit.command_cycle(step)
+        return self.control_unit
+
+    def seek_tick(self, tick: int) -> ControlUnit:
+        # the machine after the last instruction that ended at or before `tick`
+        index = max(bisect.bisect_right(self.ticks, tick) - 1, 0)
+        if index == len(self.states) - 1:
+            return self.seek(self.end)
+        self.states[index].restore(self.control_unit, self.input_tokens, self.output)
+        control_unit = self.control_unit
+        while control_unit.instr_counter < self.counters[index + 1]:
+            step = control_unit.instr_counter
+            control_unit.command_cycle(step + 1)
+            if control_unit.current_tick() > tick:
+                return self.seek(step)
+        return control_unit
+
+    def step(self, count: int = 1) -> ControlUnit:
+        return self.seek(self.control_unit.instr_counter + count)
+
+    def back(self, count: int = 1) -> ControlUnit:
+        return self.seek(self.control_unit.instr_counter - count)
+
+
+def main(codes_file, datas_file, inputs_file, steps, limit=DEFAULT_LIMIT, engine="threaded", interval=SEEK_INTERVAL):
+    start_addr, code = read_code(codes_file)
+    _, data = read_code(datas_file)
+    travel = TimeTravel(data, code, read_input(inputs_file), MAX_MEMORY, limit, start_addr, engine, interval)
+    print("instructions:", travel.end, "states:", len(travel.states))
+    for step in steps:
+        control_unit = travel.seek(step)
+        print(control_unit, "| Output:", repr("".join(control_unit.data_path.ports[1])))
+        print("next:", control_unit.instructions[control_unit.data_path.reg[Registers.rip]])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the machine state after the given numbers of instructions")
+    parser.add_argument("code_file")
+    parser.add_argument("data_file")
+    parser.add_argument("input_file")
+    parser.add_argument("steps", type=int, nargs="+")
+    parser.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    parser.add_argument("--engine", default="threaded")
+    parser.add_argument("--interval", type=int, default=SEEK_INTERVAL, help="instructions between kept states")
+    args = parser.parse_args()
+    main(args.code_file, args.data_file, args.input_file, args.steps, args.limit, args.engine, args.interval)
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import logging
+from array import array
+from collections.abc import Iterable
+
+from isa import MAX_MEMORY, Command, Instruction, hex_to_data
+from machine import DEFAULT_LIMIT, InputToken, TraceLevel, parse_input, simulation
+from translator import TranslationCache, clean_line, translate_cached
+
+
+class RunResult:
+    def __init__(self, output: str, instr_counter: int, ticks: int, trace: list[str] | None = None):
+        self.output = output
+        self.instr_counter = instr_counter
+        self.ticks = ticks
+        # the messages the machine logged, when the run was traced
+        self.trace = trace
+
+    def __repr__(self) -> str:
+        return f"RunResult(output={self.output!r}, instr_counter={self.instr_counter}, ticks={self.ticks})"
+
+
+class TraceCollector(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__(logging.INFO)
+        self.lines: list[str] = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.lines.append(record.getMessage())
+
+
+def trace_logger() -> tuple[logging.Logger, list[str]]:
+    # a logger of one run, outside the logger hierarchy: the root logger, its level and its handlers stay as they
+    # are, and runs on other threads keep their own lines
+    logger = logging.Logger("toolchain.trace", logging.INFO)
+    logger.propagate = False
+    collector = TraceCollector()
+    logger.addHandler(collector)
+    return logger, collector.lines
+
+
+class Program:
+    # A translated program kept in memory: the words are decoded once and every run starts from them.
+    def __init__(self, data: list[Instruction], code: list[Instruction], source_lines: int = 0, start_addr: int = 0):
+        self.data = data
+        self.code = code
+        self.source_lines = source_lines
+        self.start_addr = start_addr
+        self.data_words = [format(instruction.word, "020x") for instruction in data]
+        self.code_words = [format(instruction.word, "020x") for instruction in code]
+        self.memory = array("q", map(hex_to_data, self.data_words))
+        self.commands = [Command(word) for word in self.code_words]
+
+    @classmethod
+    def translate(
+        cls, text: str, data: str = "", optimize: bool = False, cache: TranslationCache | None = None
+    ) -> Program:
+        # text and data are the two source files of translator.py, data may also be a section of text
+        source = data + "\n" + text
+        data_words, code_words = translate_cached(source, cache, optimize)
+        source_lines = sum(1 for line in source.splitlines() if clean_line(line))
+        return cls(data_words, code_words, source_lines)
+
+    def code_listing(self) -> str:
+        # the target text file of translator.py
+        return "".join(f"{instruction}\n" for instruction in self.code)
+
+    def data_listing(self) -> str:
+        return "".join(f"{instruction}\n" for instruction in self.data)
+
+    def run(
+        self,
+        input_tokens: Iterable[InputToken] | str = (),
+        limit=DEFAULT_LIMIT,
+        memory_size=MAX_MEMORY,
+        engine="reference",
+        trace=TraceLevel.off,
+        **options,
+    ) -> RunResult:
+        # input_tokens is a schedule or the text of an input file; options go to simulation
+        if isinstance(input_tokens, str):
+            input_tokens = parse_input(input_tokens)
+        run = (
+            self.memory,
+            self.commands,
+            input_tokens,
+            memory_size,
+            limit,
+            self.start_addr,
+        )
+        if trace == TraceLevel.off:
+            return RunResult(*simulation(*run, engine=engine, trace=trace, **options))
+        logger, lines = trace_logger()
+        output, instr_counter, ticks = simulation(*run, engine=engine, trace=trace, logger=logger, **options)
+        return RunResult(output, instr_counter, ticks, lines)
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import argparse
+import contextlib
+import sys
+from collections.abc import Iterator
+from typing import Final
+
+from isa import registers
+from machine import (
+    TRACE_COMMAND,
+    TRACE_END,
+    TRACE_EOF,
+    TRACE_EVENT,
+    TRACE_FLAGS,
+    TRACE_INPUT,
+    TRACE_LIMIT,
+    TRACE_MAGIC,
+    TRACE_MEMORY,
+    TRACE_OUTPUT,
+    TRACE_STATE,
+    TRACE_VERSION,
+    format_flags,
+    format_state,
+)
+
+# the log format of the golden tests (pyproject.toml)
+LOG_FORMAT: Final = "%(levelname)-7s %(module)s:%(funcName)-13s %(message)s"
+WARNINGS: Final = {TRACE_EOF: "Input buffer is empty!", TRACE_LIMIT: "Limit exceeded!"}
+
+
+def log_line(levelname: str, func_name: str, message: str) -> str:
+    return LOG_FORMAT % {"levelname": levelname, "module": "machine", "funcName": func_name, "message": message}
+
+
+def shown(char: str) -> str:
+    return char if char != "\n" else "\\n"
+
+
+class TraceReader:
+    def __init__(self, data: bytes):
+        if data[: len(TRACE_MAGIC)] != TRACE_MAGIC:
+            raise ValueError(data[: len(TRACE_MAGIC)])
+        self.data = data
+        self.position = len(TRACE_MAGIC)
+        version = self.varint()
+        if version != TRACE_VERSION:
+            raise ValueError(version)
+
+    def varint(self) -> int:
+        data, position = self.data, self.position
+        value = shift = 0
+        while True:
+            byte = data[position]
+            position += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        self.position = position
+        return value >> 1 if not value & 1 else -(value + 1 >> 1)
+
+    def byte(self) -> int:
+        self.position += 1
+        return self.data[self.position - 1]
+
+    def text(self) -> str:
+        length = self.varint()
+        self.position += length
+        return self.data[self.position - length : self.position].decode("utf-8")
+
+    def done(self) -> bool:
+        return self.position >= len(self.data)
+
+
+class TraceState:
+    def __init__(self) -> None:
+        self.commands: list[str] = []
+        self.values = [0] * len(registers)
+        self.flags = 0
+        self.tick = 0
+        self.outputs: dict[int, list[str]] = {}
+        # data memory words written so far
+        self.memory: dict[int, int] = {}
+
+    def read_state(self, reader: TraceReader) -> str:
+        command = self.commands[reader.varint()]
+        self.tick += reader.varint()
+        mask = reader.byte()
+        for index in range(len(registers)):
+            if mask >> index & 1:
+                self.values[index] += reader.varint()
+        if mask & TRACE_FLAGS:
+            self.flags = reader.byte()
+        mode = "TRAP:" if self.flags & 8 else ""
+        flags = format_flags(self.flags & 1, self.flags >> 1 & 1, self.flags >> 2 & 1)
+        return format_state(mode, self.tick, dict(zip(registers, self.values)), flags, command)
+
+    def read_output(self, reader: TraceReader) -> str:
+        port_listed, char = reader.varint(), reader.text()
+        port, listed = port_listed >> 1, port_listed & 1
+        written = self.outputs.setdefault(port, [])
+        message = f"OUTPUT: {written if listed else f'port {port}'} <- {shown(char)}"
+        written.append(char)
+        return message
+
+
+# The log lines a full trace of the recorded run writes, in the format of the golden tests. The state is left as
+# at the end of the trace, with the memory writes.
+def render(data: bytes, state: TraceState | None = None) -> Iterator[str]:
+    reader = TraceReader(data)
+    state = state or TraceState()
+    while not reader.done():
+        tag = reader.byte()
+        if tag == TRACE_STATE:
+            yield log_line("INFO", "command_cycle", state.read_state(reader))
+        elif tag == TRACE_COMMAND:
+            state.commands.append(reader.text())
+        elif tag == TRACE_MEMORY:
+            addr = reader.varint()
+            state.memory[addr] = reader.varint()
+        elif tag == TRACE_INPUT:
+            yield log_line("INFO", "rd_port", f"INPUT: {shown(reader.text())}")
+        elif tag == TRACE_OUTPUT:
+            yield log_line("INFO", "wr_port", state.read_output(reader))
+        elif tag == TRACE_EVENT:
+            yield log_line("WARNING", "command_cycle", WARNINGS[reader.varint()])
+        elif tag == TRACE_END:
+            yield log_line("INFO", "simulation", f"output_buffer: {reader.text()!r}")
+        else:
+            raise ValueError(tag)
+
+
+def main(trace_file, output_file=None) -> None:
+    with open(trace_file, "rb") as file:
+        data = file.read()
+    with open(output_file, "w", encoding="utf-8") if output_file else contextlib.nullcontext(sys.stdout) as output:
+        for line in render(data):
+            output.write(line + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a binary trace of machine.py --record as the text log")
+    parser.add_argument("trace_file")
+    parser.add_argument("--output", help="write the log to this file instead of stdout")
+    args = parser.parse_args()
+    main(args.trace_file, args.output)
@@ -1,14 +1,24 @@
 from __future__ import annotations
 
+import argparse
+import hashlib
+import os
 import re
-import sys
+import tempfile
+from collections import OrderedDict
+from collections.abc import Callable
+from pathlib import Path
+from typing import Final
 
 from isa import (
     SECTION_DATA,
     SECTION_TEXT,
+    WORD_MASK,
     Commands,
     Instruction,
     Registers,
+    alu_commands,
+    branch_commands,
     get_data_line,
     int_to_binary,
     is_integer,
@@ -16,8 +26,39 @@ from isa import (
     op_commands,
     registers,
     write_code,
+    write_object,
 )
 
+# bump whenever the generated code changes so that stale cache entries are never reused
+TRANSLATOR_VERSION: Final = "2"
+MEMO_SIZE: Final = 128
+CACHE_SIZE: Final = 64 << 20
+
+OPCODES: dict[str, int] = {str(command): index for index, command in enumerate(op_commands)}
+REGISTER_CODES: dict[str, int] = {str(register): index for index, register in enumerate(registers)}
+
+# encoded operand field (addressing type and value, None for a label), operand text in the listing
+Operand = tuple[int | None, str]
+# instruction kept by an optimizing assembler until its labels are resolved: opcode, operands, source line
+Symbolic = tuple[str, list[Operand], int]
+
+BRANCHES: Final = frozenset(str(command) for command in branch_commands)
+INVERTED_BRANCHES: Final = {"jz": "jnz", "jnz": "jz", "jn": "jp", "jp": "jn"}
+# control never falls through to the next instruction
+STOPS: Final = frozenset({"jmp", "hlt", "iret"})
+ALU_OPS: Final = frozenset(str(command) for command in alu_commands)
+WRITES_FIRST_OPERAND: Final = (ALU_OPS - {"cmp"}) | {"mov", "movi"}
+# operand field of #INT, the word holding the interrupt handler address
+INT_VECTOR: Final = 2 << 32 | 1
+
+
+def is_number(word: str) -> bool:
+    return (word[1:] if word.startswith("-") else word).isdecimal()
+
+
+def is_quoted(word: str) -> bool:
+    return len(word) >= 2 and word[0] == word[-1] and word[0] in "'\""
+
 
 def remove_comment(line: str) -> str:
     return re.sub(r";.*", "", line)
@@ -39,7 +80,13 @@ def clean_text(asm_text: str) -> str:
     return cleaned_text
 
 
-def parse_data_line(line: str, variable: dict[str, int]) -> tuple[str, list[int]]:
+def parse_data_line(
+    line: str,
+    variable: dict[str, int],
+    is_int: Callable[[str], bool] = is_integer,
+    is_str: Callable[[str], bool] = is_string,
+) -> tuple[str, list[int]]:
+    # translate keeps the regex checks of isa, the Assembler passes its own is_number and is_quoted
     key, value = map(str.strip, line.split(":", 1))
 
     constant_mem: list[int]
@@ -51,9 +98,9 @@ def parse_data_line(line: str, variable: dict[str, int]) -> tuple[str, list[int]
             constant_mem = [0 for _ in range(int(param[1]))]
         else:
             raise ValueError(value)
-    elif is_integer(value):
+    elif is_int(value):
         constant_mem = [int(value)]
-    elif is_string(value):
+    elif is_str(value):
         string: str = value[1:-1]
         constant_mem = [ord(char) for char in string] + [0]
     else:
@@ -169,6 +216,334 @@ def parse_text_section(variable: dict[str, int], code: str, cur: int):
     return address_line(lines, labels, variable)
 
 
+def clean_line(line: str) -> str:
+    return " ".join(line.split(";", 1)[0].split())
+
+
+def operand_field(arg_type: int, value: int) -> int:
+    return arg_type << 32 | value & WORD_MASK
+
+
+def assemble_operand(word: str, variable: dict[str, int]) -> Operand:
+    if is_number(word):
+        return operand_field(0, int(word)), word
+    prefix = word[0]
+    if prefix == "%":
+        if word[1:] not in REGISTER_CODES:
+            raise ValueError(word)
+        return operand_field(1, REGISTER_CODES[word[1:]]), word
+    if prefix == "!":
+        return operand_field(3, int(word[1:])), word
+    if prefix == "#":
+        addr = variable[word[1:]]
+        return operand_field(2, addr), f"#{addr}"
+    if prefix == ".":
+        return None, word
+    if prefix == "*":
+        addr = variable[word[1:]]
+        return operand_field(4, addr), f"*{addr}"
+    name, offset = word.split("[")
+    addr = variable[name] + int(offset[:-1])
+    return operand_field(2, addr), f"#{addr}"
+
+
+def encode_instruction(
+    address: int, op: str, operands: list[Operand], labels: dict[str, int] | None
+) -> Instruction | None:
+    word = OPCODES[op]
+    mnemonic = op
+    for field, text in operands:
+        if field is None:
+            if labels is None:
+                return None
+            field = operand_field(0, labels[text])
+            text = str(labels[text])
+        word = word << 36 | field
+        mnemonic += " " + text
+    word <<= 36 * (2 - len(operands))
+    return Instruction.from_word(address, word, mnemonic)
+
+
+def operand_kind(operand: Operand) -> int | None:
+    return None if operand[0] is None else operand[0] >> 32
+
+
+def operand_key(operand: Operand) -> int | str:
+    return operand[1] if operand[0] is None else operand[0]
+
+
+def register_operand(name: str) -> Operand:
+    return operand_field(1, REGISTER_CODES[name]), f"%{name}"
+
+
+def can_optimize(program: list[Symbolic]) -> bool:
+    # code addresses must only be taken through labels, otherwise moving instructions breaks the program
+    rip = register_operand("rip")[0]
+    for op, operands, _ in program:
+        if any(field == rip for field, _ in operands):
+            return False
+        if op in BRANCHES and operands[0][0] is not None:
+            return False
+        if op == "mov" and operands[0][0] == INT_VECTOR and operands[1][0] is not None:
+            return False
+    return True
+
+
+def successors(program: list[Symbolic], labels: dict[str, int], index: int) -> list[int]:
+    op, operands, _ = program[index]
+    targets = [labels[operands[0][1]]] if op in BRANCHES else []
+    return targets if op in STOPS else [*targets, index + 1]
+
+
+class Volatile:
+    # Locations an interrupt handler may change between any two instructions of the interrupted code. Handlers
+    # start at labels stored to #INT (or at 0 when the vector is never set); rax is restored by iret.
+    def __init__(self, program: list[Symbolic], labels: dict[str, int]):
+        # operand fields of the registers and words written by handlers
+        self.fields: set[int | None] = set()
+        self.any_memory = False
+        if not any(op in ("ei", "iret") or self.writes_rst(op, operands) for op, operands, _ in program):
+            return
+
+        entries = [labels[operands[1][1]] for op, operands, _ in program if self.sets_vector(op, operands)]
+        pending, seen = entries or [0], set()
+        while pending:
+            index = pending.pop()
+            if index in seen or index >= len(program):
+                continue
+            seen.add(index)
+            op, operands, _ = program[index]
+            if op in WRITES_FIRST_OPERAND:
+                self.add(operands[0])
+            pending.extend(successors(program, labels, index))
+        self.fields.discard(register_operand("rax")[0])
+
+    @staticmethod
+    def writes_rst(op: str, operands: list[Operand]) -> bool:
+        return op in WRITES_FIRST_OPERAND and operands[0][0] == register_operand("rst")[0]
+
+    @staticmethod
+    def sets_vector(op: str, operands: list[Operand]) -> bool:
+        return op == "mov" and operands[0][0] == INT_VECTOR
+
+    def add(self, operand: Operand) -> None:
+        if operand_kind(operand) == 4:
+            self.any_memory = True
+        else:
+            self.fields.add(operand[0])
+
+    def __contains__(self, operand: Operand) -> bool:
+        kind = operand_kind(operand)
+        if kind == 1:
+            return operand[0] in self.fields
+        if kind == 2:
+            return self.any_memory or operand[0] in self.fields
+        if kind == 4:
+            return self.any_memory or any(operand_kind((field, "")) == 2 for field in self.fields)
+        return False
+
+
+def sets_flags(instruction: Symbolic) -> bool:
+    # every instruction but a branch leaves the flags it does not set alone, and only branches read them
+    op, operands, _ = instruction
+    return op in ALU_OPS or (op == "mov" and operand_kind(operands[0]) == 1)
+
+
+def redundant_move(first: Symbolic, second: Symbolic, volatile: Volatile) -> bool:
+    # `mov A B` repeated, or followed by `mov B A`, changes nothing when A and B are plain registers or words
+    (op, operands, _), (next_op, next_operands, _) = first, second
+    if op != next_op or any(operand in volatile for operand in operands + next_operands):
+        return False
+    if op == "cmp":
+        return list(map(operand_key, operands)) == list(map(operand_key, next_operands))
+    if op != "mov":
+        return False
+    target, source = operands
+    if operand_key(target) == operand_key(source) or target[0] == register_operand("rst")[0]:
+        return False
+    if operand_kind(target) not in (1, 2) or operand_kind(source) not in (0, 1, 2):
+        return False
+    keys = list(map(operand_key, next_operands))
+    if keys == [operand_key(target), operand_key(source)]:
+        return True
+    # reversed only between two registers or two words: a reload into a register sets the flags, which the store
+    # before it did not, and a number is a value as a source but a store address as a target
+    return keys == [operand_key(source), operand_key(target)] and operand_kind(target) == operand_kind(source)
+
+
+def thread_jumps(program: list[Symbolic], labels: dict[str, int]) -> bool:
+    changed = False
+    for index, (op, operands, line) in enumerate(program):
+        if op not in BRANCHES:
+            continue
+        target, seen = operands[0][1], set()
+        while labels[target] < len(program) and program[labels[target]][0] == "jmp":
+            seen.add(labels[target])
+            following = program[labels[target]][1][0][1]
+            if labels[following] in seen:
+                break
+            target = following
+        else:
+            if target != operands[0][1]:
+                program[index] = (op, [(None, target)], line)
+                changed = True
+    return changed
+
+
+def invert_branches(program: list[Symbolic], labels: dict[str, int], entries: set[int]) -> set[int]:
+    # `jz .a / jmp .b / .a:` is `jnz .b / .a:`
+    removed: set[int] = set()
+    for index in range(len(program) - 1):
+        (op, operands, line), (next_op, next_operands, _) = program[index], program[index + 1]
+        if op in INVERTED_BRANCHES and next_op == "jmp" and index + 1 not in entries | removed:
+            if labels[operands[0][1]] == index + 2:
+                program[index] = (INVERTED_BRANCHES[op], next_operands, line)
+                removed.add(index + 1)
+    return removed
+
+
+def dead_instructions(program: list[Symbolic], labels: dict[str, int], entries: set[int]) -> set[int]:
+    volatile = Volatile(program, labels)
+    removed, kept = set(), set()
+    reachable, previous = True, None
+    for index, instruction in enumerate(program):
+        op, operands, _ = instruction
+        reachable = reachable or index in entries
+        if not reachable:
+            removed.add(index)
+        elif index in kept:
+            pass
+        elif op in BRANCHES and labels[operands[0][1]] == index + 1:
+            removed.add(index)
+        elif index not in entries and previous is not None and redundant_move(previous, instruction, volatile):
+            removed.add(index)
+        elif op == "cmp" and index + 1 < len(program) and sets_flags(program[index + 1]):
+            removed.add(index)
+            kept.add(index + 1)
+        if index not in removed:
+            previous = instruction
+        reachable = reachable and op not in STOPS
+    return removed
+
+
+def compact(program: list[Symbolic], labels: dict[str, int], removed: set[int]) -> list[Symbolic]:
+    addresses, address = [], 0
+    for index in range(len(program) + 1):
+        addresses.append(address)
+        address += index not in removed
+    for name, index in labels.items():
+        labels[name] = addresses[index]
+    return [instruction for index, instruction in enumerate(program) if index not in removed]
+
+
+def peephole(program: list[Symbolic], labels: dict[str, int]) -> list[Symbolic]:
+    # Jump threading, branch inversion, removal of unreachable code, jumps to the next instruction and redundant
+    # moves and compares, repeated until nothing changes. Labels are moved to the new addresses in place.
+    if not can_optimize(program):
+        return program
+    program = list(program)
+    while True:
+        entries = {0} | {labels[text] for _, operands, _ in program for field, text in operands if field is None}
+        threaded = thread_jumps(program, labels)
+        removed = invert_branches(program, labels, entries) or dead_instructions(program, labels, entries)
+        if not threaded and not removed:
+            return program
+        program = compact(program, labels, removed)
+
+
+class Assembler:
+    # Labels may be used before they are defined: such instructions are encoded once the whole source is read.
+    def __init__(self, optimize: bool = False) -> None:
+        self.variable: dict[str, int] = {"JMPS": 0, "INT": 1}
+        self.memory: list[int] = [0, 0]
+        self.labels: dict[str, int] = {}
+        self.code: list[Instruction | None] = []
+        # source line number of every code word, for profiles and debuggers
+        self.lines: list[int] = []
+        self.line = 0
+        # with optimize the code is kept symbolic until the peephole pass has run
+        self.optimize = optimize
+        self.program: list[Symbolic] = []
+        self.fixups: list[tuple[int, str, list[Operand]]] = []
+        self.operands: dict[str, Operand] = {}
+
+    def data_line(self, line: str) -> None:
+        key, constant_mem = parse_data_line(line, self.variable, is_number, is_quoted)
+        if key in self.variable:
+            raise KeyError(key)
+        self.variable[key] = len(self.memory)
+        self.memory.extend(constant_mem)
+
+    def text_line(self, words: list[str]) -> None:
+        if words[0][0] == ".":
+            name, line = map(str.strip, " ".join(words).split(":", 1))
+            self.labels[name] = len(self.lines)
+            words = line.split(" ")
+        op = words[0]
+        if op not in OPCODES:
+            raise ValueError(op)
+
+        operands = []
+        for word in words[1:]:
+            operand = self.operands.get(word)
+            if operand is None:
+                operand = self.operands[word] = assemble_operand(word, self.variable)
+            operands.append(operand)
+
+        if len(operands) <= 2:
+            self.emit(op, operands)
+        else:
+            for operand in operands[1:]:
+                self.emit(op, [operands[0], operand])
+
+    def emit(self, op: str, operands: list[Operand]) -> None:
+        if self.optimize:
+            self.program.append((op, operands, self.line))
+            self.lines.append(self.line)
+            return
+        address = len(self.code)
+        instruction = encode_instruction(address, op, operands, None)
+        if instruction is None:
+            self.fixups.append((address, op, operands))
+        self.code.append(instruction)
+        self.lines.append(self.line)
+
+    def finish(self) -> tuple[list[Instruction], list[Instruction]]:
+        memory = self.memory
+        memory[0] = len(memory)
+        data = [Instruction.from_word(addr, (value & WORD_MASK) << 36, str(value)) for addr, value in enumerate(memory)]
+        if self.optimize:
+            program = peephole(self.program, self.labels)
+            self.lines = [line for _, _, line in program]
+            self.fixups = [(address, op, operands) for address, (op, operands, _) in enumerate(program)]
+            self.code = [None] * len(program)
+        for address, op, operands in self.fixups:
+            self.code[address] = encode_instruction(address, op, operands, self.labels)
+        return data, [instruction for instruction in self.code if instruction is not None]
+
+
+def read_source(source: str, optimize: bool = False) -> Assembler:
+    assembler = Assembler(optimize)
+    section = None
+    for number, line in enumerate(source.splitlines(), 1):
+        words = line.split(";", 1)[0].split()
+        if len(words) == 2 and " ".join(words) in (SECTION_DATA, SECTION_TEXT):
+            section = " ".join(words)
+        elif not words or section is None:
+            continue
+        elif section == SECTION_DATA:
+            assembler.data_line(" ".join(words))
+        else:
+            assembler.line = number
+            assembler.text_line(words)
+
+    return assembler
+
+
+def assemble(source: str, optimize: bool = False) -> tuple[list[Instruction], list[Instruction]]:
+    return read_source(source, optimize).finish()
+
+
 def translate(code: str):
     text_index: int = code.find(SECTION_TEXT)
     data_index: int = code.find(SECTION_DATA)
@@ -179,23 +554,142 @@ def translate(code: str):
     return generate_binary(text_code, memory)
 
 
-def main(source_text_file, source_data_file, target_text_file, target_data_file):
+def clean_source(source: str) -> str:
+    return "\n".join(filter(None, map(clean_line, source.splitlines())))
+
+
+def source_key(cleaned_source: str, optimize: bool = False) -> str:
+    version = f"{TRANSLATOR_VERSION} optimize" if optimize else TRANSLATOR_VERSION
+    return hashlib.sha256(f"{version}\n{cleaned_source}".encode()).hexdigest()
+
+
+def format_listing(data: list[Instruction], code: list[Instruction]) -> str:
+    lines = [f"{len(data)} {len(code)}", *map(str, data), *map(str, code)]
+    return "\n".join(lines) + "\n"
+
+
+def parse_listing(listing: str) -> tuple[list[Instruction], list[Instruction]]:
+    header, *lines = listing.splitlines()
+    data_size, code_size = map(int, header.split(" "))
+    if len(lines) != data_size + code_size:
+        raise ValueError(header)
+
+    instructions = []
+    for line in lines:
+        address, word, mnemonic = line.split(" ", 2)
+        instructions.append(Instruction.from_word(int(address), int(word, 16), mnemonic))
+    return instructions[:data_size], instructions[data_size:]
+
+
+class TranslationCache:
+    # One listing file per source hash; file mtimes order the entries for LRU eviction.
+    def __init__(self, directory: str, max_bytes: int = CACHE_SIZE):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str) -> Path:
+        return self.directory / f"{key}.lst"
+
+    def get(self, key: str) -> tuple[list[Instruction], list[Instruction]] | None:
+        path = self.path(key)
+        try:
+            listing = path.read_text(encoding="utf-8")
+            path.touch()
+            return parse_listing(listing)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key: str, data: list[Instruction], code: list[Instruction]) -> None:
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(format_listing(data, code))
+        Path(tmp_name).replace(self.path(key))
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.directory.glob("*.lst"):
+            stat = path.stat()
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink()
+            total -= size
+
+
+memo: OrderedDict[str, tuple[list[Instruction], list[Instruction]]] = OrderedDict()
+
+
+def translate_cached(
+    source: str, cache: TranslationCache | None = None, optimize: bool = False
+) -> tuple[list[Instruction], list[Instruction]]:
+    cleaned = clean_source(source)
+    key = source_key(cleaned, optimize)
+    if key in memo:
+        memo.move_to_end(key)
+        data, code = memo[key]
+        return list(data), list(code)
+
+    result = cache.get(key) if cache is not None else None
+    if result is None:
+        result = assemble(cleaned, optimize)
+        if cache is not None:
+            cache.put(key, *result)
+
+    memo[key] = result
+    if len(memo) > MEMO_SIZE:
+        memo.popitem(last=False)
+    return list(result[0]), list(result[1])
+
+
+def main(
+    source_text_file,
+    source_data_file,
+    target_text_file,
+    target_data_file,
+    target_object_file=None,
+    cache_dir=None,
+    optimize=False,
+):
     with open(source_data_file, encoding="utf-8") as f:
         source_file = f.read()
     with open(source_text_file, encoding="utf-8") as f:
         source_file += "\n" + f.read()
 
-    source_file = clean_text(source_file)
-    data, text = translate(source_file)
+    cache = TranslationCache(cache_dir) if cache_dir is not None else None
+    data, text = translate_cached(source_file, cache, optimize)
+    source_lines = sum(1 for line in source_file.splitlines() if clean_line(line))
 
     write_code(data, target_data_file)
     write_code(text, target_text_file)
-    print("source LoC:", len(source_file.split("\n")), "code instr:", len(text))
+    if target_object_file is not None:
+        write_object(text, data, target_object_file)
+    print("source LoC:", source_lines, "code instr:", len(text))
+    if optimize:
+        _, unoptimized = translate_cached(source_file, cache)
+        print("peephole removed:", len(unoptimized) - len(text), "of", len(unoptimized), "code instr")
 
 
 if __name__ == "__main__":
-    assert (
-        len(sys.argv) == 5
-    ), "Wrong arguments: translator.py <input_text_file> <input_data_file> <target_text_file> <target_data_file>"
-    _, source_text, source_data, target_text, target_data = sys.argv
-    main(source_text, source_data, target_text, target_data)
+    parser = argparse.ArgumentParser(description="Translate an assembly program into machine code")
+    parser.add_argument("input_text_file")
+    parser.add_argument("input_data_file")
+    parser.add_argument("target_text_file")
+    parser.add_argument("target_data_file")
+    parser.add_argument("target_object_file", nargs="?")
+    parser.add_argument("--cache-dir", help="reuse translations of unchanged sources stored in this directory")
+    parser.add_argument("-O", "--optimize", action="store_true", help="run the peephole pass")
+    args = parser.parse_args()
+    main(
+        args.input_text_file,
+        args.input_data_file,
+        args.target_text_file,
+        args.target_data_file,
+        args.target_object_file,
+        args.cache_dir,
+        args.optimize,
+    )